@@ -5,7 +5,6 @@ Soporte para Telegram, SMTP y notificaciones web
 """
 
 import json
-import sqlite3
 import smtplib
 import requests
 import time
@@ -14,17 +13,19 @@ import subprocess
 import os
 import signal  # ← FALTANTE - AGREGAR ESTA LÍNEA
 from datetime import datetime, timedelta
-from email.mime.text import MimeText
-from email.mime.multipart import MimeMultipart
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
 from typing import Dict, List, Optional
 import threading
 import queue
+from bytefense_storage import open_storage, utc_now, INTEL_DB, SYSTEM_DB, HONEYPOT_EVENT_TYPES
 
 class AlertManager:
     def __init__(self, config_file='/opt/bytefense/system/alerts.json'):
         self.config_file = config_file
         self.config = self.load_config()
-        self.db_path = '/opt/bytefense/intel/threats.db'
+        self.db_path = INTEL_DB
+        self.storage = open_storage(self.db_path)
         self.alert_queue = queue.Queue()
         self.running = True
         
@@ -79,8 +80,7 @@ class AlertManager:
                     "services": ["bytefense-dashboard", "bytefense-watch"]
                 },
                 "node_disconnected": {
-                    "enabled": True,
-                    "timeout": 600
+                    "enabled": True
                 },
                 "high_traffic": {
                     "enabled": True,
@@ -220,12 +220,12 @@ class AlertManager:
             if not smtp_config['username'] or not smtp_config['to_emails']:
                 return
             
-            msg = MimeMultipart()
+            msg = MIMEMultipart()
             msg['From'] = smtp_config['from_email'] or smtp_config['username']
             msg['Subject'] = f"Bytefense Alert: {alert['type']} ({alert['severity']})"
             
             plain_message = message.replace('**', '').replace('*', '')
-            msg.attach(MimeText(plain_message, 'plain'))
+            msg.attach(MIMEText(plain_message, 'plain'))
             
             server = smtplib.SMTP(smtp_config['server'], smtp_config['port'])
             server.starttls()
@@ -269,27 +269,13 @@ class AlertManager:
     
     def _store_alert(self, alert: Dict):
         try:
-            import os
-            if not os.path.exists(self.db_path):  # ← AGREGAR validación
-                self.logger.error(f"Base de datos no encontrada: {self.db_path}")
-                return
-                
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                INSERT INTO events (event_type, source_ip, details, timestamp, severity)
-                VALUES (?, ?, ?, ?, ?)
-            """, (
+            self.storage.submit_event(
                 f"alert_{alert['type']}",
-                alert['data'].get('source_ip', 'system'),
                 json.dumps(alert),
-                alert['timestamp'],
-                alert['severity']
-            ))
-            
-            conn.commit()
-            conn.close()
+                alert['data'].get('source_ip', 'system'),
+                severity=alert['severity'],
+                date=datetime.fromisoformat(alert['timestamp'])
+            )
             
         except Exception as e:
             self.logger.error(f"Error almacenando alerta: {e}")
@@ -299,7 +285,11 @@ class AlertMonitor:
     
     def __init__(self, alert_manager: AlertManager):
         self.alert_manager = alert_manager
-        self.db_path = '/opt/bytefense/intel/threats.db'
+        self.db_path = INTEL_DB
+        self.storage = alert_manager.storage
+        # Los nodos se registran y envían heartbeats a la API (bytefense.db)
+        self.nodes = open_storage(SYSTEM_DB)
+        self.last_node_change = None  # último id de node_status_log revisado
         self.last_checks = {}
         
     def start_monitoring(self):
@@ -322,18 +312,8 @@ class AlertMonitor:
             return
         
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
             # Contar IPs bloqueadas en el último intervalo
-            since = datetime.now() - timedelta(seconds=config['interval'])
-            cursor.execute("""
-                SELECT COUNT(*) FROM blocked_ips 
-                WHERE created_at > ?
-            """, (since.isoformat(),))
-            
-            count = cursor.fetchone()[0]
-            conn.close()
+            count = self.storage.count_blocked_ips(utc_now(time.time() - config['interval']))
             
             if count >= config['threshold']:
                 self.alert_manager.send_alert(
@@ -382,12 +362,12 @@ class AlertMonitor:
                             self.alert_manager.config['last_alerts'][last_alert_key] = time.time()
                             self.alert_manager.save_config(self.alert_manager.config)
                             
-                    except subprocess.TimeoutExpired:
-                        logging.error(f"Timeout verificando servicio {service}")
-                    except Exception as e:
-                        logging.error(f"Error verificando servicio {service}: {e}")
+                except subprocess.TimeoutExpired:
+                    logging.error(f"Timeout verificando servicio {service}")
                 except Exception as e:
-                    logging.error(f"Error general verificando servicios: {e}")
+                    logging.error(f"Error verificando servicio {service}: {e}")
+        except Exception as e:
+            logging.error(f"Error general verificando servicios: {e}")
     
     def check_nodes(self):
         """Verificar nodos conectados"""
@@ -396,24 +376,15 @@ class AlertMonitor:
             return
         
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Buscar nodos que no han enviado heartbeat recientemente
-            timeout = datetime.now() - timedelta(seconds=config['timeout'])
-            cursor.execute("""
-                SELECT node_id, node_name, last_seen 
-                FROM registered_nodes 
-                WHERE last_seen < ? AND status = 'online'
-            """, (timeout.isoformat(),))
-            
-            disconnected_nodes = cursor.fetchall()
-            conn.close()
+            # La API marca los nodos offline; aquí sólo se avisa de los cambios
+            # que registra en node_status_log desde la última comprobación
+            if self.last_node_change is None:
+                self.last_node_change = self.nodes.last_node_status_change()
+                return
             
-            for node_id, node_name, last_seen in disconnected_nodes:
-                # Marcar como offline
-                self._update_node_status(node_id, 'offline')
-                
+            for change_id, node_id, node_name, last_seen in \
+                    self.nodes.node_status_changes(self.last_node_change, 'offline'):
+                self.last_node_change = change_id
                 self.alert_manager.send_alert(
                     'node_disconnected',
                     f"El nodo {node_name} ({node_id}) se ha desconectado",
@@ -435,18 +406,9 @@ class AlertMonitor:
             return
         
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Contar eventos de honeypot en la última hora
-            since = datetime.now() - timedelta(hours=1)
-            cursor.execute("""
-                SELECT COUNT(*) FROM events 
-                WHERE event_type LIKE 'honeypot_%' AND timestamp > ?
-            """, (since.isoformat(),))
-            
-            count = cursor.fetchone()[0]
-            conn.close()
+            # Contar eventos de honeypot en la última hora (sus tipos no llevan prefijo 'honeypot_')
+            count = self.storage.count_events(utc_now(time.time() - 3600),
+                                              event_types=HONEYPOT_EVENT_TYPES)
             
             if count >= config['threshold']:
                 self.alert_manager.send_alert(
@@ -458,20 +420,6 @@ class AlertMonitor:
                 
         except Exception as e:
             logging.error(f"Error verificando honeypot: {e}")
-    
-    def _update_node_status(self, node_id: str, status: str):
-        """Actualizar estado de nodo"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE registered_nodes SET status = ? WHERE node_id = ?",
-                (status, node_id)
-            )
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            logging.error(f"Error actualizando estado de nodo: {e}")
 
 def main():
     """Función principal"""
@@ -2,7 +2,9 @@
 # API endpoints para SpeedTest
 
 from flask import Flask, jsonify, request
+import os
 from bytefense_speedtest import BytefenseSpeedTest
+from bytefense_prefork import serve_wsgi_app, worker_count
 
 app = Flask(__name__)
 speedtest = BytefenseSpeedTest()
@@ -31,4 +33,5 @@ def manage_config():
         return jsonify({'success': True})
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8082, debug=False)
\ No newline at end of file
+    # BYTEFENSE_API_PROCESSES > 1 arranca varios procesos con SO_REUSEPORT
+    serve_wsgi_app(app, '0.0.0.0', 8082, worker_count(os.environ.get('BYTEFENSE_API_PROCESSES', 1)))
\ No newline at end of file
@@ -6,43 +6,765 @@ Bytefense OS - API REST para gestión de nodos y datos de dashboard
 
 import json
 import sqlite3
+import hashlib
+import base64
+import gzip
+import zlib
+import mimetypes
+import stat
 import datetime
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import urlparse, parse_qs, unquote
 import threading
+import queue
 import time
+import heapq
+import socket
+import collections
+import calendar
 import os
 import random
 
-DB_PATH = "/opt/bytefense/system/bytefense.db"
-API_PORT = 8080
+from bytefense_prefork import PreforkSupervisor, worker_count
+from bytefense_metrics import (metrics, instrumented, clear_dumps, MetricsHandlerMixin,
+                               PROMETHEUS_CONTENT_TYPE)
+from bytefense_schema import migrate, rebuild_rollups
+from bytefense_storage import ConnectionPool, utc_now, SYSTEM_DB
+from bytefense_hot import hot_client
+from bytefense_events import (events_source, events_after_source, max_event_id,
+                              maintenance_loop as events_maintenance_loop)
+try:
+    import brotli  # Opcional: Content-Encoding br
+except ImportError:
+    brotli = None
 
-class BytefenseAPIHandler(BaseHTTPRequestHandler):
+DB_PATH = SYSTEM_DB
+WEB_ROOT = "/opt/bytefense/web"
+API_PORT = int(os.environ.get('BYTEFENSE_API_PORT', 8080))
+
+# Servidor concurrente
+API_WORKERS = int(os.environ.get('BYTEFENSE_API_WORKERS', 32))         # hilos de atención
+API_BACKLOG = int(os.environ.get('BYTEFENSE_API_BACKLOG', 128))        # cola de accept() del kernel
+API_QUEUE_SIZE = int(os.environ.get('BYTEFENSE_API_QUEUE_SIZE', 256))  # conexiones aceptadas en espera
+API_KEEPALIVE_TIMEOUT = int(os.environ.get('BYTEFENSE_API_KEEPALIVE', 5))  # segundos de inactividad
+API_PROCESSES = worker_count(os.environ.get('BYTEFENSE_API_PROCESSES', 1))   # >1: modo pre-fork, 0: uno por CPU
+
+# Caché de respuestas del dashboard (0 = desactivada, calcular en cada petición)
+CACHE_REFRESH_INTERVAL = float(os.environ.get('BYTEFENSE_API_CACHE_REFRESH', 10))
+
+# Codificación de respuestas
+COMPRESS_MIN_SIZE = 1024                # no comprimir respuestas pequeñas
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+STREAM_CHUNK_SIZE = 16 * 1024           # tamaño de cada chunk en respuestas por streaming
+
+# Heartbeats: se acumulan en memoria y se escriben en una transacción por intervalo
+HEARTBEAT_FLUSH_INTERVAL = float(os.environ.get('BYTEFENSE_HEARTBEAT_FLUSH', 2))  # 0 = escritura inmediata
+HEARTBEAT_BULK_MAX = 10000              # heartbeats por petición a /api/heartbeat/bulk
+MAX_BODY_SIZE = 8 * 1024 * 1024
+
+# Listados paginados (?cursor=&limit=&since=&until=&type=&fields=)
+LIST_PARAMS = ('cursor', 'limit', 'since', 'until', 'type', 'fields')
+LIST_DEFAULT_LIMIT = 100
+LIST_MAX_LIMIT = 1000
+
+# Nodos sin heartbeat durante este tiempo pasan a 'offline'
+NODE_OFFLINE_TIMEOUT = int(os.environ.get('BYTEFENSE_NODE_OFFLINE_TIMEOUT', 300))
+NODE_RESYNC_INTERVAL = 600              # recarga periódica de nodos registrados por otros procesos
+
+# Stream de cambios para dashboards (/api/stream, Server-Sent Events)
+STREAM_BUFFER_SIZE = 1000               # mensajes retenidos para reconexiones (Last-Event-ID)
+STREAM_POLL_INTERVAL = 1.0              # lectura de filas nuevas en events/blocked_ips
+STREAM_KEEPALIVE = 15                   # comentario periódico para detectar clientes caídos
+STREAM_MAX_CLIENTS = max(1, API_WORKERS // 2)  # cada cliente ocupa un hilo del pool
+
+# Archivos estáticos
+STATIC_MEMORY_LIMIT = 256 * 1024        # archivos mayores se envían con sendfile
+STATIC_MAX_AGE = 3600                   # Cache-Control para recursos que no son HTML
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json',
+                      'application/manifest+json', 'image/svg+xml')
+
+db_pool = ConnectionPool(DB_PATH)
+
+NODE_STATUS_LOG_RETENTION = '-1 day'
+
+def encode_json(data):
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+def choose_encoding(accept_encoding):
+    """Elegir Content-Encoding según Accept-Encoding (br > gzip > ninguno)"""
+    if not accept_encoding:
+        return None
+    accepted = set()
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        params = params.replace(' ', '')
+        if params in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(body, GZIP_LEVEL)
+    return body
+
+def make_compressor(encoding):
+    """Compresor incremental: devuelve (compress, flush) o None"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        return compressor.compress, compressor.flush
+    return None
+
+def iter_json_list(key, items, head=None, tail=None):
+    """Serializar {**head, key: [items], **tail()} por partes.
+    
+    `items` produce elementos ya codificados como JSON (str) para no
+    construir la lista completa en memoria; `tail` se evalúa al final.
+    """
+    yield '{'
+    for name, value in (head or {}).items():
+        yield f'{json.dumps(name)}:{json.dumps(value, separators=(",", ":"))},'
+    yield json.dumps(key) + ':['
+    separator = ''
+    for item in items:
+        yield separator + item
+        separator = ','
+    yield ']'
+    for name, value in (tail() if tail else {}).items():
+        yield f',{json.dumps(name)}:{json.dumps(value, separators=(",", ":"))}'
+    yield '}'
+
+class ResponseCache:
+    """Respuestas JSON precalculadas y compartidas por todos los clientes.
+    
+    Cada endpoint registra una función que construye su respuesta; un hilo
+    en segundo plano la recalcula cada `interval` segundos y las peticiones
+    se sirven desde memoria junto con su ETag.
+    """
+    
+    def __init__(self, interval=CACHE_REFRESH_INTERVAL):
+        self.interval = interval
+        self.builders = {}
+        self.entries = {}  # key -> {encoding: (body, etag)}
+        self.lock = threading.Lock()
+    
+    def register(self, key, builder):
+        self.builders[key] = builder
+    
+    def get(self, key):
+        if self.interval <= 0:
+            return self.refresh(key)
+        
+        entry = self.entries.get(key)
+        if entry is None:
+            # Primer acceso: calcular una sola vez aunque lleguen varias peticiones
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is None:
+                    entry = self.refresh(key)
+        return entry
+    
+    def refresh(self, key):
+        start = time.perf_counter()
+        data = self.builders[key]()
+        built = time.perf_counter()
+        body = encode_json(data)
+        digest = hashlib.sha1(body).hexdigest()
+        
+        # Comprimir una vez por refresco, no por petición
+        entry = {None: (body, f'"{digest}"')}
+        if len(body) >= COMPRESS_MIN_SIZE:
+            encodings = ['gzip', 'br'] if brotli is not None else ['gzip']
+            for encoding in encodings:
+                entry[encoding] = (compress(body, encoding), f'"{digest}-{encoding}"')
+        self.entries[key] = entry
+        
+        metrics.observe('cache_refresh', key, 'db', built - start)
+        metrics.observe('cache_refresh', key, 'serialize', time.perf_counter() - built)
+        return entry
+    
+    def run(self):
+        """Bucle del hilo de refresco"""
+        while True:
+            time.sleep(self.interval)
+            for key in list(self.builders):
+                try:
+                    self.refresh(key)
+                except Exception as e:
+                    print(f"Error refreshing {key}: {e}")
+
+response_cache = ResponseCache()
+
+class StaticAsset:
+    """Archivo estático con sus cabeceras precalculadas"""
+    
+    def __init__(self, path, st):
+        self.path = path
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        self.last_modified = formatdate(st.st_mtime, usegmt=True)
+        
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        compressible = content_type.startswith(COMPRESSIBLE_TYPES)
+        if content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type += '; charset=utf-8'
+        self.content_type = content_type
+        self.cache_control = 'no-cache' if content_type.startswith('text/html') else f'public, max-age={STATIC_MAX_AGE}'
+        
+        # Archivos pequeños en memoria; los grandes se leen con sendfile en cada envío
+        self.data = None
+        if self.size <= STATIC_MEMORY_LIMIT:
+            with open(path, 'rb') as f:
+                self.data = f.read()
+        
+        # Variante gzip: archivo .gz precomprimido junto al original, o comprimida una vez en memoria
+        self.gzip_path = None
+        self.gzip_data = None
+        self.gzip_size = 0
+        try:
+            gz_st = os.stat(path + '.gz')
+            if gz_st.st_mtime_ns >= st.st_mtime_ns:
+                self.gzip_path = path + '.gz'
+                self.gzip_size = gz_st.st_size
+        except OSError:
+            pass
+        if self.gzip_path is None and self.data is not None and compressible \
+                and self.size >= COMPRESS_MIN_SIZE:
+            self.gzip_data = gzip.compress(self.data, GZIP_LEVEL)
+            self.gzip_size = len(self.gzip_data)
+    
+    @property
+    def has_gzip(self):
+        return self.gzip_path is not None or self.gzip_data is not None
+
+class StaticAssetCache:
+    """Caché de archivos estáticos invalidada por mtime/tamaño"""
+    
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.assets = {}
+    
+    def resolve(self, url_path):
+        """Ruta del archivo para una URL, o None si sale de la raíz web"""
+        relative = unquote(url_path).lstrip('/') or 'index.html'
+        full_path = os.path.realpath(os.path.join(self.root, relative))
+        if not full_path.startswith(self.root + os.sep):
+            return None
+        return full_path
+    
+    def get(self, file_path):
+        st = os.stat(file_path)
+        if not stat.S_ISREG(st.st_mode):
+            raise FileNotFoundError(file_path)
+        
+        asset = self.assets.get(file_path)
+        if asset is None or asset.mtime_ns != st.st_mtime_ns or asset.size != st.st_size:
+            asset = StaticAsset(file_path, st)
+            self.assets[file_path] = asset
+        return asset
+
+static_cache = StaticAssetCache(WEB_ROOT)
+
+def not_modified_since(if_modified_since, asset):
+    try:
+        since = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return False
+    return asset.mtime_ns // 1_000_000_000 <= since
+
+def etag_matches(if_none_match, etag):
+    """Comprobar una cabecera If-None-Match contra un ETag"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == '*' or candidate == etag:
+            return True
+    return False
+
+def parse_utc(value):
+    """Convertir una fecha 'YYYY-MM-DD HH:MM:SS' (UTC) a timestamp"""
+    return calendar.timegm(time.strptime(value[:19].replace('T', ' '), '%Y-%m-%d %H:%M:%S'))
+
+# Orden de los componentes de la posición del stream (ids de events, blocked_ips, node_status_log)
+STREAM_KINDS = ('event', 'block', 'node')
+
+def format_stream_id(position):
+    return '-'.join(map(str, position))
+
+def parse_stream_id(value):
+    """Posición de un id SSE, o None si no tiene el formato actual"""
+    parts = value.split('-')
+    if len(parts) != len(STREAM_KINDS) or not all(part.isdigit() for part in parts):
+        return None
+    return tuple(int(part) for part in parts)
+
+class EventStream:
+    """Ring buffer de cambios publicados a los dashboards.
+    
+    Un hilo lee una vez por intervalo las filas nuevas de events,
+    blocked_ips y node_status_log (por id, usando la clave primaria) sin
+    importar cuántos clientes haya; así todos los procesos del modo
+    pre-fork ven los mismos cambios. La posición de un mensaje es el
+    último id leído de cada tabla tras publicarlo y es su id SSE: al
+    tratarse de ids de la base de datos significan lo mismo en todos los
+    procesos, así que un cliente que reconecta a otro proceso recibe sólo
+    las filas que le faltan, o `resync` si ya salieron del buffer.
+    """
+    
+    def __init__(self, size=STREAM_BUFFER_SIZE):
+        self.buffer = collections.deque()  # (posición, kind, data)
+        self.size = size
+        self.position = None  # último id leído de cada tabla (STREAM_KINDS)
+        self.base = None      # posición anterior al primer mensaje del buffer
+        self.cond = threading.Condition()
+        self.clients = 0
+    
+    def publish(self, kind, payload, row_id):
+        data = json.dumps(payload, separators=(',', ':'))
+        with self.cond:
+            position = list(self.position)
+            position[STREAM_KINDS.index(kind)] = row_id
+            self.position = tuple(position)
+            self.buffer.append((self.position, kind, data))
+            if len(self.buffer) > self.size:
+                self.base = self.buffer.popleft()[0]
+            self.cond.notify_all()
+    
+    def since(self, cursor):
+        """(mensajes posteriores a `cursor`, nuevo cursor); None si faltan del buffer.
+        
+        `cursor` es la posición que ya tiene el cliente (None: desde ahora).
+        Cada mensaje se devuelve con la posición acumulada del cliente, que
+        puede ir por delante de este proceso en alguna tabla; los mensajes
+        de filas que ya tiene se saltan.
+        """
+        if self.position is None:
+            return [], cursor
+        if cursor is None:
+            return [], self.position
+        if any(c < b for c, b in zip(cursor, self.base)):
+            return None, self.position
+        
+        # Las posiciones crecen en todas las tablas: recorrer desde el final
+        pending = []
+        for position, kind, data in reversed(self.buffer):
+            if all(p <= c for p, c in zip(position, cursor)):
+                break
+            pending.append((position, kind, data))
+        messages = []
+        for position, kind, data in reversed(pending):
+            i = STREAM_KINDS.index(kind)
+            if position[i] > cursor[i]:
+                cursor = tuple(max(c, p) for c, p in zip(cursor, position))
+                messages.append((cursor, kind, data))
+        return messages, tuple(max(c, p) for c, p in zip(cursor, self.position))
+    
+    def wait(self, cursor, timeout):
+        with self.cond:
+            messages, cursor = self.since(cursor)
+            if messages == []:
+                self.cond.wait(timeout)
+                messages, cursor = self.since(cursor)
+            return messages, cursor
+    
+    def acquire_client(self):
+        with self.cond:
+            if self.clients >= STREAM_MAX_CLIENTS:
+                return False
+            self.clients += 1
+            return True
+    
+    def release_client(self):
+        with self.cond:
+            self.clients -= 1
+    
+    def poll_tables(self, conn):
+        if self.position is None:
+            position = (
+                max_event_id(conn),
+                conn.execute("SELECT COALESCE(MAX(id), 0) FROM blocked_ips").fetchone()[0],
+                conn.execute("SELECT COALESCE(MAX(id), 0) FROM node_status_log").fetchone()[0]
+            )
+            with self.cond:
+                self.position = self.base = position
+            return
+        last_event_id, last_block_id, last_node_id = self.position
+        
+        # Sólo las particiones de events que pueden tener ids nuevos
+        for row in conn.execute(f"""
+            SELECT id, event_type, source_ip, description, severity, date
+            FROM {events_after_source(conn, last_event_id)} WHERE id > ? ORDER BY id LIMIT 500
+        """, (last_event_id,)).fetchall():
+            self.publish('event', {
+                "id": row[0],
+                "event_type": row[1],
+                "source_ip": row[2],
+                "description": row[3],
+                "severity": row[4],
+                "date": row[5]
+            }, row[0])
+        
+        for row in conn.execute("""
+            SELECT id, ip, reason, country, date
+            FROM blocked_ips WHERE id > ? ORDER BY id LIMIT 500
+        """, (last_block_id,)).fetchall():
+            self.publish('block', {
+                "id": row[0],
+                "ip": row[1],
+                "reason": row[2],
+                "country": row[3],
+                "date": row[4]
+            }, row[0])
+        
+        for row in conn.execute("""
+            SELECT id, node_id, status, date
+            FROM node_status_log WHERE id > ? ORDER BY id LIMIT 500
+        """, (last_node_id,)).fetchall():
+            self.publish('node', {
+                "node_id": row[1],
+                "status": row[2],
+                "date": row[3]
+            }, row[0])
+    
+    def run(self):
+        """Bucle del hilo lector"""
+        while True:
+            try:
+                self.poll_tables(db_pool.get())
+            except Exception as e:
+                print(f"Error polling stream tables: {e}")
+            time.sleep(STREAM_POLL_INTERVAL)
+
+event_stream = EventStream()
+
+class OfflineTracker:
+    """Plazo del próximo heartbeat de cada nodo en un min-heap.
+    
+    Cada heartbeat empuja un nuevo plazo; las entradas antiguas se
+    descartan al salir del heap (borrado perezoso). El hilo duerme hasta
+    el plazo más cercano y marca offline, en un solo lote, todos los
+    nodos vencidos en ese momento.
+    """
+    
+    def __init__(self, timeout=NODE_OFFLINE_TIMEOUT):
+        self.timeout = timeout
+        self.heap = []       # (deadline, node_id)
+        self.deadlines = {}  # node_id -> plazo vigente
+        self.cond = threading.Condition()
+    
+    def touch(self, node_id, when=None):
+        """Registrar un heartbeat recibido en `when` (timestamp)"""
+        deadline = (time.time() if when is None else when) + self.timeout
+        with self.cond:
+            self.deadlines[node_id] = deadline
+            heapq.heappush(self.heap, (deadline, node_id))
+            
+            # Compactar si se acumulan demasiadas entradas obsoletas
+            if len(self.heap) > 4 * len(self.deadlines) + 1024:
+                self.heap = [(d, n) for n, d in self.deadlines.items()]
+                heapq.heapify(self.heap)
+            
+            if self.heap[0] == (deadline, node_id):
+                self.cond.notify()
+    
+    def load(self, conn):
+        """Programar los nodos online de la base de datos que aún no se siguen"""
+        rows = conn.execute(
+            "SELECT node_id, last_heartbeat FROM registered_nodes WHERE status != 'offline'"
+        ).fetchall()
+        for node_id, last_heartbeat in rows:
+            if node_id in self.deadlines:
+                continue
+            try:
+                self.touch(node_id, parse_utc(last_heartbeat))
+            except (TypeError, ValueError):
+                self.touch(node_id, 0)
+    
+    def pop_expired(self, now):
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, node_id = heapq.heappop(self.heap)
+            if self.deadlines.get(node_id) == deadline:
+                del self.deadlines[node_id]
+                expired.append((node_id, deadline))
+        return expired
+    
+    def mark_offline(self, expired):
+        # La condición sobre last_heartbeat evita pisar un heartbeat escrito mientras tanto
+        # Otro proceso puede haber recibido un heartbeat: sólo cuentan las filas actualizadas
+        conn = db_pool.get()
+        marked = []
+        missed = []
+        with conn:
+            for node_id, deadline in expired:
+                cursor = conn.execute("""
+                    UPDATE registered_nodes 
+                    SET status = 'offline' 
+                    WHERE node_id = ?
+                    AND status != 'offline'
+                    AND last_heartbeat <= ?
+                """, (node_id, utc_now(deadline - self.timeout)))
+                if cursor.rowcount:
+                    marked.append(node_id)
+                else:
+                    missed.append(node_id)
+        
+        if marked:
+            print(f"Marked {len(marked)} nodes as offline")
+        for node_id in marked:
+            heartbeat_buffer.set_status(node_id, 'offline')
+        
+        # Heartbeat más reciente recibido por otro proceso (pre-fork), que no
+        # llama a touch() en este: volver a programar el nodo con ese plazo
+        # en lugar de esperar a la resincronización de NODE_RESYNC_INTERVAL
+        for node_id in missed:
+            row = conn.execute(
+                "SELECT last_heartbeat FROM registered_nodes WHERE node_id = ? AND status != 'offline'",
+                (node_id,)
+            ).fetchone()
+            if row is None:
+                continue
+            try:
+                self.touch(node_id, parse_utc(row[0]))
+            except (TypeError, ValueError):
+                self.touch(node_id)
+    
+    def run(self):
+        """Bucle del hilo de detección"""
+        next_resync = time.time() + NODE_RESYNC_INTERVAL
+        while True:
+            with self.cond:
+                expired = self.pop_expired(time.time())
+                while not expired and time.time() < next_resync:
+                    wait = next_resync - time.time()
+                    if self.heap:
+                        wait = min(wait, self.heap[0][0] - time.time())
+                    self.cond.wait(max(wait, 0))
+                    expired = self.pop_expired(time.time())
+            
+            try:
+                if expired:
+                    self.mark_offline(expired)
+                if time.time() >= next_resync:
+                    next_resync = time.time() + NODE_RESYNC_INTERVAL
+                    self.load(db_pool.get())
+                    with db_pool.get() as conn:
+                        conn.execute(
+                            "DELETE FROM node_status_log WHERE date < datetime('now', ?)",
+                            (NODE_STATUS_LOG_RETENTION,)
+                        )
+            except Exception as e:
+                print(f"Error in offline detection: {e}")
+
+offline_tracker = OfflineTracker()
+
+class HeartbeatBuffer:
+    """Heartbeats pendientes de escribir, uno por nodo (el último gana).
+    
+    Un hilo vuelca el contenido cada `interval` segundos con un único
+    executemany dentro de una transacción, de modo que el coste de
+    escritura depende del intervalo y no del número de satélites.
+    """
+    
+    def __init__(self, interval=HEARTBEAT_FLUSH_INTERVAL):
+        self.interval = interval
+        self.pending = {}  # node_id -> (last_heartbeat, status, metadata)
+        self.known_nodes = {}  # node_id -> último estado conocido
+        self.lock = threading.Lock()
+    
+    def load_known_nodes(self, conn):
+        rows = conn.execute("SELECT node_id, status FROM registered_nodes").fetchall()
+        with self.lock:
+            self.known_nodes.update(rows)
+    
+    def set_status(self, node_id, status):
+        """Actualizar el estado conocido (el stream lo publica desde node_status_log)"""
+        with self.lock:
+            self.known_nodes[node_id] = status
+    
+    def is_known(self, node_id):
+        if node_id in self.known_nodes:
+            return True
+        # Nodo registrado por otro proceso: confirmarlo una vez en la base de datos
+        row = db_pool.get().execute(
+            "SELECT status FROM registered_nodes WHERE node_id = ?", (node_id,)
+        ).fetchone()
+        if row:
+            with self.lock:
+                self.known_nodes.setdefault(node_id, row[0])
+        return row is not None
+    
+    def add(self, node_id, status, metrics):
+        now = time.time()
+        entry = (utc_now(now), status, json.dumps(metrics, separators=(',', ':')))
+        with self.lock:
+            self.pending[node_id] = entry
+        offline_tracker.touch(node_id, now)
+        self.set_status(node_id, status)
+        if self.interval <= 0:
+            self.flush()
+    
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return 0
+            batch = self.pending
+            self.pending = {}
+        
+        try:
+            conn = db_pool.get()
+            with conn:
+                conn.executemany("""
+                    UPDATE registered_nodes 
+                    SET last_heartbeat = ?, 
+                        status = ?, 
+                        metadata = ?
+                    WHERE node_id = ?
+                """, [(hb, status, metadata, node_id)
+                      for node_id, (hb, status, metadata) in batch.items()])
+        except sqlite3.Error:
+            # Devolver el lote sin pisar heartbeats más recientes
+            with self.lock:
+                for node_id, entry in batch.items():
+                    self.pending.setdefault(node_id, entry)
+            raise
+        return len(batch)
+    
+    def run(self):
+        """Bucle del hilo de volcado"""
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing heartbeats: {e}")
+
+heartbeat_buffer = HeartbeatBuffer()
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer que atiende las conexiones con un pool acotado de hilos"""
+    
+    def __init__(self, server_address, handler_class, workers=API_WORKERS,
+                 backlog=API_BACKLOG, queue_size=API_QUEUE_SIZE, reuse_port=False):
+        # request_queue_size se usa en listen(), debe fijarse antes de activar el socket
+        self.request_queue_size = backlog
+        self.reuse_port = reuse_port
+        self.pending = queue.Queue(maxsize=queue_size)
+        super().__init__(server_address, handler_class)
+        
+        self.workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"api-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+    
+    def server_bind(self):
+        # Modo pre-fork: cada proceso abre su propio socket en el mismo puerto
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+    
+    def process_request(self, request, client_address):
+        """Encolar la conexión; si el pool está saturado responder 503 sin bloquear accept()"""
+        try:
+            self.pending.put_nowait((request, client_address))
+        except queue.Full:
+            try:
+                request.sendall(b"HTTP/1.1 503 Service Unavailable\r\n"
+                                b"Retry-After: 1\r\n"
+                                b"Content-Length: 0\r\n"
+                                b"Connection: close\r\n\r\n")
+            except OSError:
+                pass
+            self.shutdown_request(request)
+    
+    def _worker_loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+    
+    def server_close(self):
+        super().server_close()
+        for _ in self.workers:
+            self.pending.put(None)
+
+# Rutas con etiqueta propia en las métricas (bytefense_metrics.endpoint_label)
+API_ROUTES = frozenset((
+    "/api/status", "/api/threats", "/api/events", "/api/intel", "/api/nodes",
+    "/api/vpn", "/api/stream", "/api/metrics",
+    "/api/register", "/api/heartbeat", "/api/heartbeat/bulk"
+))
+
+def timed_rows(cursor):
+    """Iterar un cursor sumando el tiempo de cada lectura al de base de datos"""
+    iterator = iter(cursor)
+    while True:
+        start = time.perf_counter()
+        row = next(iterator, None)
+        metrics.add_time('db', time.perf_counter() - start)
+        if row is None:
+            return
+        yield row
+
+class BytefenseAPIHandler(MetricsHandlerMixin, BaseHTTPRequestHandler):
+    # HTTP/1.1 con keep-alive: toda respuesta debe llevar Content-Length
+    protocol_version = "HTTP/1.1"
+    # Cerrar conexiones inactivas para liberar el hilo del pool
+    timeout = API_KEEPALIVE_TIMEOUT
+    # Cabeceras y cuerpo van en escrituras separadas: sin TCP_NODELAY, Nagle y el
+    # ACK retardado añaden ~40 ms a cada respuesta en conexiones keep-alive
+    disable_nagle_algorithm = True
+    
+    @instrumented(API_ROUTES, untimed=("/api/stream",))
     def do_GET(self):
         parsed_path = urlparse(self.path)
         path = parsed_path.path
         
-        # Servir archivos estáticos
-        if path == "/" or path == "/index.html":
-            self.serve_static_file("/opt/bytefense/web/index.html", "text/html")
-        elif path.startswith("/static/"):
-            self.serve_static_file(f"/opt/bytefense/web{path}", "text/css" if path.endswith('.css') else "application/javascript")
+        query = parse_qs(parsed_path.query)
+        
         # APIs
+        if path in LIST_QUERIES and any(param in query for param in LIST_PARAMS):
+            self.handle_list(path, {name: values[0] for name, values in query.items()})
+        elif path == "/api/stream":
+            self.handle_stream()
         elif path == "/api/nodes":
             self.handle_get_nodes()
-        elif path == "/api/status":
-            self.handle_get_status()
-        elif path == "/api/threats":
-            self.handle_get_threats()
-        elif path == "/api/events":
-            self.handle_get_events()
+        elif path in ("/api/status", "/api/threats", "/api/events", "/api/intel"):
+            self.send_cached_response(path)
         elif path == "/api/vpn":
             self.handle_get_vpn_status()
-        elif path == "/api/intel":
-            self.handle_get_intel()
-        else:
+        elif path == "/api/metrics":
+            self.handle_metrics()
+        elif path.startswith("/api/"):
             self.send_error(404, "Endpoint not found")
+        # Archivos estáticos del dashboard
+        else:
+            self.serve_static_file(path)
     
+    @instrumented(API_ROUTES)
     def do_POST(self):
         parsed_path = urlparse(self.path)
         path = parsed_path.path
@@ -51,139 +773,72 @@ class BytefenseAPIHandler(BaseHTTPRequestHandler):
             self.handle_register_node()
         elif path == "/api/heartbeat":
             self.handle_heartbeat()
+        elif path == "/api/heartbeat/bulk":
+            self.handle_heartbeat_bulk()
         else:
             self.send_error(404, "Endpoint not found")
     
-    def serve_static_file(self, file_path, content_type):
+    def serve_static_file(self, url_path):
+        file_path = static_cache.resolve(url_path)
+        if file_path is None:
+            self.send_error(404, "File not found")
+            return
+        
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            self.send_response(200)
-            self.send_header('Content-Type', content_type + '; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
-        except FileNotFoundError:
+            asset = static_cache.get(file_path)
+        except (FileNotFoundError, NotADirectoryError):
             self.send_error(404, "File not found")
+            return
         except Exception as e:
             self.send_error(500, f"Error serving file: {str(e)}")
+            return
+        
+        use_gzip = asset.has_gzip and choose_encoding(self.headers.get('Accept-Encoding')) is not None
+        etag = asset.etag[:-1] + '-gzip"' if use_gzip else asset.etag
+        
+        if_none_match = self.headers.get('If-None-Match')
+        if etag_matches(if_none_match, etag) or \
+                (if_none_match is None and not_modified_since(self.headers.get('If-Modified-Since'), asset)):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', asset.last_modified)
+            self.send_header('Cache-Control', asset.cache_control)
+            self.end_headers()
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', asset.content_type)
+        self.send_header('Content-Length', str(asset.gzip_size if use_gzip else asset.size))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', asset.last_modified)
+        self.send_header('Cache-Control', asset.cache_control)
+        if asset.has_gzip:
+            self.send_header('Vary', 'Accept-Encoding')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        
+        if use_gzip:
+            data, path = asset.gzip_data, asset.gzip_path
+        else:
+            data, path = asset.data, asset.path
+        
+        if data is not None:
+            self.wfile.write(data)
+        else:
+            # Copia directa archivo -> socket en el kernel (os.sendfile)
+            with open(path, 'rb') as f:
+                self.connection.sendfile(f)
     
-    def handle_get_threats(self):
-        try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            
-            # Obtener amenazas por hora en las últimas 24 horas
-            cursor.execute("""
-                SELECT 
-                    strftime('%H', date) as hour,
-                    COUNT(*) as count
-                FROM blocked_ips 
-                WHERE date >= datetime('now', '-24 hours')
-                GROUP BY strftime('%H', date)
-                ORDER BY hour
-            """)
-            
-            hourly_data = cursor.fetchall()
-            
-            # Llenar horas faltantes con 0
-            hours = []
-            counts = []
-            
-            for i in range(24):
-                hour = (datetime.datetime.now().hour - 23 + i) % 24
-                hour_str = f"{hour:02d}"
-                hours.append(f"{hour_str}:00")
-                
-                # Buscar datos para esta hora
-                found = False
-                for h, c in hourly_data:
-                    if h == hour_str:
-                        counts.append(c)
-                        found = True
-                        break
-                if not found:
-                    counts.append(0)
-            
-            # Obtener top amenazas
-            cursor.execute("""
-                SELECT ip, reason, COUNT(*) as count
-                FROM blocked_ips 
-                WHERE date >= datetime('now', '-24 hours')
-                GROUP BY ip, reason
-                ORDER BY count DESC
-                LIMIT 10
-            """)
-            
-            top_threats = [{
-                "ip": row[0],
-                "reason": row[1],
-                "count": row[2]
-            } for row in cursor.fetchall()]
-            
-            conn.close()
-            
-            response = {
-                "status": "success",
-                "hourly": {
-                    "hours": hours,
-                    "counts": counts
-                },
-                "top_threats": top_threats
-            }
-            
-            self.send_json_response(response)
-            
-        except Exception as e:
-            self.send_error(500, f"Internal server error: {str(e)}")
-    
-    def handle_get_events(self):
-        try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            
-            # Eventos por tipo
-            cursor.execute("""
-                SELECT event_type, COUNT(*) as count
-                FROM events 
-                WHERE date >= datetime('now', '-24 hours')
-                GROUP BY event_type
-                ORDER BY count DESC
-            """)
-            
-            events_by_type = [{
-                "type": row[0],
-                "count": row[1]
-            } for row in cursor.fetchall()]
-            
-            # Eventos recientes
-            cursor.execute("""
-                SELECT event_type, source_ip, description, 
-                       datetime(date, 'localtime') as local_date
-                FROM events 
-                ORDER BY date DESC 
-                LIMIT 20
-            """)
-            
-            recent_events = [{
-                "type": row[0],
-                "source_ip": row[1],
-                "description": row[2],
-                "date": row[3]
-            } for row in cursor.fetchall()]
-            
-            conn.close()
-            
-            response = {
-                "status": "success",
-                "by_type": events_by_type,
-                "recent": recent_events
-            }
-            
-            self.send_json_response(response)
-            
-        except Exception as e:
-            self.send_error(500, f"Internal server error: {str(e)}")
+    def handle_metrics(self):
+        """Métricas de peticiones en formato de exposición de Prometheus"""
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
     
     def handle_get_vpn_status(self):
         try:
@@ -222,55 +877,6 @@ class BytefenseAPIHandler(BaseHTTPRequestHandler):
         except Exception as e:
             self.send_error(500, f"Internal server error: {str(e)}")
     
-    def handle_get_intel(self):
-        try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            
-            # Obtener indicadores de amenazas
-            cursor.execute("""
-                SELECT indicator, type, source, confidence, tags,
-                       datetime(last_seen, 'localtime') as last_seen
-                FROM threat_intel 
-                ORDER BY last_seen DESC 
-                LIMIT 50
-            """)
-            
-            indicators = [{
-                "indicator": row[0],
-                "type": row[1],
-                "source": row[2],
-                "confidence": row[3],
-                "tags": row[4],
-                "last_seen": row[5]
-            } for row in cursor.fetchall()]
-            
-            # Estadísticas por tipo
-            cursor.execute("""
-                SELECT type, COUNT(*) as count
-                FROM threat_intel 
-                GROUP BY type
-                ORDER BY count DESC
-            """)
-            
-            by_type = [{
-                "type": row[0],
-                "count": row[1]
-            } for row in cursor.fetchall()]
-            
-            conn.close()
-            
-            response = {
-                "status": "success",
-                "indicators": indicators,
-                "by_type": by_type
-            }
-            
-            self.send_json_response(response)
-            
-        except Exception as e:
-            self.send_error(500, f"Internal server error: {str(e)}")
-    
     def handle_register_node(self):
         try:
             content_length = int(self.headers.get('Content-Length', 0))
@@ -302,30 +908,30 @@ class BytefenseAPIHandler(BaseHTTPRequestHandler):
                 return
             
             # Conectar a la base de datos
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
+            conn = db_pool.get()
             
             # Insertar o actualizar nodo
-            cursor.execute("""
-                INSERT OR REPLACE INTO registered_nodes 
-                (node_id, node_name, node_type, ip_address, public_ip, port, version, 
-                 status, last_heartbeat, first_registered, metadata)
-                VALUES (?, ?, ?, ?, ?, ?, ?, 'online', datetime('now'), 
-                        COALESCE((SELECT first_registered FROM registered_nodes WHERE node_id = ?), datetime('now')), ?)
-            """, (
-                data['node_id'],
-                data['node_name'],
-                data['node_type'],
-                data['ip_address'],
-                data.get('public_ip'),
-                data.get('port', 8080),
-                data.get('version', '1.0.0'),
-                data['node_id'],
-                json.dumps(data.get('metadata', {}))
-            ))
-            
-            conn.commit()
-            conn.close()
+            with metrics.timer('db'), conn:
+                conn.execute("""
+                    INSERT OR REPLACE INTO registered_nodes 
+                    (node_id, node_name, node_type, ip_address, public_ip, port, version, 
+                     status, last_heartbeat, first_registered, metadata)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, 'online', datetime('now'), 
+                            COALESCE((SELECT first_registered FROM registered_nodes WHERE node_id = ?), datetime('now')), ?)
+                """, (
+                    data['node_id'],
+                    data['node_name'],
+                    data['node_type'],
+                    data['ip_address'],
+                    data.get('public_ip'),
+                    data.get('port', 8080),
+                    data.get('version', '1.0.0'),
+                    data['node_id'],
+                    json.dumps(data.get('metadata', {}))
+                ))
+            
+            heartbeat_buffer.set_status(data['node_id'], 'online')
+            offline_tracker.touch(data['node_id'])
             
             # Registrar evento
             self.log_event("NODE_REGISTER", data['ip_address'], f"Node {data['node_name']} registered")
@@ -355,29 +961,12 @@ class BytefenseAPIHandler(BaseHTTPRequestHandler):
                 self.send_error(400, "Missing node_id")
                 return
             
-            # Conectar a la base de datos
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            
-            # Actualizar heartbeat
-            cursor.execute("""
-                UPDATE registered_nodes 
-                SET last_heartbeat = datetime('now'), 
-                    status = ?, 
-                    metadata = ?
-                WHERE node_id = ?
-            """, (
-                data.get('status', 'online'),
-                json.dumps(data.get('metrics', {})),
-                data['node_id']
-            ))
-            
-            if cursor.rowcount == 0:
+            if not heartbeat_buffer.is_known(data['node_id']):
                 self.send_error(404, "Node not found")
                 return
             
-            conn.commit()
-            conn.close()
+            # Encolar heartbeat (se escribe en el próximo volcado)
+            heartbeat_buffer.add(data['node_id'], data.get('status', 'online'), data.get('metrics', {}))
             
             # Respuesta exitosa
             response = {"status": "success", "message": "Heartbeat received"}
@@ -388,20 +977,142 @@ class BytefenseAPIHandler(BaseHTTPRequestHandler):
         except Exception as e:
             self.send_error(500, f"Internal server error: {str(e)}")
     
+    def handle_heartbeat_bulk(self):
+        """Heartbeats de muchos nodos en una sola petición (relays)"""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            if content_length == 0:
+                self.send_error(400, "No data provided")
+                return
+            if content_length > MAX_BODY_SIZE:
+                self.send_error(413, "Request body too large")
+                return
+            
+            data = json.loads(self.rfile.read(content_length).decode('utf-8'))
+            heartbeats = data.get('heartbeats') if isinstance(data, dict) else None
+            if not isinstance(heartbeats, list):
+                self.send_error(400, "Missing heartbeats list")
+                return
+            if len(heartbeats) > HEARTBEAT_BULK_MAX:
+                self.send_error(413, f"Too many heartbeats (max {HEARTBEAT_BULK_MAX})")
+                return
+            
+            accepted = 0
+            unknown = []
+            for item in heartbeats:
+                node_id = item.get('node_id') if isinstance(item, dict) else None
+                if not isinstance(node_id, str) or not node_id:
+                    continue
+                if not heartbeat_buffer.is_known(node_id):
+                    unknown.append(node_id)
+                    continue
+                heartbeat_buffer.add(node_id, item.get('status', 'online'), item.get('metrics', {}))
+                accepted += 1
+            
+            response = {
+                "status": "success",
+                "accepted": accepted,
+                "rejected": len(heartbeats) - accepted,
+                "unknown_nodes": unknown
+            }
+            self.send_json_response(response)
+            
+        except json.JSONDecodeError:
+            self.send_error(400, "Invalid JSON")
+        except Exception as e:
+            self.send_error(500, f"Internal server error: {str(e)}")
+    
+    def handle_stream(self):
+        """Server-Sent Events con los cambios de eventos, bloqueos y nodos"""
+        if not event_stream.acquire_client():
+            self.send_error(503, "Too many stream clients")
+            return
+        
+        try:
+            query = parse_qs(urlparse(self.path).query)
+            last_id = self.headers.get('Last-Event-ID') or query.get('lastEventId', [None])[0]
+            cursor = parse_stream_id(last_id) if last_id else None
+            # Id con otro formato (versión anterior del servidor): forzar recarga completa
+            resync = last_id is not None and cursor is None
+            
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('X-Accel-Buffering', 'no')
+            # Sin longitud conocida: el stream termina al cerrar la conexión
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+            self.end_headers()
+            self.wfile.write(b'retry: 3000\n\n')
+            if resync:
+                cursor = event_stream.position
+                stream_id = f'id: {format_stream_id(cursor)}\n' if cursor else ''
+                self.wfile.write(f'{stream_id}event: resync\ndata: {{}}\n\n'.encode('utf-8'))
+            
+            while True:
+                messages, cursor = event_stream.wait(cursor, STREAM_KEEPALIVE)
+                if messages is None:
+                    # El cliente perdió mensajes: debe recargar los datos completos
+                    self.wfile.write(f'id: {format_stream_id(cursor)}\nevent: resync\ndata: {{}}\n\n'.encode('utf-8'))
+                elif not messages:
+                    self.wfile.write(b': keepalive\n\n')
+                else:
+                    self.wfile.write(''.join(
+                        f'id: {format_stream_id(position)}\nevent: {kind}\ndata: {data}\n\n'
+                        for position, kind, data in messages
+                    ).encode('utf-8'))
+        except (BrokenPipeError, ConnectionResetError, TimeoutError):
+            pass  # Cliente desconectado
+        finally:
+            event_stream.release_client()
+    
+    def handle_list(self, path, params):
+        """Página de un listado con filtros, proyección y cursor"""
+        spec = LIST_QUERIES[path]
+        try:
+            conn = db_pool.get()
+            sql, args, fields, limit = spec.build(params, conn)
+            with metrics.timer('db'):
+                cursor = conn.execute(sql, args)
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        except Exception as e:
+            self.send_error(500, f"Internal server error: {str(e)}")
+            return
+        
+        state = {'next_cursor': None, 'count': 0}
+        self.send_json_stream(iter_json_list(
+            spec.key, spec.iter_rows(timed_rows(cursor), fields, limit, state),
+            head={"status": "success"},
+            tail=lambda: {"count": state['count'], "next_cursor": state['next_cursor']}
+        ))
+    
     def handle_get_nodes(self):
         try:
-            conn = sqlite3.connect(DB_PATH)
+            conn = db_pool.get()
             cursor = conn.cursor()
             
+            # metadata ya está guardado como JSON: se inserta tal cual sin decodificarlo
+            start = time.perf_counter()
             cursor.execute("""
                 SELECT node_id, node_name, node_type, ip_address, public_ip, 
-                       port, version, status, last_heartbeat, first_registered, metadata
+                       port, version, status, last_heartbeat, first_registered,
+                       CASE WHEN json_valid(metadata) THEN metadata ELSE '{}' END
                 FROM registered_nodes 
                 ORDER BY last_heartbeat DESC
             """)
-            
-            nodes = []
-            for row in cursor.fetchall():
+            metrics.add_time('db', time.perf_counter() - start)
+        except Exception as e:
+            self.send_error(500, f"Internal server error: {str(e)}")
+            return
+        
+        total = 0
+        
+        def nodes():
+            nonlocal total
+            for row in timed_rows(cursor):
                 node = {
                     "node_id": row[0],
                     "node_name": row[1],
@@ -412,135 +1123,644 @@ class BytefenseAPIHandler(BaseHTTPRequestHandler):
                     "version": row[6],
                     "status": row[7],
                     "last_heartbeat": row[8],
-                    "first_registered": row[9],
-                    "metadata": json.loads(row[10]) if row[10] else {}
+                    "first_registered": row[9]
                 }
-                nodes.append(node)
-            
-            conn.close()
-            
-            response = {
-                "status": "success",
-                "nodes": nodes,
-                "total": len(nodes)
-            }
-            
-            self.send_json_response(response)
-            
-        except Exception as e:
-            self.send_error(500, f"Internal server error: {str(e)}")
+                total += 1
+                yield json.dumps(node, separators=(',', ':'))[:-1] + ',"metadata":' + row[10] + '}'
+        
+        self.send_json_stream(iter_json_list(
+            "nodes", nodes(),
+            head={"status": "success"},
+            tail=lambda: {"total": total}
+        ))
     
-    def handle_get_status(self):
+    def send_cached_response(self, key):
+        """Servir una respuesta de la caché, con 304 si el cliente ya la tiene"""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            
-            # Obtener estadísticas generales
-            cursor.execute("SELECT COUNT(*) FROM registered_nodes")
-            total_nodes = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM registered_nodes WHERE status = 'online'")
-            online_nodes = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM blocked_ips WHERE date >= date('now', '-24 hours')")
-            blocked_ips_24h = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM events WHERE date >= date('now', '-24 hours')")
-            events_24h = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM threat_intel")
-            total_intel = cursor.fetchone()[0]
-            
-            conn.close()
-            
-            response = {
-                "status": "success",
-                "statistics": {
-                    "total_nodes": total_nodes,
-                    "online_nodes": online_nodes,
-                    "offline_nodes": total_nodes - online_nodes,
-                    "blocked_ips_24h": blocked_ips_24h,
-                    "events_24h": events_24h,
-                    "total_intel": total_intel,
-                    "uptime": self.get_uptime()
-                }
-            }
-            
-            self.send_json_response(response)
-            
+            entry = response_cache.get(key)
         except Exception as e:
             self.send_error(500, f"Internal server error: {str(e)}")
+            return
+        
+        encoding = choose_encoding(self.headers.get('Accept-Encoding'))
+        if encoding not in entry:
+            encoding = None
+        body, etag = entry[encoding]
+        
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            return
+        
+        self.send_body(body, encoding, {'ETag': etag, 'Cache-Control': 'no-cache'})
     
     def send_json_response(self, data):
+        with metrics.timer('serialize'):
+            body = encode_json(data)
+            encoding = None
+            if len(body) >= COMPRESS_MIN_SIZE:
+                encoding = choose_encoding(self.headers.get('Accept-Encoding'))
+                body = compress(body, encoding)
+        self.send_body(body, encoding)
+    
+    def send_body(self, body, encoding=None, extra_headers=None):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_json_stream(self, parts):
+        """Enviar un JSON generado por partes (chunked y comprimido al vuelo).
+        
+        Sólo se mantiene en memoria un bloque de STREAM_CHUNK_SIZE bytes.
+        """
+        encoding = choose_encoding(self.headers.get('Accept-Encoding'))
+        compressor = make_compressor(encoding)
+        chunked = self.request_version == 'HTTP/1.1'
+        
         self.send_response(200)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            # HTTP/1.0: el fin del cuerpo lo marca el cierre de la conexión
+            self.send_header('Connection', 'close')
+            self.close_connection = True
         self.end_headers()
-        self.wfile.write(json.dumps(data, indent=2).encode('utf-8'))
+        
+        def write(data):
+            if not data:
+                return
+            if chunked:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            else:
+                self.wfile.write(data)
+        
+        # Tiempo de serialización = generar y comprimir las partes, sin las lecturas
+        # de base de datos (timed_rows) ni la escritura en el socket
+        db_before = getattr(metrics.local, 'db', 0.0)
+        start = time.perf_counter()
+        writing = 0.0
+        try:
+            pending = []
+            pending_size = 0
+            for part in parts:
+                data = part.encode('utf-8')
+                pending.append(data)
+                pending_size += len(data)
+                if pending_size >= STREAM_CHUNK_SIZE:
+                    block = b''.join(pending)
+                    block = compressor[0](block) if compressor else block
+                    write_start = time.perf_counter()
+                    write(block)
+                    writing += time.perf_counter() - write_start
+                    pending = []
+                    pending_size = 0
+            
+            block = b''.join(pending)
+            if compressor:
+                block = compressor[0](block) + compressor[1]()
+            metrics.add_time('serialize', time.perf_counter() - start - writing
+                             - (getattr(metrics.local, 'db', 0.0) - db_before))
+            write(block)
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+        except Exception:
+            # Las cabeceras ya se enviaron: cortar la conexión para señalar el error
+            self.close_connection = True
+            raise
     
     def log_event(self, event_type, source_ip, description):
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
+            conn = db_pool.get()
             
-            cursor.execute("""
-                INSERT INTO events (event_type, source_ip, description, date)
-                VALUES (?, ?, ?, datetime('now'))
-            """, (event_type, source_ip, description))
-            
-            conn.commit()
-            conn.close()
+            with conn:
+                conn.execute("""
+                    INSERT INTO events (event_type, source_ip, description, date)
+                    VALUES (?, ?, ?, datetime('now'))
+                """, (event_type, source_ip, description))
         except:
             pass  # No fallar si no se puede registrar el evento
     
-    def get_uptime(self):
-        try:
-            with open('/proc/uptime', 'r') as f:
-                uptime_seconds = float(f.readline().split()[0])
-            return f"{uptime_seconds:.0f} seconds"
-        except:
-            return "unknown"
-    
     def log_message(self, format, *args):
         # Suprimir logs de acceso para reducir ruido
         pass
 
-def cleanup_offline_nodes():
-    """Marcar nodos como offline si no han enviado heartbeat en 5 minutos"""
-    while True:
+def local_date(date):
+    """Fecha UTC de la base de datos en hora local, como datetime(date, 'localtime')"""
+    try:
+        timestamp = calendar.timegm(time.strptime(date[:19], '%Y-%m-%d %H:%M:%S'))
+    except (TypeError, ValueError):
+        return date
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+def query_status():
+    """Estadísticas generales para /api/status"""
+    conn = db_pool.get()
+    cursor = conn.cursor()
+    
+    # Obtener estadísticas generales
+    cursor.execute("SELECT COUNT(*) FROM registered_nodes")
+    total_nodes = cursor.fetchone()[0]
+    
+    cursor.execute("SELECT COUNT(*) FROM registered_nodes WHERE status = 'online'")
+    online_nodes = cursor.fetchone()[0]
+    
+    # Últimas 24 horas desde el nivel caliente del demonio de ingesta; sin él, agregados horarios
+    hot = hot_client()
+    blocked_ips_24h = hot.count(DB_PATH, 'blocked_ips', 24 * 60)
+    if blocked_ips_24h is None:
+        cursor.execute("""
+            SELECT COALESCE(SUM(count), 0) FROM blocked_ips_hourly
+            WHERE hour >= strftime('%Y-%m-%d %H:00:00', 'now', '-23 hours')
+        """)
+        blocked_ips_24h = cursor.fetchone()[0]
+    
+    events_24h = hot.count(DB_PATH, 'events', 24 * 60)
+    if events_24h is None:
+        cursor.execute("""
+            SELECT COALESCE(SUM(count), 0) FROM events_hourly
+            WHERE hour >= strftime('%Y-%m-%d %H:00:00', 'now', '-23 hours')
+        """)
+        events_24h = cursor.fetchone()[0]
+    
+    cursor.execute("SELECT COUNT(*) FROM threat_intel")
+    total_intel = cursor.fetchone()[0]
+    
+    response = {
+        "status": "success",
+        "statistics": {
+            "total_nodes": total_nodes,
+            "online_nodes": online_nodes,
+            "offline_nodes": total_nodes - online_nodes,
+            "blocked_ips_24h": blocked_ips_24h,
+            "events_24h": events_24h,
+            "total_intel": total_intel,
+            "uptime": get_uptime()
+        }
+    }
+    
+    return response
+
+def query_threats():
+    """Histograma horario y top de amenazas para /api/threats"""
+    conn = db_pool.get()
+    cursor = conn.cursor()
+    
+    hot = hot_client()
+    
+    # Amenazas por hora en las últimas 24 horas: nivel caliente (24 totales,
+    # de la hora más antigua a la actual) o filas del agregado, cuya clave
+    # es la hora UTC completa
+    hot_counts = hot.query(DB_PATH, 'hourly', 'blocked_ips')
+    hourly_data = {}
+    if hot_counts is None:
+        cursor.execute("""
+            SELECT hour, SUM(count)
+            FROM blocked_ips_hourly
+            WHERE hour >= strftime('%Y-%m-%d %H:00:00', 'now', '-23 hours')
+            GROUP BY hour
+        """)
+        hourly_data = dict(cursor.fetchall())
+    
+    # Las 24 horas UTC, de la más antigua a la actual, etiquetadas en hora
+    # local; las que no tienen filas van con 0
+    hours = []
+    counts = []
+    
+    first_hour = int(time.time()) // 3600 * 3600 - 23 * 3600
+    for i in range(24):
+        bucket = first_hour + i * 3600
+        hours.append(time.strftime('%H:%M', time.localtime(bucket)))
+        if hot_counts is not None:
+            counts.append(hot_counts[i])
+        else:
+            counts.append(hourly_data.get(time.strftime('%Y-%m-%d %H:00:00', time.gmtime(bucket)), 0))
+    
+    # Obtener top amenazas
+    rows = hot.query(DB_PATH, 'top', 'blocked_ips', minutes=24 * 60, n=10)
+    if rows is not None:
+        rows = [(ip, reason, count) for reason, ip, count in rows]
+    else:
+        cursor.execute("""
+            SELECT ip, reason, COUNT(*) as count
+            FROM blocked_ips 
+            WHERE date >= datetime('now', '-24 hours')
+            GROUP BY +ip, reason  -- '+': agrupar sobre el rango de fechas, no recorriendo el índice de ip
+            ORDER BY count DESC
+            LIMIT 10
+        """)
+        rows = cursor.fetchall()
+    
+    top_threats = [{
+        "ip": row[0],
+        "reason": row[1],
+        "count": row[2]
+    } for row in rows]
+    
+    response = {
+        "status": "success",
+        "hourly": {
+            "hours": hours,
+            "counts": counts
+        },
+        "top_threats": top_threats
+    }
+    
+    return response
+
+def query_events():
+    """Eventos por tipo y recientes para /api/events"""
+    conn = db_pool.get()
+    cursor = conn.cursor()
+    
+    hot = hot_client()
+    
+    # Eventos por tipo
+    rows = hot.query(DB_PATH, 'by_type', 'events', minutes=24 * 60)
+    if rows is None:
+        cursor.execute("""
+            SELECT event_type, SUM(count) as count
+            FROM events_hourly
+            WHERE hour >= strftime('%Y-%m-%d %H:00:00', 'now', '-23 hours')
+            GROUP BY event_type
+            HAVING SUM(count) > 0
+            ORDER BY count DESC
+        """)
+        rows = cursor.fetchall()
+    
+    events_by_type = [{
+        "type": row[0],
+        "count": row[1]
+    } for row in rows]
+    
+    # Eventos recientes: el nivel caliente los da en UTC
+    rows = hot.query(DB_PATH, 'recent', n=20)
+    if rows is not None:
+        rows = [(event_type, source_ip, description, local_date(date))
+                for event_type, source_ip, description, date in rows]
+    else:
+        # La conversión a hora local va fuera de la subconsulta para que
+        # SQLite recorra el índice de fecha de cada partición de events
+        cursor.execute("""
+            SELECT event_type, source_ip, description, 
+                   datetime(date, 'localtime') as local_date
+            FROM (
+                SELECT event_type, source_ip, description, date
+                FROM events 
+                ORDER BY date DESC 
+                LIMIT 20
+            )
+        """)
+        rows = cursor.fetchall()
+    
+    recent_events = [{
+        "type": row[0],
+        "source_ip": row[1],
+        "description": row[2],
+        "date": row[3]
+    } for row in rows]
+    
+    response = {
+        "status": "success",
+        "by_type": events_by_type,
+        "recent": recent_events
+    }
+    
+    return response
+
+def query_intel():
+    """Indicadores de amenazas para /api/intel"""
+    conn = db_pool.get()
+    cursor = conn.cursor()
+    
+    # Obtener indicadores de amenazas
+    cursor.execute("""
+        SELECT indicator, type, source, confidence, tags,
+               datetime(last_seen, 'localtime') as local_last_seen
+        FROM threat_intel 
+        ORDER BY last_seen DESC 
+        LIMIT 50
+    """)
+    
+    indicators = [{
+        "indicator": row[0],
+        "type": row[1],
+        "source": row[2],
+        "confidence": row[3],
+        "tags": row[4],
+        "last_seen": row[5]
+    } for row in cursor.fetchall()]
+    
+    # Estadísticas por tipo
+    cursor.execute("""
+        SELECT type, COUNT(*) as count
+        FROM threat_intel 
+        GROUP BY type
+        ORDER BY count DESC
+    """)
+    
+    by_type = [{
+        "type": row[0],
+        "count": row[1]
+    } for row in cursor.fetchall()]
+    
+    response = {
+        "status": "success",
+        "indicators": indicators,
+        "by_type": by_type
+    }
+    
+    return response
+
+def get_uptime():
+    # Redondeado al minuto: /api/status lleva ETag y el valor exacto lo
+    # cambiaría en cada refresco aunque nada más hubiera variado
+    try:
+        with open('/proc/uptime', 'r') as f:
+            uptime_seconds = float(f.readline().split()[0])
+        return f"{int(uptime_seconds) // 60 * 60} seconds"
+    except:
+        return "unknown"
+
+class KeysetQuery:
+    """Listado paginado por clave sobre una tabla.
+    
+    Las filas se recorren en orden descendente por (order_column, id) y el
+    cursor guarda la última clave devuelta, así cada página es un rango
+    sobre un índice con coste constante aunque la tabla tenga millones de
+    filas. `fields` mapea nombre público -> expresión SQL.
+    """
+    
+    def __init__(self, table, key, fields, order_column=None, time_column=None,
+                 type_column=None, json_fields=(), partitioned=False):
+        self.table = table
+        self.partitioned = partitioned  # events: leer sólo las particiones de [since, until)
+        self.key = key
+        self.fields = fields
+        self.order_column = order_column
+        self.time_column = time_column
+        self.type_column = type_column
+        self.json_fields = json_fields  # columnas que ya contienen JSON
+    
+    def build(self, params, conn=None):
+        """Construir (sql, args, campos, límite) o lanzar ValueError"""
+        fields = list(self.fields)
+        if params.get('fields'):
+            fields = [f.strip() for f in params['fields'].split(',') if f.strip()]
+            unknown = [f for f in fields if f not in self.fields]
+            if unknown or not fields:
+                raise ValueError(f"Campos no válidos: {', '.join(unknown) or '(vacío)'}")
+        
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                UPDATE registered_nodes 
-                SET status = 'offline' 
-                WHERE datetime(last_heartbeat) < datetime('now', '-5 minutes')
-                AND status != 'offline'
-            """)
-            
-            if cursor.rowcount > 0:
-                print(f"Marked {cursor.rowcount} nodes as offline")
-            
-            conn.commit()
-            conn.close()
-            
-        except Exception as e:
-            print(f"Error in cleanup: {e}")
+            limit = int(params.get('limit', LIST_DEFAULT_LIMIT))
+        except ValueError:
+            raise ValueError("limit debe ser un entero")
+        limit = max(1, min(limit, LIST_MAX_LIMIT))
+        
+        where = []
+        args = []
+        since = until = None
+        if self.time_column:
+            if params.get('since'):
+                since = parse_time_param(params['since'])
+                where.append(f"{self.time_column} >= ?")
+                args.append(since)
+            if params.get('until'):
+                until = parse_time_param(params['until'])
+                where.append(f"{self.time_column} < ?")
+                args.append(until)
+        if self.type_column and params.get('type'):
+            where.append(f"{self.type_column} = ?")
+            args.append(params['type'])
+        if params.get('cursor'):
+            position = decode_cursor(params['cursor'], self.key_count)
+            if self.order_column:
+                where.append(f"({self.order_column}, id) < (?, ?)")
+            else:
+                where.append("id < ?")
+            args.extend(position)
         
-        time.sleep(60)  # Verificar cada minuto
+        order = f"{self.order_column} DESC, id DESC" if self.order_column else "id DESC"
+        key_columns = f"{self.order_column}, id" if self.order_column else "id"
+        columns = ', '.join(self.fields[f] for f in fields)
+        table = events_source(conn, since, until) if self.partitioned and conn else self.table
+        sql = f"SELECT {key_columns}, {columns} FROM {table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {order} LIMIT ?"
+        args.append(limit + 1)
+        return sql, args, fields, limit
+    
+    @property
+    def key_count(self):
+        """Columnas de la clave de orden: (order_column, id) o sólo id"""
+        return 2 if self.order_column else 1
+    
+    def iter_rows(self, cursor, fields, limit, state):
+        """Filas de la página como JSON; deja en state el cursor siguiente"""
+        key_count = self.key_count
+        sent = 0
+        for row in cursor:
+            if sent == limit:
+                state['next_cursor'] = encode_cursor(last_key)
+                break
+            last_key = list(row[:key_count])
+            values = row[key_count:]
+            plain = {f: v for f, v in zip(fields, values) if f not in self.json_fields}
+            item = json.dumps(plain, separators=(',', ':'))
+            for f, v in zip(fields, values):
+                if f in self.json_fields:
+                    item = item[:-1] + (',' if len(item) > 2 else '') + f'{json.dumps(f)}:{v}' + '}'
+            sent += 1
+            yield item
+        state['count'] = sent
 
-if __name__ == "__main__":
-    # Iniciar hilo de limpieza
-    cleanup_thread = threading.Thread(target=cleanup_offline_nodes, daemon=True)
-    cleanup_thread.start()
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(value, arity):
+    """Clave de `arity` valores escalares; cualquier otra cosa es ValueError (400)"""
+    try:
+        padded = value + '=' * (-len(value) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise ValueError("cursor inválido")
+    if not isinstance(position, list) or len(position) != arity:
+        raise ValueError("cursor inválido")
+    for item in position:
+        if isinstance(item, bool) or not isinstance(item, (int, float, str)):
+            raise ValueError("cursor inválido")
+    return position
+
+def parse_time_param(value):
+    """Aceptar timestamp Unix o fecha ISO y devolverla como 'YYYY-MM-DD HH:MM:SS' (UTC)"""
+    if value.isdigit():
+        return utc_now(int(value))
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d'):
+        try:
+            return time.strftime('%Y-%m-%d %H:%M:%S', time.strptime(value, fmt))
+        except ValueError:
+            continue
+    raise ValueError(f"Fecha no válida: {value}")
+
+LIST_QUERIES = {
+    "/api/events": KeysetQuery(
+        "events", "events",
+        fields={
+            "id": "id",
+            "type": "event_type",
+            "source_ip": "source_ip",
+            "target_ip": "target_ip",
+            "description": "description",
+            "severity": "severity",
+            "date": "date"
+        },
+        order_column="date", time_column="date", type_column="event_type", partitioned=True
+    ),
+    "/api/threats": KeysetQuery(
+        "blocked_ips", "threats",
+        fields={
+            "id": "id",
+            "ip": "ip",
+            "reason": "reason",
+            "date": "date",
+            "country": "country",
+            "asn": "asn",
+            "active": "active"
+        },
+        order_column="date", time_column="date", type_column="reason"
+    ),
+    "/api/intel": KeysetQuery(
+        "threat_intel", "indicators",
+        fields={
+            "id": "id",
+            "indicator": "indicator",
+            "type": "type",
+            "source": "source",
+            "confidence": "confidence",
+            "tags": "tags",
+            "first_seen": "first_seen",
+            "last_seen": "last_seen"
+        },
+        order_column="last_seen", time_column="last_seen", type_column="type"
+    ),
+    "/api/nodes": KeysetQuery(
+        "registered_nodes", "nodes",
+        fields={
+            "node_id": "node_id",
+            "node_name": "node_name",
+            "node_type": "node_type",
+            "ip_address": "ip_address",
+            "public_ip": "public_ip",
+            "port": "port",
+            "version": "version",
+            "status": "status",
+            "last_heartbeat": "last_heartbeat",
+            "first_registered": "first_registered",
+            "metadata": "CASE WHEN json_valid(metadata) THEN metadata ELSE '{}' END"
+        },
+        time_column="last_heartbeat", type_column="node_type", json_fields=("metadata",)
+    ),
+}
+
+response_cache.register("/api/status", query_status)
+response_cache.register("/api/threats", query_threats)
+response_cache.register("/api/events", query_events)
+response_cache.register("/api/intel", query_intel)
+
+def serve(beat=None, primary=True, reuse_port=False, index=None):
+    """Arrancar los hilos de fondo y atender peticiones hasta que se pida parar.
     
-    # Iniciar servidor HTTP
-    server = HTTPServer(('0.0.0.0', API_PORT), BytefenseAPIHandler)
-    print(f"🚀 Bytefense API server running on port {API_PORT}")
+    En modo pre-fork sólo el proceso primario detecta nodos offline y
+    mantiene las particiones. La caché de respuestas, el lector de
+    /api/stream y el búfer de heartbeats van en cada proceso: cada uno
+    sirve a sus propios clientes y vuelca los heartbeats que recibe, a
+    costa de repetir el refresco de la caché una vez por proceso.
+    """
+    # Métricas de todos los procesos en /api/metrics
+    if index is not None:
+        metrics.start_dumping("bytefense-api", index)
+    
+    # Iniciar detección de nodos offline
+    if primary:
+        offline_thread = threading.Thread(target=offline_tracker.run, daemon=True)
+        offline_thread.start()
+        
+        # Particiones de events: crear las próximas y aplicar la retención
+        partition_thread = threading.Thread(target=events_maintenance_loop, args=(DB_PATH,), daemon=True)
+        partition_thread.start()
+    
+    # Iniciar refresco de la caché de respuestas
+    if CACHE_REFRESH_INTERVAL > 0:
+        cache_thread = threading.Thread(target=response_cache.run, daemon=True)
+        cache_thread.start()
+    
+    # Iniciar lectura de cambios para /api/stream
+    stream_thread = threading.Thread(target=event_stream.run, daemon=True)
+    stream_thread.start()
+    
+    # Iniciar volcado de heartbeats
+    if HEARTBEAT_FLUSH_INTERVAL > 0:
+        heartbeat_thread = threading.Thread(target=heartbeat_buffer.run, daemon=True)
+        heartbeat_thread.start()
+    
+    # Iniciar servidor HTTP concurrente
+    server = PooledHTTPServer(('0.0.0.0', API_PORT), BytefenseAPIHandler, reuse_port=reuse_port)
+    if beat:
+        # Latido para el supervisor en cada vuelta del bucle de accept()
+        server.service_actions = beat
+    print(f"🚀 Bytefense API server running on port {API_PORT} "
+          f"({API_WORKERS} workers, backlog {API_BACKLOG}, pid {os.getpid()})")
     
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print("\n🛑 Shutting down API server")
-        server.shutdown()
\ No newline at end of file
+    finally:
+        server.server_close()
+        heartbeat_buffer.flush()
+        db_pool.close_all()
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild-rollups":
+        rebuild_rollups(db_pool.get())
+        print("✅ Rollup tables rebuilt")
+        sys.exit(0)
+    
+    try:
+        migrate(db_pool.get())
+        heartbeat_buffer.load_known_nodes(db_pool.get())
+        offline_tracker.load(db_pool.get())
+    except sqlite3.Error as e:
+        print(f"Error preparing database: {e}")
+    
+    if API_PROCESSES > 1:
+        # Las conexiones SQLite no deben cruzar un fork
+        db_pool.close_all()
+        clear_dumps("bytefense-api")
+        print(f"🚀 Bytefense API pre-fork supervisor: {API_PROCESSES} processes on port {API_PORT}")
+        supervisor = PreforkSupervisor(
+            API_PROCESSES,
+            lambda index, beat: serve(beat=beat, primary=index == 0, reuse_port=True, index=index),
+            name="bytefense-api"
+        )
+        supervisor.run()
+    else:
+        serve()
@@ -15,36 +15,138 @@ import secrets
 import time
 import json
 import hashlib
+import threading
 from datetime import datetime, timedelta
 from functools import wraps
 from flask import Flask, request, jsonify, session, render_template_string
-from collections import defaultdict
 import logging
 from logging.handlers import RotatingFileHandler
-import redis
 import smtplib
 from email.mime.text import MimeText
+from bytefense_geoip import lookup as geoip_lookup
+
+# Almacén clave-valor local cuando no hay Redis
+KV_DB_PATH = '/opt/bytefense/system/bytefense-kv.db'
+KV_PURGE_INTERVAL = 60  # segundos entre limpiezas de claves caducadas
+FAILED_ATTEMPTS_WINDOW = 15 * 60
+SQLITE_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)  # UPSERT ... RETURNING
+
+class LocalKVStore:
+    """Claves con caducidad sobre una tabla SQLite en modo WAL.
+    
+    Implementa el subconjunto de Redis que usa Advanced2FAManager (get,
+    setex, delete) más un incremento atómico con caducidad. Al estar en
+    disco, los contadores se comparten entre procesos y sobreviven a un
+    reinicio; cada operación es una búsqueda por clave primaria.
+    """
+    
+    def __init__(self, db_path=KV_DB_PATH):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.last_purge = 0
+        with self._conn() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS kv_store (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    expires_at REAL NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_kv_store_expires ON kv_store(expires_at)')
+    
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+    
+    def get(self, key):
+        row = self._conn().execute(
+            'SELECT value FROM kv_store WHERE key = ? AND expires_at > ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+    
+    def setex(self, key, ttl, value):
+        with self._conn() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO kv_store (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, str(value), time.time() + ttl)
+            )
+        self._maybe_purge()
+        return True
+    
+    def delete(self, key):
+        with self._conn() as conn:
+            return conn.execute('DELETE FROM kv_store WHERE key = ?', (key,)).rowcount
+    
+    def incr_with_expiry(self, key, ttl):
+        """Incrementar un contador; la caducidad se fija al crearlo"""
+        now = time.time()
+        upsert = '''
+            INSERT INTO kv_store (key, value, expires_at) VALUES (?, 1, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                value = CASE WHEN expires_at <= ? THEN 1 ELSE CAST(value AS INTEGER) + 1 END,
+                expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END
+        '''
+        params = (key, now + ttl, now, now)
+        with self._conn() as conn:
+            if SQLITE_RETURNING:
+                value = conn.execute(upsert + ' RETURNING value', params).fetchone()[0]
+            else:
+                # SQLite < 3.35: releer el valor dentro de la misma transacción
+                # de escritura para que nadie lo incremente entre medias
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute(upsert, params)
+                value = conn.execute('SELECT value FROM kv_store WHERE key = ?', (key,)).fetchone()[0]
+        self._maybe_purge()
+        return int(value)
+    
+    def _maybe_purge(self):
+        now = time.time()
+        if now - self.last_purge < KV_PURGE_INTERVAL:
+            return
+        self.last_purge = now
+        with self._conn() as conn:
+            conn.execute('DELETE FROM kv_store WHERE expires_at <= ?', (now,))
 
 class Advanced2FAManager:
     def __init__(self, db_path='/opt/bytefense/system/bytefense.db'):
         self.db_path = db_path
+        self.setup_logging()
         self.secret_key = self.get_or_create_secret_key()
         self.redis_client = self.setup_redis()
-        self.rate_limits = defaultdict(list)
-        self.failed_attempts = defaultdict(int)
         self.setup_database()
-        self.setup_logging()
         
     def setup_redis(self):
-        """Configurar Redis para sesiones y cache"""
+        """Configurar Redis para sesiones y cache; si no está, almacén SQLite local"""
         try:
             import redis
             client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
             client.ping()
             return client
-        except:
-            self.logger.warning("Redis no disponible, usando memoria local")
-            return None
+        except Exception:
+            self.logger.warning("Redis no disponible, usando almacén local SQLite")
+            return LocalKVStore()
+    
+    def incr_with_expiry(self, key, ttl):
+        """Contador atómico que caduca `ttl` segundos después de crearse"""
+        if isinstance(self.redis_client, LocalKVStore):
+            return self.redis_client.incr_with_expiry(key, ttl)
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.set(key, 0, ex=ttl, nx=True)
+        pipe.incr(key)
+        return pipe.execute()[1]
+    
+    def record_failed_attempt(self, ip):
+        """Anotar un intento fallido de la IP y devolver el total en la ventana"""
+        return self.incr_with_expiry(f"failed_attempts:{ip}", FAILED_ATTEMPTS_WINDOW)
+    
+    def get_failed_attempts(self, ip):
+        value = self.redis_client.get(f"failed_attempts:{ip}")
+        return int(value) if value else 0
     
     def setup_logging(self):
         """Configurar logging avanzado"""
@@ -88,8 +190,16 @@ class Advanced2FAManager:
         
         return codes
     
-    def verify_backup_code(self, user_id, code):
-        """Verificar código de respaldo"""
+    def verify_totp(self, secret, token, ip=None):
+        """Verificar token TOTP; un fallo cuenta como intento fallido de la IP"""
+        if pyotp.TOTP(secret).verify(token, valid_window=1):
+            return True
+        if ip:
+            self.record_failed_attempt(ip)
+        return False
+    
+    def verify_backup_code(self, user_id, code, ip=None):
+        """Verificar código de respaldo; un fallo cuenta como intento fallido de la IP"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
@@ -110,6 +220,8 @@ class Advanced2FAManager:
                 return True
         
         conn.close()
+        if ip:
+            self.record_failed_attempt(ip)
         return False
     
     def setup_webauthn(self, user_id):
@@ -125,10 +237,12 @@ class Advanced2FAManager:
                 user_display_name=f"Bytefense User {user_id}"
             )
             
-            # Guardar challenge en Redis/memoria
+            # Guardar challenge en Redis/almacén local
             challenge_key = f"webauthn_challenge_{user_id}"
-            if self.redis_client:
-                self.redis_client.setex(challenge_key, 300, options.challenge)  # 5 min
+            challenge = options.challenge
+            if isinstance(challenge, bytes):
+                challenge = base64.urlsafe_b64encode(challenge).decode()
+            self.redis_client.setex(challenge_key, 300, challenge)  # 5 min
             
             return options
             
@@ -144,20 +258,17 @@ class Advanced2FAManager:
         # Factor 1: Geolocalización
         ip = request_data.get('ip')
         if ip:
-            try:
-                import requests
-                geo_data = requests.get(f"http://ip-api.com/json/{ip}", timeout=5).json()
-                country = geo_data.get('country', 'Unknown')
-                
-                # Lista de países de alto riesgo
-                high_risk_countries = ['CN', 'RU', 'KP', 'IR']
-                if geo_data.get('countryCode') in high_risk_countries:
-                    risk_score += 30
-                    factors.append(f"High-risk country: {country}")
-                    
-            except:
+            geo_data = geoip_lookup(ip)
+            country = geo_data['country'] or 'Unknown'
+            
+            # Lista de países de alto riesgo
+            high_risk_countries = ['CN', 'RU', 'KP', 'IR']
+            if geo_data['country_code'] is None:
                 risk_score += 10
                 factors.append("Unable to verify geolocation")
+            elif geo_data['country_code'] in high_risk_countries:
+                risk_score += 30
+                factors.append(f"High-risk country: {country}")
         
         # Factor 2: Horario inusual
         current_hour = datetime.now().hour
@@ -173,7 +284,7 @@ class Advanced2FAManager:
             factors.append("Suspicious user agent")
         
         # Factor 4: Velocidad de intentos
-        if self.failed_attempts.get(ip, 0) > 3:
+        if ip and self.get_failed_attempts(ip) > 3:
             risk_score += 40
             factors.append("Multiple failed attempts")
         
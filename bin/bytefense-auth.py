@@ -9,27 +9,213 @@ import bcrypt
 import pyotp
 import qrcode
 import io
+import os
 import base64
 import sqlite3
 import secrets
+import hashlib
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from functools import wraps
 from flask import Flask, request, jsonify, session, render_template_string
-from collections import defaultdict
+from collections import OrderedDict
 import logging
 
+# Procesos dedicados a bcrypt y trabajos admitidos a la vez (en curso + en cola)
+PASSWORD_WORKERS = int(os.environ.get('BYTEFENSE_PASSWORD_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+PASSWORD_QUEUE_LIMIT = int(os.environ.get('BYTEFENSE_PASSWORD_QUEUE', PASSWORD_WORKERS * 4))
+PASSWORD_TIMEOUT = 10  # segundos
+# Intentos de login por IP antes de tocar bcrypt
+LOGIN_ATTEMPTS_PER_MINUTE = 10
+LOGIN_MAX_FAILURES = 5
+LOGIN_LOCKOUT_SECONDS = 15 * 60
+LOGIN_MAX_CLIENTS = 100000
+
+# Tokens JWT ya verificados que se mantienen en memoria
+TOKEN_CACHE_SIZE = 4096
+# Filtro de Bloom de revocaciones: 2^20 bits (128 KB), ~1% de falsos
+# positivos con 100.000 tokens revocados
+REVOCATION_BLOOM_BITS = 1 << 20
+REVOCATION_BLOOM_HASHES = 7
+# Cada cuánto se comprueba si otro proceso ha revocado tokens (segundos)
+REVOCATION_SYNC_INTERVAL = 1.0
+
+class BloomFilter:
+    """Filtro de Bloom sobre un bytearray, serializable como BLOB"""
+    
+    def __init__(self, size_bits=REVOCATION_BLOOM_BITS, hashes=REVOCATION_BLOOM_HASHES, data=None):
+        self.size_bits = size_bits
+        self.hashes = hashes
+        self.bits = bytearray(data) if data else bytearray(size_bits // 8)
+    
+    def _positions(self, key: str):
+        digest = hashlib.sha256(key.encode('utf-8')).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.size_bits for i in range(self.hashes)]
+    
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+    
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+    
+    def to_bytes(self) -> bytes:
+        return bytes(self.bits)
+
+class VerifiedTokenCache:
+    """LRU de tokens con firma ya verificada, válidos hasta su `exp`"""
+    
+    def __init__(self, max_size=TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # sha256(token) -> payload
+        self.lock = threading.Lock()
+    
+    def get(self, digest: bytes):
+        with self.lock:
+            payload = self.entries.get(digest)
+            if payload is None:
+                return None
+            if payload['exp'] <= time.time():
+                del self.entries[digest]
+                return None
+            self.entries.move_to_end(digest)
+            return payload
+    
+    def put(self, digest: bytes, payload: dict):
+        with self.lock:
+            self.entries[digest] = payload
+            self.entries.move_to_end(digest)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+    
+    def discard(self, digest: bytes):
+        with self.lock:
+            self.entries.pop(digest, None)
+
+class PasswordHasherBusy(Exception):
+    """No hay hueco en la cola de bcrypt; el cliente debe reintentar"""
+
+class LoginThrottled(Exception):
+    """La IP superó el límite de intentos de login o está bloqueada (429)"""
+
+class PasswordHasher:
+    """bcrypt en un pool de procesos con cola acotada.
+    
+    Cada hash cuesta ~100 ms de CPU; ejecutarlo en el hilo de la petición
+    bloquea al resto durante un ataque de fuerza bruta. Aquí se envía a
+    procesos aparte y, si ya hay `queue_limit` trabajos pendientes, se
+    rechaza al momento en lugar de encolar sin límite.
+    """
+    
+    def __init__(self, workers=PASSWORD_WORKERS, queue_limit=PASSWORD_QUEUE_LIMIT):
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(queue_limit)
+        self.executor = None
+        self.lock = threading.Lock()
+    
+    def _run(self, func, *args):
+        if not self.slots.acquire(blocking=False):
+            raise PasswordHasherBusy("Servicio de autenticación saturado")
+        try:
+            with self.lock:
+                if self.executor is None:
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            future = self.executor.submit(func, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result(timeout=PASSWORD_TIMEOUT)
+    
+    def hash(self, password: bytes) -> bytes:
+        return self._run(bcrypt.hashpw, password, bcrypt.gensalt())
+    
+    def check(self, password: bytes, password_hash: bytes) -> bool:
+        return self._run(bcrypt.checkpw, password, password_hash)
+    
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+
+class LoginThrottle:
+    """Límite de intentos por IP, comprobado antes de cualquier bcrypt.
+    
+    Por IP guarda (inicio de ventana, intentos, fallos seguidos, bloqueada
+    hasta) en un LRU acotado a `max_clients`.
+    
+    El estado vive en la memoria del proceso: si un servidor pre-fork
+    (BYTEFENSE_API_PROCESSES) usara AuthManager, cada proceso aplicaría su
+    propio límite y una IP tendría hasta N × LOGIN_ATTEMPTS_PER_MINUTE
+    intentos. Hoy ningún servidor pre-fork lo usa; si se hace, el estado
+    debe pasar a un almacén compartido como el kv_store de
+    bytefense-auth-2fa.py.
+    """
+    
+    def __init__(self, max_clients=LOGIN_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self.clients = OrderedDict()  # ip -> [window_start, attempts, failures, locked_until]
+        self.lock = threading.Lock()
+    
+    def _entry(self, ip, now):
+        entry = self.clients.get(ip)
+        if entry is None:
+            entry = self.clients[ip] = [now, 0, 0, 0]
+            if len(self.clients) > self.max_clients:
+                self.clients.popitem(last=False)
+        else:
+            self.clients.move_to_end(ip)
+        return entry
+    
+    def allow(self, ip) -> bool:
+        now = time.time()
+        with self.lock:
+            entry = self._entry(ip, now)
+            if entry[3] > now:
+                return False
+            if now - entry[0] >= 60:
+                entry[0], entry[1] = now, 0
+            if entry[1] >= LOGIN_ATTEMPTS_PER_MINUTE:
+                return False
+            entry[1] += 1
+            return True
+    
+    def record(self, ip, success: bool):
+        now = time.time()
+        with self.lock:
+            entry = self._entry(ip, now)
+            if success:
+                entry[2] = 0
+                return
+            entry[2] += 1
+            if entry[2] >= LOGIN_MAX_FAILURES:
+                entry[2] = 0
+                entry[3] = now + LOGIN_LOCKOUT_SECONDS
+
+password_hasher = PasswordHasher()
+
 class AuthManager:
     def __init__(self, db_path='/opt/bytefense/intel/threats.db'):
         self.db_path = db_path
         self.secret_key = self.get_or_create_secret_key()
-        self.rate_limits = defaultdict(list)
-        self.failed_attempts = defaultdict(int)
-        self.setup_database()
+        self.login_throttle = LoginThrottle()
+        self.token_cache = VerifiedTokenCache()
+        self.revocations = BloomFilter()
+        self.revocations_version = None
+        self.revocations_checked = 0
+        self.revocations_lock = threading.Lock()
         
         # Configurar logging
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
+        
+        self.setup_database()
+        self.load_revocations()
     
     def setup_database(self):
         """Configurar tablas de autenticación"""
@@ -96,6 +282,24 @@ class AuthManager:
             )
         ''')
         
+        # Tokens JWT revocados antes de su expiración
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS revoked_tokens (
+                token_id TEXT PRIMARY KEY,
+                expires_at INTEGER NOT NULL,
+                revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Filtro de Bloom de revoked_tokens (una sola fila)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS revocation_filter (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                bits BLOB NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        
         # Crear usuario admin por defecto si no existe
         cursor.execute('SELECT COUNT(*) FROM users WHERE username = ?', ('admin',))
         if cursor.fetchone()[0] == 0:
@@ -122,12 +326,24 @@ class AuthManager:
             return secret
     
     def hash_password(self, password: str) -> str:
-        """Hash de contraseña con bcrypt"""
-        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        """Hash de contraseña con bcrypt (en el pool de procesos)"""
+        return password_hasher.hash(password.encode('utf-8')).decode('utf-8')
     
-    def verify_password(self, password: str, password_hash: str) -> bool:
-        """Verificar contraseña"""
-        return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    def verify_password(self, password: str, password_hash: str, ip_address: str = None) -> bool:
+        """Verificar contraseña
+        
+        Con `ip_address` se aplica antes el límite de intentos de esa IP y se
+        anota el resultado; si se supera se lanza LoginThrottled sin gastar bcrypt.
+        """
+        if ip_address and not self.login_throttle.allow(ip_address):
+            raise LoginThrottled("Demasiados intentos de login")
+        
+        valid = password_hasher.check(password.encode('utf-8'), password_hash.encode('utf-8'))
+        if ip_address:
+            self.login_throttle.record(ip_address, valid)
+            if not valid:
+                self.logger.warning(f"Login fallido desde {ip_address}")
+        return valid
     
     def generate_totp_secret(self) -> str:
         """Generar secreto TOTP"""
@@ -165,19 +381,140 @@ class AuthManager:
             'username': username,
             'role': role,
             'exp': datetime.utcnow() + timedelta(hours=24),
-            'iat': datetime.utcnow()
+            'iat': datetime.utcnow(),
+            'jti': secrets.token_hex(16)
         }
         
         return jwt.encode(payload, self.secret_key, algorithm='HS256')
     
     def verify_jwt_token(self, token: str) -> dict:
-        """Verificar token JWT"""
+        """Verificar token JWT
+        
+        La firma solo se comprueba la primera vez: los tokens válidos quedan
+        en una caché LRU hasta su `exp`. La revocación se consulta siempre,
+        primero en el filtro de Bloom y, si coincide, en revoked_tokens.
+        """
+        digest = hashlib.sha256(token.encode('utf-8')).digest()
+        payload = self.token_cache.get(digest)
+        
+        if payload is None:
+            try:
+                payload = jwt.decode(token, self.secret_key, algorithms=['HS256'])
+            except jwt.ExpiredSignatureError:
+                raise Exception("Token expirado")
+            except jwt.InvalidTokenError:
+                raise Exception("Token inválido")
+            except Exception as e:
+                raise Exception(f"Error verificando token: {str(e)}")
+            self.token_cache.put(digest, payload)
+        
+        if self.is_revoked(self.token_id(payload, digest)):
+            self.token_cache.discard(digest)
+            raise Exception("Token revocado")
+        
+        return dict(payload)
+    
+    def token_id(self, payload: dict, digest: bytes) -> str:
+        """Identificador de revocación: `jti`, o el hash del token si no lo tiene"""
+        return payload.get('jti') or digest.hex()
+    
+    def revoke_jwt_token(self, token: str):
+        """Revocar un token (logout o compromiso) con efecto inmediato"""
         try:
-            payload = jwt.decode(token, self.secret_key, algorithms=['HS256'])
-            return payload
-        except jwt.ExpiredSignatureError:
-            raise Exception("Token expirado")
+            payload = jwt.decode(token, self.secret_key, algorithms=['HS256'],
+                                 options={'verify_exp': False})
         except jwt.InvalidTokenError:
             raise Exception("Token inválido")
-        except Exception as e:
-            raise Exception(f"Error verificando token: {str(e)}")
\ No newline at end of file
+        
+        digest = hashlib.sha256(token.encode('utf-8')).digest()
+        token_id = self.token_id(payload, digest)
+        
+        with self.revocations_lock:
+            self.revocations.add(token_id)
+            conn = sqlite3.connect(self.db_path)
+            try:
+                with conn:
+                    conn.execute(
+                        'INSERT OR IGNORE INTO revoked_tokens (token_id, expires_at) VALUES (?, ?)',
+                        (token_id, int(payload['exp']))
+                    )
+                    # Fusionar con lo que otros procesos hayan añadido
+                    row = conn.execute('SELECT bits FROM revocation_filter WHERE id = 1').fetchone()
+                    if row:
+                        self.revocations.bits = bytearray(
+                            a | b for a, b in zip(self.revocations.bits, row[0])
+                        )
+                    conn.execute('''
+                        INSERT INTO revocation_filter (id, bits, version) VALUES (1, ?, 1)
+                        ON CONFLICT(id) DO UPDATE SET bits = excluded.bits, version = version + 1
+                    ''', (self.revocations.to_bytes(),))
+                    self.revocations_version = conn.execute(
+                        'SELECT version FROM revocation_filter WHERE id = 1'
+                    ).fetchone()[0]
+            finally:
+                conn.close()
+        
+        self.token_cache.discard(digest)
+        self.logger.info(f"Token revocado para {payload.get('username')}")
+    
+    def is_revoked(self, token_id: str) -> bool:
+        """Comprobar revocación; el filtro evita ir a SQLite en el caso normal"""
+        self.sync_revocations()
+        if token_id not in self.revocations:
+            return False
+        
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute(
+                'SELECT 1 FROM revoked_tokens WHERE token_id = ?', (token_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return row is not None
+    
+    def sync_revocations(self):
+        """Recargar el filtro si otro proceso lo ha cambiado"""
+        now = time.monotonic()
+        if now - self.revocations_checked < REVOCATION_SYNC_INTERVAL:
+            return
+        self.revocations_checked = now
+        
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute('SELECT version FROM revocation_filter WHERE id = 1').fetchone()
+        finally:
+            conn.close()
+        if row and row[0] != self.revocations_version:
+            self.load_revocations()
+    
+    def load_revocations(self):
+        """Cargar el filtro de Bloom persistido, purgando antes las revocaciones caducadas"""
+        with self.revocations_lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                with conn:
+                    purged = conn.execute(
+                        'DELETE FROM revoked_tokens WHERE expires_at < ?', (int(time.time()),)
+                    ).rowcount
+                    row = conn.execute(
+                        'SELECT bits, version FROM revocation_filter WHERE id = 1'
+                    ).fetchone()
+                    
+                    if row and not purged and len(row[0]) * 8 == REVOCATION_BLOOM_BITS:
+                        self.revocations = BloomFilter(data=row[0])
+                        self.revocations_version = row[1]
+                    else:
+                        # Reconstruir: los filtros de Bloom no admiten borrados
+                        self.revocations = BloomFilter()
+                        for (token_id,) in conn.execute('SELECT token_id FROM revoked_tokens'):
+                            self.revocations.add(token_id)
+                        conn.execute('''
+                            INSERT INTO revocation_filter (id, bits, version) VALUES (1, ?, 1)
+                            ON CONFLICT(id) DO UPDATE SET bits = excluded.bits, version = version + 1
+                        ''', (self.revocations.to_bytes(),))
+                        self.revocations_version = conn.execute(
+                            'SELECT version FROM revocation_filter WHERE id = 1'
+                        ).fetchone()[0]
+            finally:
+                conn.close()
+            self.revocations_checked = time.monotonic()
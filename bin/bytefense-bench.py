@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bytefense OS - Datos sintéticos y benchmark de la API REST
+
+Genera una bytefense.db a escala (millones de eventos, IPs bloqueadas e
+indicadores, miles de nodos) y lanza contra bytefense-api.py una mezcla de
+GETs del dashboard y heartbeats. El resultado es un JSON con throughput y
+percentiles p50/p95/p99 por endpoint para comparar entre commits.
+
+Uso:
+    bytefense-bench.py generate DB [--events N] [--blocked N] [--intel N] [--nodes N] [--days N]
+    bytefense-bench.py run DB [--url URL] [--duration S] [--concurrency N] [--mix RUTA=PESO,...]
+    bytefense-bench.py all [DB] [opciones de generate y run] [--output FICHERO]
+
+`all` genera la base de datos si no existe, arranca la API sobre ella en
+un puerto libre, ejecuta la carga y la para al terminar.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import sqlite3
+import argparse
+import platform
+import threading
+import subprocess
+import http.client
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+BIN_DIR = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_PATHS = (
+    os.path.join(BIN_DIR, '..', 'system', 'schema.sql'),
+    '/opt/bytefense/system/schema.sql'
+)
+API_SCRIPT = os.path.join(BIN_DIR, 'bytefense-api.py')
+
+# Tamaños por defecto de `generate`
+DEFAULT_EVENTS = 2_000_000
+DEFAULT_BLOCKED = 1_000_000
+DEFAULT_INTEL = 1_000_000
+DEFAULT_NODES = 2_000
+DEFAULT_DAYS = 30
+INSERT_CHUNK = 50_000
+
+# Mezcla por defecto: etiqueta -> (método, ruta, peso)
+DEFAULT_MIX = {
+    'GET /api/status': ('GET', '/api/status', 20),
+    'GET /api/threats': ('GET', '/api/threats', 15),
+    'GET /api/events': ('GET', '/api/events', 15),
+    'GET /api/intel': ('GET', '/api/intel', 5),
+    'GET /api/nodes': ('GET', '/api/nodes', 5),
+    'GET /api/events?limit=100': ('GET', '/api/events?limit=100', 5),
+    'GET /api/threats?limit=100': ('GET', '/api/threats?limit=100', 5),
+    'POST /api/heartbeat': ('POST', '/api/heartbeat', 30)
+}
+DEFAULT_DURATION = 30
+DEFAULT_WARMUP = 3
+DEFAULT_CONCURRENCY = 16
+API_START_TIMEOUT = 120
+
+EVENT_TYPES = (('AUTH_FAIL', 30), ('SCAN', 20), ('BLOCK', 15), ('HONEYPOT', 12),
+               ('IDS_ALERT', 10), ('DNS_BLOCK', 8), ('MALWARE', 3), ('NODE_REGISTER', 2))
+BLOCK_REASONS = (('SSH Brute Force', 35), ('Port Scan', 25), ('Invalid User', 15),
+                 ('Threat Intel', 10), ('Honeypot', 8), ('Web Attack', 5), ('Malware C2', 2))
+INTEL_TYPES = (('ip', 50), ('domain', 30), ('hash', 12), ('url', 8))
+INTEL_SOURCES = ('abuseipdb', 'spamhaus', 'emergingthreats', 'urlhaus', 'malwarebazaar', 'local')
+INTEL_TAGS = ('botnet', 'scanner', 'bruteforce', 'phishing', 'malware', 'c2', 'tor')
+COUNTRIES = ('CN', 'RU', 'US', 'BR', 'IN', 'VN', 'NL', 'DE', 'KR', 'ES')
+
+def load_schema():
+    for path in SCHEMA_PATHS:
+        if os.path.exists(path):
+            with open(path) as f:
+                return f.read()
+    raise FileNotFoundError("No se encuentra system/schema.sql")
+
+def weighted(rng, choices):
+    """Función que elige de [(valor, peso)] con el generador `rng`"""
+    values = [value for value, _ in choices]
+    weights = [weight for _, weight in choices]
+    return lambda: rng.choices(values, weights)[0]
+
+def int_to_ip(value):
+    return f"{value >> 24 & 255}.{value >> 16 & 255}.{value >> 8 & 255}.{value & 255}"
+
+def unique_ip(i, salt):
+    """IP distinta para cada i (multiplicación por un impar módulo 2^32)"""
+    return int_to_ip((i * 2654435761 + salt) & 0xFFFFFFFF)
+
+def chunks(rows, size=INSERT_CHUNK):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def generate(db_path, events=DEFAULT_EVENTS, blocked=DEFAULT_BLOCKED, intel=DEFAULT_INTEL,
+             nodes=DEFAULT_NODES, days=DEFAULT_DAYS, seed=1):
+    """Crear una base de datos con el esquema de system/schema.sql y datos sintéticos.
+
+    Los triggers de agregados se desactivan durante la carga y los
+    agregados se recalculan al final con `bytefense-api.py rebuild-rollups`.
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    span = days * 86400
+
+    def date_ago(seconds):
+        return (now - timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')
+
+    def recent_date():
+        # Más densidad en las últimas horas, como en un nodo real
+        return date_ago(int(min(rng.expovariate(3.0 / span), span)))
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executescript(load_schema())
+    triggers = [name for name, in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger'")]
+    for name in triggers:
+        conn.execute(f"DROP TRIGGER {name}")
+
+    started = time.perf_counter()
+
+    # IPs atacantes con distribución sesgada: unas pocas generan muchos eventos
+    attacker_pool = [unique_ip(i, 0x5EED) for i in range(max(1000, events // 200))]
+
+    def attacker():
+        if rng.random() < 0.5:
+            index = min(int(rng.paretovariate(1.2)) - 1, len(attacker_pool) - 1)
+        else:
+            index = rng.randrange(len(attacker_pool))
+        return attacker_pool[index]
+
+    event_type = weighted(rng, EVENT_TYPES)
+    event_rows = ((t, attacker(), f"10.0.{rng.randrange(256)}.{rng.randrange(1, 255)}",
+                   f"Synthetic {t.lower()} event", rng.randint(1, 5), recent_date())
+                  for t in (event_type() for _ in range(events)))
+    with conn:
+        for batch in chunks(event_rows):
+            conn.executemany("""
+                INSERT INTO events (event_type, source_ip, target_ip, description, severity, date)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, batch)
+
+    reason = weighted(rng, BLOCK_REASONS)
+    blocked_rows = ((unique_ip(i, 0xB10C), reason(), recent_date(), rng.choice(COUNTRIES),
+                     f"AS{rng.randint(1000, 65000)}", int(rng.random() < 0.9))
+                    for i in range(blocked))
+    with conn:
+        for batch in chunks(blocked_rows):
+            conn.executemany("""
+                INSERT OR IGNORE INTO blocked_ips (ip, reason, date, country, asn, active)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, batch)
+
+    intel_type = weighted(rng, INTEL_TYPES)
+
+    def intel_row(i):
+        kind = intel_type()
+        if kind == 'ip':
+            indicator = unique_ip(i, 0x1E7E1)
+        elif kind == 'domain':
+            indicator = f"bad-{i:x}.example.net"
+        elif kind == 'hash':
+            indicator = f"{rng.getrandbits(256):064x}"
+        else:
+            indicator = f"http://bad-{i:x}.example.org/payload"
+        last_seen = recent_date()
+        return (indicator, kind, rng.choice(INTEL_SOURCES), rng.randint(10, 100),
+                ','.join(rng.sample(INTEL_TAGS, rng.randint(1, 3))),
+                min(date_ago(rng.randrange(span)), last_seen), last_seen)
+
+    with conn:
+        for batch in chunks(intel_row(i) for i in range(intel)):
+            conn.executemany("""
+                INSERT INTO threat_intel (indicator, type, source, confidence, tags, first_seen, last_seen)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, batch)
+
+    node_rows = ((f"bench-{i:05d}", f"bench-node-{i:05d}", 'master' if i == 0 else 'satellite',
+                  f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255 or 1}", None, 8080, '1.0.0',
+                  'online' if rng.random() < 0.95 else 'offline',
+                  date_ago(rng.randrange(120)), date_ago(span),
+                  json.dumps({'bench': True, 'rack': i % 40}))
+                 for i in range(nodes))
+    with conn:
+        conn.executemany("""
+            INSERT OR REPLACE INTO registered_nodes
+            (node_id, node_name, node_type, ip_address, public_ip, port, version,
+             status, last_heartbeat, first_registered, metadata)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, node_rows)
+
+    # Volver a crear los triggers (y los índices) antes de entregar la base de datos
+    conn.executescript(load_schema())
+    conn.execute("PRAGMA optimize")
+    conn.close()
+
+    subprocess.run([sys.executable, API_SCRIPT, 'rebuild-rollups'], check=True,
+                   env=dict(os.environ, BYTEFENSE_DB_PATH=os.path.abspath(db_path)),
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+def table_counts(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ('events', 'blocked_ips', 'threat_intel', 'registered_nodes')}
+    finally:
+        conn.close()
+
+def parse_mix(value):
+    """'GET /api/status=20,POST /api/heartbeat=30' o pesos sobre las etiquetas por defecto"""
+    if not value:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for item in value.split(','):
+        label, _, weight = item.rpartition('=')
+        label = label.strip()
+        if ' ' not in label:
+            label = f"GET {label}"
+        method, path = label.split(' ', 1)
+        mix[label] = (method.upper(), path, float(weight))
+    return mix
+
+def percentile(sorted_values, fraction):
+    """Percentil por rango más cercano sobre una lista ordenada"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+class LoadWorker(threading.Thread):
+    """Cliente keep-alive que elige peticiones de la mezcla hasta `deadline`"""
+
+    def __init__(self, host, port, mix, node_ids, seed, warmup_until, deadline):
+        super().__init__(daemon=True)
+        self.host = host
+        self.port = port
+        self.rng = random.Random(seed)
+        self.labels = list(mix)
+        self.weights = [mix[label][2] for label in self.labels]
+        self.mix = mix
+        self.node_ids = node_ids
+        self.warmup_until = warmup_until
+        self.deadline = deadline
+        self.latencies = {label: [] for label in self.labels}
+        self.errors = {label: 0 for label in self.labels}
+        self.statuses = {}
+        self.conn = None
+
+    def _request(self, method, path):
+        body = None
+        headers = {'Accept-Encoding': 'gzip'}
+        if method == 'POST':
+            body = json.dumps({
+                'node_id': self.rng.choice(self.node_ids) if self.node_ids else 'bench-00000',
+                'status': 'online',
+                'metrics': {'cpu': round(self.rng.uniform(1, 90), 1),
+                            'memory': round(self.rng.uniform(10, 90), 1)}
+            })
+            headers['Content-Type'] = 'application/json'
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        self.conn.request(method, path, body=body, headers=headers)
+        response = self.conn.getresponse()
+        response.read()
+        if response.will_close:
+            self.conn.close()
+            self.conn = None
+        return response.status
+
+    def run(self):
+        while True:
+            label = self.rng.choices(self.labels, self.weights)[0]
+            method, path, _ = self.mix[label]
+            start = time.perf_counter()
+            if start >= self.deadline:
+                break
+            try:
+                status = self._request(method, path)
+            except (OSError, http.client.HTTPException):
+                status = None
+                if self.conn:
+                    self.conn.close()
+                self.conn = None
+            elapsed = time.perf_counter() - start
+            if start < self.warmup_until:
+                continue
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status is None or status >= 400:
+                self.errors[label] += 1
+            else:
+                self.latencies[label].append(elapsed)
+        if self.conn:
+            self.conn.close()
+
+def run_load(url, mix, node_ids, duration=DEFAULT_DURATION, concurrency=DEFAULT_CONCURRENCY,
+             warmup=DEFAULT_WARMUP, seed=1):
+    """Lanzar la carga y devolver el informe por endpoint"""
+    target = urlparse(url)
+    start = time.perf_counter()
+    warmup_until = start + warmup
+    deadline = warmup_until + duration
+    workers = [LoadWorker(target.hostname, target.port or 80, mix, node_ids, seed + i,
+                          warmup_until, deadline)
+               for i in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    endpoints = {}
+    statuses = {}
+    total_ok = total_errors = 0
+    for label in mix:
+        latencies = sorted(l for worker in workers for l in worker.latencies[label])
+        errors = sum(worker.errors[label] for worker in workers)
+        total_ok += len(latencies)
+        total_errors += errors
+        endpoints[label] = {
+            'requests': len(latencies),
+            'errors': errors,
+            'throughput_rps': round(len(latencies) / duration, 2),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+            **{name: round(percentile(latencies, fraction) * 1000, 3) if latencies else None
+               for name, fraction in (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99))},
+            'max_ms': round(latencies[-1] * 1000, 3) if latencies else None
+        }
+    for worker in workers:
+        for status, n in worker.statuses.items():
+            statuses[str(status)] = statuses.get(str(status), 0) + n
+
+    return {
+        'total': {
+            'requests': total_ok,
+            'errors': total_errors,
+            'throughput_rps': round(total_ok / duration, 2),
+            'status_codes': statuses
+        },
+        'endpoints': endpoints
+    }
+
+def load_node_ids(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return [node_id for node_id, in conn.execute("SELECT node_id FROM registered_nodes")]
+    finally:
+        conn.close()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_api(db_path, port, extra_env=None):
+    """Arrancar bytefense-api.py sobre `db_path` y esperar a que responda"""
+    env = dict(os.environ, BYTEFENSE_DB_PATH=os.path.abspath(db_path), BYTEFENSE_API_PORT=str(port))
+    env.update(extra_env or {})
+    process = subprocess.Popen([sys.executable, API_SCRIPT], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + API_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"bytefense-api.py terminó con código {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/api/status')
+            conn.getresponse().read()
+            conn.close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("bytefense-api.py no respondió a tiempo")
+
+def git_commit():
+    try:
+        return subprocess.run(['git', '-C', BIN_DIR, 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='bytefense-bench.py',
+                                     description='Datos sintéticos y benchmark de la API REST')
+    parser.add_argument('command', choices=('generate', 'run', 'all'))
+    parser.add_argument('db', nargs='?', default='bytefense-bench.db')
+    parser.add_argument('--events', type=int, default=DEFAULT_EVENTS)
+    parser.add_argument('--blocked', type=int, default=DEFAULT_BLOCKED)
+    parser.add_argument('--intel', type=int, default=DEFAULT_INTEL)
+    parser.add_argument('--nodes', type=int, default=DEFAULT_NODES)
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--url', help='API ya arrancada (por defecto `all` lanza una propia)')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION)
+    parser.add_argument('--warmup', type=float, default=DEFAULT_WARMUP)
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--mix', help="pesos 'GET /api/status=20,POST /api/heartbeat=30'")
+    parser.add_argument('--processes', type=int, default=1, help='BYTEFENSE_API_PROCESSES de la API lanzada')
+    parser.add_argument('--output', help='fichero JSON de resultados (por defecto stdout)')
+    args = parser.parse_args(argv)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+    if args.command == 'generate' or (args.command == 'all' and not os.path.exists(args.db)):
+        if args.command == 'generate' and os.path.exists(args.db):
+            print(f"❌ {args.db} ya existe", file=sys.stderr)
+            return 1
+        print(f"🧪 Generando {args.db}...", file=sys.stderr)
+        report['generate_seconds'] = round(generate(args.db, args.events, args.blocked, args.intel,
+                                                    args.nodes, args.days, args.seed), 2)
+        if args.command == 'generate':
+            report['tables'] = table_counts(args.db)
+            print(json.dumps(report, indent=2))
+            return 0
+
+    report['tables'] = table_counts(args.db)
+    mix = parse_mix(args.mix)
+    report['load'] = {
+        'duration': args.duration,
+        'warmup': args.warmup,
+        'concurrency': args.concurrency,
+        'processes': args.processes,
+        'mix': {label: weight for label, (_, _, weight) in mix.items()}
+    }
+
+    process = None
+    url = args.url
+    if url is None:
+        if args.command == 'run':
+            url = f"http://127.0.0.1:{os.environ.get('BYTEFENSE_API_PORT', 8080)}"
+        else:
+            port = free_port()
+            process = start_api(args.db, port, {'BYTEFENSE_API_PROCESSES': str(args.processes)})
+            url = f"http://127.0.0.1:{port}"
+
+    try:
+        print(f"🚀 Carga contra {url} durante {args.duration}s...", file=sys.stderr)
+        report.update(run_load(url, mix, load_node_ids(args.db), args.duration,
+                               args.concurrency, args.warmup, args.seed))
+    finally:
+        if process:
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
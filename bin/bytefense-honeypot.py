@@ -7,16 +7,17 @@ Bytefense OS - Sistema de Honeypots Inteligentes
 import socket
 import threading
 import time
-import sqlite3
 import json
 import random
 import string
 from datetime import datetime
 import subprocess
+from bytefense_events import utc_since
+from bytefense_storage import open_storage, INTEL_DB
 
 class IntelligentHoneypot:
     def __init__(self):
-        self.db_path = '/opt/bytefense/intel/threats.db'
+        self.db_path = INTEL_DB
         self.honeypots = {
             'ssh': {'port': 2222, 'service': 'SSH'},
             'ftp': {'port': 2121, 'service': 'FTP'},
@@ -26,6 +27,9 @@ class IntelligentHoneypot:
         }
         self.fake_responses = self.load_fake_responses()
         self.running = True
+        
+        # Esquema al día (índice events(source_ip, date) para auto_block_aggressive_ips)
+        self.storage = open_storage(self.db_path)
     
     def load_fake_responses(self):
         """Cargar respuestas falsas convincentes"""
@@ -189,27 +193,16 @@ class IntelligentHoneypot:
         return 'Unknown'
     
     def log_honeypot_activity(self, activity_type, source_ip, details):
-        """Registrar actividad del honeypot"""
+        """Registrar actividad del honeypot (tipos nuevos: añadir a HONEYPOT_EVENT_TYPES)"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
             description = f"{activity_type} from {source_ip}: {json.dumps(details)}"
             
-            cursor.execute(
-                "INSERT INTO events (event_type, source_ip, description, severity, date) VALUES (?, ?, ?, ?, ?)",
-                (activity_type, source_ip, description, 2, datetime.now())
-            )
+            # Vía bytefense_ingest: se confirma en lote junto con el resto de productores
+            self.storage.submit_event(activity_type, description, source_ip, severity=2)
             
             # También agregar IP a lista de amenazas si es un intento de login
             if 'login_attempt' in activity_type:
-                cursor.execute(
-                    "INSERT OR IGNORE INTO blocked_ips (ip, reason, date) VALUES (?, ?, ?)",
-                    (source_ip, f"Honeypot {activity_type}", datetime.now())
-                )
-            
-            conn.commit()
-            conn.close()
+                self.storage.submit_blocked_ip(source_ip, f"Honeypot {activity_type}")
             
             print(f"[HONEYPOT] {activity_type} from {source_ip}")
             
@@ -222,16 +215,8 @@ class IntelligentHoneypot:
     def auto_block_aggressive_ips(self, ip):
         """Bloquear automáticamente IPs agresivas"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Contar eventos de esta IP en la última hora
-            cursor.execute(
-                "SELECT COUNT(*) FROM events WHERE source_ip = ? AND date > datetime('now', '-1 hour')",
-                (ip,)
-            )
-            
-            count = cursor.fetchone()[0]
+            # Contar eventos de esta IP en la última hora (sólo particiones de ese intervalo)
+            count = self.storage.count_events(utc_since(hours=1), source_ip=ip)
             
             if count >= 5:  # 5 o más intentos en una hora
                 # Bloquear con UFW
@@ -241,7 +226,5 @@ class IntelligentHoneypot:
                 except subprocess.CalledProcessError:
                     print(f"[ERROR] Failed to block IP {ip}")
             
-            conn.close()
-            
         except Exception as e:
             print(f"Error in auto-block: {e}")
\ No newline at end of file
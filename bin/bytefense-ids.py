@@ -6,7 +6,6 @@ Bytefense OS - Sistema de Detección de Intrusiones Avanzado
 
 import re
 import time
-import sqlite3
 import threading
 import subprocess
 import json
@@ -15,10 +14,12 @@ from datetime import datetime, timedelta
 import psutil
 import hashlib
 import os
+from bytefense_storage import open_storage, INTEL_DB
 
 class AdvancedIDS:
     def __init__(self):
-        self.db_path = '/opt/bytefense/intel/threats.db'
+        self.db_path = INTEL_DB
+        self.storage = open_storage(self.db_path)
         self.patterns = self.load_attack_patterns()
         self.connection_tracker = defaultdict(lambda: deque(maxlen=100))
         self.process_baseline = self.create_process_baseline()
@@ -172,16 +173,7 @@ class AdvancedIDS:
     def log_suspicious_activity(self, activity_type, description):
         """Registrar actividad sospechosa"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                "INSERT INTO events (event_type, description, severity, date) VALUES (?, ?, ?, ?)",
-                (activity_type, description, 3, datetime.now())
-            )
-            
-            conn.commit()
-            conn.close()
+            self.storage.submit_event(activity_type, description, severity=3)
             
             print(f"[IDS ALERT] {activity_type}: {description}")
             
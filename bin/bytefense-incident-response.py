@@ -5,7 +5,6 @@ Bytefense OS - Sistema de Respuesta Automática a Incidentes (SOAR)
 """
 
 import json
-import sqlite3
 import subprocess
 import time
 import threading
@@ -14,8 +13,9 @@ from typing import Dict, List, Optional
 import logging
 from enum import Enum
 import smtplib
-from email.mime.text import MimeText
+from email.mime.text import MIMEText
 import requests
+from bytefense_storage import open_storage, db_date, SYSTEM_DB
 
 class IncidentSeverity(Enum):
     LOW = 1
@@ -30,7 +30,7 @@ class IncidentStatus(Enum):
     CLOSED = "closed"
 
 class AutomatedIncidentResponse:
-    def __init__(self, db_path='/opt/bytefense/system/bytefense.db'):
+    def __init__(self, db_path=SYSTEM_DB):
         self.db_path = db_path
         self.playbooks = self.load_playbooks()
         self.setup_logging()
@@ -50,44 +50,8 @@ class AutomatedIncidentResponse:
         self.logger = logging.getLogger(__name__)
     
     def setup_database(self):
-        """Configurar base de datos de incidentes"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS incidents (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                description TEXT,
-                severity INTEGER NOT NULL,
-                status TEXT NOT NULL,
-                source_ip TEXT,
-                target_ip TEXT,
-                attack_type TEXT,
-                indicators TEXT,
-                created_at DATETIME NOT NULL,
-                updated_at DATETIME NOT NULL,
-                resolved_at DATETIME,
-                playbook_executed TEXT,
-                actions_taken TEXT,
-                analyst_notes TEXT
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS incident_timeline (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                incident_id INTEGER,
-                timestamp DATETIME NOT NULL,
-                action TEXT NOT NULL,
-                details TEXT,
-                automated BOOLEAN DEFAULT 1,
-                FOREIGN KEY (incident_id) REFERENCES incidents (id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        """Abrir la base de datos (tablas incidents e incident_timeline: migración 7)"""
+        self.storage = open_storage(self.db_path)
     
     def load_playbooks(self):
         """Cargar playbooks de respuesta automática"""
@@ -144,10 +108,8 @@ class AutomatedIncidentResponse:
                        source_ip: str = None, target_ip: str = None, 
                        attack_type: str = None, indicators: List[str] = None) -> int:
         """Crear nuevo incidente"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        now = db_date()
+        cursor = self.storage.execute('''
             INSERT INTO incidents 
             (title, description, severity, status, source_ip, target_ip, 
              attack_type, indicators, created_at, updated_at)
@@ -156,12 +118,10 @@ class AutomatedIncidentResponse:
             title, description, severity.value, IncidentStatus.OPEN.value,
             source_ip, target_ip, attack_type, 
             json.dumps(indicators) if indicators else None,
-            datetime.now(), datetime.now()
+            now, now
         ))
         
         incident_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
         
         self.logger.info(f"Created incident {incident_id}: {title}")
         
@@ -218,14 +178,10 @@ class AutomatedIncidentResponse:
                 })
         
         # Guardar acciones tomadas
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
+        self.storage.execute(
             'UPDATE incidents SET actions_taken = ?, playbook_executed = ? WHERE id = ?',
             (json.dumps(actions_taken), playbook['name'], incident_id)
         )
-        conn.commit()
-        conn.close()
     
     def execute_action(self, incident_id: int, action: Dict) -> str:
         """Ejecutar acción específica"""
@@ -249,11 +205,7 @@ class AutomatedIncidentResponse:
     def block_ip_action(self, incident_id: int, action: Dict) -> str:
         """Bloquear IP maliciosa"""
         # Obtener IP del incidente
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT source_ip FROM incidents WHERE id = ?', (incident_id,))
-        result = cursor.fetchone()
-        conn.close()
+        result = self.storage.query_one('SELECT source_ip FROM incidents WHERE id = ?', (incident_id,))
         
         if not result or not result[0]:
             return "No source IP found"
@@ -280,11 +232,7 @@ class AutomatedIncidentResponse:
         method = action.get('method', 'email')
         
         # Obtener detalles del incidente
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM incidents WHERE id = ?', (incident_id,))
-        incident = cursor.fetchone()
-        conn.close()
+        incident = self.storage.query_one('SELECT * FROM incidents WHERE id = ?', (incident_id,))
         
         if not incident:
             return "Incident not found"
@@ -323,11 +271,7 @@ class AutomatedIncidentResponse:
     def isolate_host_action(self, incident_id: int, action: Dict) -> str:
         """Aislar host comprometido"""
         # Obtener IP del incidente
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT target_ip FROM incidents WHERE id = ?', (incident_id,))
-        result = cursor.fetchone()
-        conn.close()
+        result = self.storage.query_one('SELECT target_ip FROM incidents WHERE id = ?', (incident_id,))
         
         if not result or not result[0]:
             return "No target IP found"
@@ -374,30 +318,15 @@ class AutomatedIncidentResponse:
     
     def add_timeline_entry(self, incident_id: int, action: str, details: str):
         """Agregar entrada al timeline del incidente"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO incident_timeline (incident_id, timestamp, action, details)
-            VALUES (?, ?, ?, ?)
-        ''', (incident_id, datetime.now(), action, details))
-        
-        conn.commit()
-        conn.close()
+        self.storage.submit('incident_timeline', (incident_id, db_date(), action, details))
     
     def update_incident_status(self, incident_id: int, status: IncidentStatus):
         """Actualizar estado del incidente"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute(
+        self.storage.execute(
             'UPDATE incidents SET status = ?, updated_at = ? WHERE id = ?',
-            (status.value, datetime.now(), incident_id)
+            (status.value, db_date(), incident_id)
         )
         
-        conn.commit()
-        conn.close()
-        
         self.add_timeline_entry(incident_id, "status_changed", f"Status changed to {status.value}")
     
     def unblock_ip(self, ip: str):
@@ -6,7 +6,6 @@ Bytefense OS - Sistema de Threat Intelligence Avanzado
 
 import requests
 import json
-import sqlite3
 import time
 import hashlib
 import threading
@@ -19,9 +18,11 @@ from concurrent.futures import ThreadPoolExecutor
 import ipaddress
 import dns.resolver
 import whois
+from bytefense_geoip import lookup as geoip_lookup
+from bytefense_storage import open_storage, db_date, INTEL_DB
 
 class AdvancedThreatIntelligence:
-    def __init__(self, db_path='/opt/bytefense/intel/threats.db'):
+    def __init__(self, db_path=INTEL_DB):
         self.db_path = db_path
         self.feeds = self.load_threat_feeds()
         self.api_keys = self.load_api_keys()
@@ -77,64 +78,9 @@ class AdvancedThreatIntelligence:
         self.logger = logging.getLogger(__name__)
     
     def setup_database(self):
-        """Configurar base de datos extendida"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Tabla de indicadores enriquecidos
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS threat_indicators (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                indicator TEXT NOT NULL,
-                type TEXT NOT NULL,
-                confidence INTEGER DEFAULT 50,
-                severity TEXT DEFAULT 'medium',
-                source TEXT NOT NULL,
-                tags TEXT,
-                context TEXT,
-                first_seen DATETIME NOT NULL,
-                last_seen DATETIME NOT NULL,
-                ttl INTEGER DEFAULT 86400,
-                metadata TEXT,
-                active BOOLEAN DEFAULT 1
-            )
-        ''')
-        
-        # Tabla de análisis de malware
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS malware_analysis (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                hash_md5 TEXT,
-                hash_sha1 TEXT,
-                hash_sha256 TEXT,
-                file_type TEXT,
-                file_size INTEGER,
-                family TEXT,
-                analysis_date DATETIME,
-                sandbox_report TEXT,
-                yara_matches TEXT,
-                behavior TEXT
-            )
-        ''')
-        
-        # Tabla de campañas de ataque
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS attack_campaigns (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT,
-                threat_actor TEXT,
-                start_date DATETIME,
-                end_date DATETIME,
-                indicators TEXT,
-                ttps TEXT,
-                targets TEXT,
-                active BOOLEAN DEFAULT 1
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        """Abrir la base de datos (threat_indicators, malware_analysis y
+        attack_campaigns con su clave única e índices: bytefense_schema)"""
+        self.storage = open_storage(self.db_path)
     
     def enrich_ip_indicator(self, ip: str) -> Dict:
         """Enriquecer indicador IP con múltiples fuentes"""
@@ -149,26 +95,19 @@ class AdvancedThreatIntelligence:
             'domains': []
         }
         
-        # Geolocalización
-        try:
-            geo_response = requests.get(f'http://ip-api.com/json/{ip}', timeout=10)
-            if geo_response.status_code == 200:
-                enrichment['geolocation'] = geo_response.json()
-        except Exception as e:
-            self.logger.warning(f"Error getting geolocation for {ip}: {e}")
-        
-        # Información ASN
-        try:
-            asn_response = requests.get(f'https://ipapi.co/{ip}/json/', timeout=10)
-            if asn_response.status_code == 200:
-                data = asn_response.json()
-                enrichment['asn'] = {
-                    'asn': data.get('asn'),
-                    'org': data.get('org'),
-                    'isp': data.get('isp')
-                }
-        except Exception as e:
-            self.logger.warning(f"Error getting ASN for {ip}: {e}")
+        # Geolocalización y ASN (tablas locales de bytefense_geoip)
+        geo_data = geoip_lookup(ip)
+        if geo_data['country_code']:
+            enrichment['geolocation'] = {
+                'country': geo_data['country'],
+                'countryCode': geo_data['country_code']
+            }
+        if geo_data['asn']:
+            enrichment['asn'] = {
+                'asn': f"AS{geo_data['asn']}",
+                'org': geo_data['as_org'],
+                'isp': geo_data['as_org']
+            }
         
         # VirusTotal (si hay API key)
         if self.api_keys.get('virustotal'):
@@ -258,19 +197,14 @@ class AdvancedThreatIntelligence:
     def detect_attack_campaign(self, indicators: List[str]) -> Optional[Dict]:
         """Detectar campañas de ataque basadas en indicadores"""
         # Buscar patrones en indicadores
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Buscar indicadores relacionados
+        # Buscar indicadores relacionados (igualdad exacta: usa el índice de indicator)
         related_indicators = []
-        for indicator in indicators:
-            cursor.execute(
-                'SELECT * FROM threat_indicators WHERE indicator LIKE ? OR tags LIKE ?',
-                (f'%{indicator}%', f'%{indicator}%')
+        if indicators:
+            placeholders = ', '.join('?' * len(indicators))
+            related_indicators = self.storage.query(
+                f'SELECT * FROM threat_indicators WHERE indicator IN ({placeholders})',
+                list(indicators)
             )
-            related_indicators.extend(cursor.fetchall())
-        
-        conn.close()
         
         if len(related_indicators) >= 3:  # Umbral mínimo para campaña
             campaign = {
@@ -329,41 +263,37 @@ class AdvancedThreatIntelligence:
     
     def process_json_feed(self, source: str, feed_name: str, data: Dict):
         """Procesar feed en formato JSON"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        indicators_added = 0
+        now = db_date()
+        rows = []
         
         # Procesar según la estructura del feed
         if source == 'abuse_ch' and feed_name == 'feodo_tracker':
             for item in data:
                 if 'ip_address' in item:
-                    cursor.execute('''
-                        INSERT OR REPLACE INTO threat_indicators 
-                        (indicator, type, source, confidence, first_seen, last_seen, metadata)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (
+                    rows.append((
                         item['ip_address'],
                         'ip',
                         f'{source}/{feed_name}',
                         80,
-                        datetime.now(),
-                        datetime.now(),
+                        now,
+                        now,
                         json.dumps(item)
                     ))
-                    indicators_added += 1
         
-        conn.commit()
-        conn.close()
+        # Todo el feed en una transacción
+        self.storage.executemany('''
+            INSERT OR REPLACE INTO threat_indicators 
+            (indicator, type, source, confidence, first_seen, last_seen, metadata)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        indicators_added = len(rows)
         
         self.logger.info(f"Added {indicators_added} indicators from {source}/{feed_name}")
     
     def process_text_feed(self, source: str, feed_name: str, data: str):
         """Procesar feed en formato texto"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        indicators_added = 0
+        now = db_date()
+        rows = []
         
         for line in data.split('\n'):
             line = line.strip()
@@ -372,22 +302,22 @@ class AdvancedThreatIntelligence:
                 indicator_type = self.detect_indicator_type(line)
                 
                 if indicator_type:
-                    cursor.execute('''
-                        INSERT OR REPLACE INTO threat_indicators 
-                        (indicator, type, source, confidence, first_seen, last_seen)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (
+                    rows.append((
                         line,
                         indicator_type,
                         f'{source}/{feed_name}',
                         70,
-                        datetime.now(),
-                        datetime.now()
+                        now,
+                        now
                     ))
-                    indicators_added += 1
         
-        conn.commit()
-        conn.close()
+        # Todo el feed en una transacción
+        self.storage.executemany('''
+            INSERT OR REPLACE INTO threat_indicators 
+            (indicator, type, source, confidence, first_seen, last_seen)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        indicators_added = len(rows)
         
         self.logger.info(f"Added {indicators_added} indicators from {source}/{feed_name}")
     
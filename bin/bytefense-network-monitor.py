@@ -11,7 +11,6 @@ import subprocess
 import json
 import time
 import requests
-import sqlite3
 import threading
 import re
 import os
@@ -19,15 +18,22 @@ from collections import defaultdict, deque
 from datetime import datetime, timedelta
 from flask import Flask, jsonify, request
 from flask_cors import CORS
+from bytefense_prefork import serve_wsgi_app, worker_count
+from bytefense_schema import NETWORK_MONITOR_SCHEMA
+from bytefense_storage import open_storage, NETWORK_MONITOR_DB, INTEL_DB
+from bytefense_archive import EventArchive
 import joblib
 import numpy as np
 from sklearn.ensemble import IsolationForest
 from sklearn.cluster import DBSCAN
 from sklearn.preprocessing import StandardScaler
 
+# Historia de eventos para los modelos (archivo columnar, bytefense_archive.py)
+AI_HISTORY_DAYS = int(os.environ.get('BYTEFENSE_AI_HISTORY_DAYS', 90))
+
 class AdvancedNetworkMonitor:
     def __init__(self):
-        self.db_path = 'c:/proyectos/bytefense/data/network_monitor.db'
+        self.db_path = NETWORK_MONITOR_DB
         self.ai_models_path = 'c:/proyectos/bytefense/models/'
         self.setup_database()
         self.setup_ai_models()
@@ -56,69 +62,7 @@ class AdvancedNetworkMonitor:
         
     def setup_database(self):
         """Configurar base de datos SQLite"""
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Tabla de actividad de red por nodo
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS network_activity (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                node_ip TEXT,
-                node_name TEXT,
-                app_name TEXT,
-                bandwidth_down REAL,
-                bandwidth_up REAL,
-                connections_count INTEGER,
-                risk_level TEXT,
-                category TEXT
-            )
-        ''')
-        
-        # Tabla de sitios visitados
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS visited_sites (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                node_ip TEXT,
-                url TEXT,
-                domain TEXT,
-                category TEXT,
-                risk_level TEXT,
-                blocked BOOLEAN DEFAULT FALSE,
-                response_time REAL
-            )
-        ''')
-        
-        # Tabla de topología de red
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS network_topology (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                source_ip TEXT,
-                dest_ip TEXT,
-                protocol TEXT,
-                port INTEGER,
-                status TEXT
-            )
-        ''')
-        
-        # Tabla de análisis de IA
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ai_analysis (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                analysis_type TEXT,
-                node_ip TEXT,
-                anomaly_score REAL,
-                threat_level TEXT,
-                details TEXT
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        self.storage = open_storage(self.db_path, migrations=False, schema=NETWORK_MONITOR_SCHEMA)
     
     def setup_ai_models(self):
         """Configurar modelos de IA"""
@@ -306,6 +250,29 @@ class AdvancedNetworkMonitor:
             print(f"Error generating AI insights: {e}")
             return insights
     
+    def get_network_metrics(self):
+        """Matriz de características de los eventos de los últimos
+        AI_HISTORY_DAYS días: hora, día de la semana, severidad, tipo y
+        eventos de la misma IP en el periodo. Las particiones cerradas
+        llegan con mmap desde el archivo y el mes en curso de SQLite; todo
+        se combina con NumPy, sin bucles por evento."""
+        arrays, _ = EventArchive(INTEL_DB).load(('date', 'event_type', 'source_ip', 'severity'),
+                                                since=time.time() - AI_HISTORY_DAYS * 86400,
+                                                tail=True)
+        # Fechas que no se pudieron leer (NaT): sin hora ni día de la semana
+        valid = ~np.isnat(arrays['date'])
+        if not valid.all():
+            arrays = {column: array[valid] for column, array in arrays.items()}
+        seconds = arrays['date'].astype(np.int64)
+        ip_counts = np.bincount(arrays['source_ip'])[arrays['source_ip']] if len(seconds) else seconds
+        return np.column_stack((
+            (seconds // 3600) % 24,
+            (seconds // 86400 + 3) % 7,  # 1970-01-01 fue jueves: 0 = lunes
+            arrays['severity'],
+            arrays['event_type'],
+            ip_counts,
+        )).astype(np.float32)
+    
     def get_network_topology(self):
         """Generar mapa de topología de red"""
         topology = {
@@ -435,4 +402,5 @@ def get_statistics():
     return jsonify(monitor.get_network_statistics())
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=False)
\ No newline at end of file
+    # BYTEFENSE_API_PROCESSES > 1 arranca varios procesos con SO_REUSEPORT
+    serve_wsgi_app(app, '0.0.0.0', 5001, worker_count(os.environ.get('BYTEFENSE_API_PROCESSES', 1)))
\ No newline at end of file
@@ -5,51 +5,23 @@
 import os
 import json
 import time
-import sqlite3
 import requests
 import subprocess
 from datetime import datetime
 from flask import Flask, render_template, jsonify
+from bytefense_schema import SPEEDTEST_SCHEMA
+from bytefense_storage import open_storage, SPEEDTEST_DB
 
 class BytefenseSpeedTest:
     def __init__(self):
-        self.db_path = "/opt/bytefense/system/speedtest.db"
+        self.db_path = SPEEDTEST_DB
         self.config_path = "/opt/bytefense/system/speedtest-config.json"
         self.init_database()
         self.load_config()
     
     def init_database(self):
         """Inicializar base de datos para resultados de speedtest"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS speedtest_results (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                download_speed REAL,
-                upload_speed REAL,
-                ping REAL,
-                jitter REAL,
-                server_info TEXT,
-                test_type TEXT DEFAULT 'auto'
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS network_stats (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                interface_name TEXT,
-                bytes_sent INTEGER,
-                bytes_recv INTEGER,
-                packets_sent INTEGER,
-                packets_recv INTEGER
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        self.storage = open_storage(self.db_path, migrations=False, schema=SPEEDTEST_SCHEMA)
     
     def load_config(self):
         """Cargar configuración del speedtest"""
@@ -122,10 +94,7 @@ class BytefenseSpeedTest:
     
     def save_result(self, result):
         """Guardar resultado en base de datos"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        self.storage.execute('''
             INSERT INTO speedtest_results 
             (download_speed, upload_speed, ping, jitter, server_info, test_type)
             VALUES (?, ?, ?, ?, ?, ?)
@@ -138,18 +107,12 @@ class BytefenseSpeedTest:
             result['test_type']
         ))
         
-        conn.commit()
-        conn.close()
-        
         # Limpiar resultados antiguos
         self.cleanup_old_results()
     
     def cleanup_old_results(self):
         """Limpiar resultados antiguos"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        self.storage.execute('''
             DELETE FROM speedtest_results 
             WHERE id NOT IN (
                 SELECT id FROM speedtest_results 
@@ -157,9 +120,6 @@ class BytefenseSpeedTest:
                 LIMIT ?
             )
         ''', (self.config['max_results'],))
-        
-        conn.commit()
-        conn.close()
     
     def check_alerts(self, download, upload, ping):
         """Verificar si se deben enviar alertas"""
@@ -200,19 +160,13 @@ class BytefenseSpeedTest:
     
     def get_recent_results(self, limit=24):
         """Obtener resultados recientes"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        results = self.storage.query('''
             SELECT timestamp, download_speed, upload_speed, ping, test_type
             FROM speedtest_results 
             ORDER BY timestamp DESC 
             LIMIT ?
         ''', (limit,))
         
-        results = cursor.fetchall()
-        conn.close()
-        
         return [{
             'timestamp': row[0],
             'download': row[1],
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bytefense OS - Archivo columnar de las particiones cerradas de events
+
+El motor de IA y el monitor de red entrenan con meses de historia. Leerla
+fila a fila de SQLite y convertirla en bucles de Python es lento y ocupa
+mucha memoria, así que cada partición cerrada (su intervalo acaba antes
+de hoy) se copia a un directorio con un fichero .npy por columna,
+ordenado por fecha:
+
+    date         datetime64[s] (UTC)
+    id           int64
+    severity     int8
+    event_type, source_ip, target_ip, description
+                 códigos uint8/uint16/uint32 según el tamaño del diccionario,
+                 que se guarda aparte comprimido (<columna>.dict.gz)
+
+Los .npy no se comprimen para poder abrirlos con mmap: la compresión viene
+de la codificación por diccionario y de los tipos estrechos. El lector
+devuelve vistas de sólo las columnas pedidas, recortadas por fecha con
+búsqueda binaria, sin copiar datos ni pasar por Python fila a fila.
+
+meta.json guarda filas y id máximo de lo archivado: si una partición
+cerrada recibe filas tarde (cola de ingesta, relojes desfasados) se
+vuelve a archivar. bytefense_events.py sólo borra por retención las
+particiones cuyo archivo coincide con la tabla en ese momento; el
+archivo tiene su propia retención (BYTEFENSE_ARCHIVE_RETENTION_DAYS).
+
+Uso:
+    bytefense_archive.py archive DB [--dir DIR]
+    bytefense_archive.py list DB [--dir DIR]
+"""
+
+import os
+import sys
+import gzip
+import json
+import shutil
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+
+from bytefense_events import (EVENT_COLUMNS, EVENTS_VIEW, LEGACY_PARTITION, list_partitions,
+                              partition_ranges, partition_stats)
+from bytefense_storage import connect, db_date, INTEL_DB
+
+ARCHIVE_DIR = os.environ.get('BYTEFENSE_ARCHIVE_DIR', "/opt/bytefense/archive/events")
+ARCHIVE_RETENTION_DAYS = int(os.environ.get('BYTEFENSE_ARCHIVE_RETENTION_DAYS', 730))
+ARCHIVE_VERSION = 2                     # 2: meta.json con max_id
+ARCHIVE_FETCH_SIZE = 50000
+
+DICTIONARY_COLUMNS = ('event_type', 'source_ip', 'target_ip', 'description')
+NUMERIC_COLUMNS = {'id': np.int64, 'severity': np.int8}
+
+def archive_root(db_path, archive_dir=ARCHIVE_DIR):
+    """Directorio del archivo de una base: <archive_dir>/<nombre sin extensión>"""
+    return os.path.join(archive_dir, os.path.splitext(os.path.basename(db_path))[0])
+
+def to_datetime64(value):
+    """Fecha de la base (cadena UTC, datetime local, timestamp) a datetime64[s]"""
+    return np.datetime64(db_date(value)[:19].replace(' ', 'T'), 's')
+
+def code_dtype(size):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if size <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+def encode(values):
+    """(códigos, diccionario) de una columna de texto; None es un valor más"""
+    dictionary = {}
+    codes = np.fromiter((dictionary.setdefault(value, len(dictionary)) for value in values),
+                        dtype=np.uint64, count=len(values))
+    return codes.astype(code_dtype(len(dictionary))), list(dictionary)
+
+def parse_dates(values):
+    try:
+        return np.array(values, dtype='datetime64[s]')
+    except ValueError:
+        # Alguna fecha con otro formato: NaT, que queda al final al ordenar
+        dates = np.empty(len(values), dtype='datetime64[s]')
+        for i, value in enumerate(values):
+            try:
+                dates[i] = np.datetime64(str(value)[:19].replace(' ', 'T'), 's')
+            except ValueError:
+                dates[i] = np.datetime64('NaT')
+        return dates
+
+def fetch_columns(cursor, names):
+    """{columna: lista de valores} de todas las filas de un cursor, por lotes"""
+    columns = {column: [] for column in names}
+    while True:
+        rows = cursor.fetchmany(ARCHIVE_FETCH_SIZE)
+        if not rows:
+            break
+        for column, values in zip(names, zip(*rows)):
+            columns[column].extend(values)
+    return columns
+
+def to_columnar(columns):
+    """({columna: array ordenado por fecha}, {columna: diccionario}); `columns`
+    debe incluir 'date'"""
+    dates = parse_dates(columns['date'])
+    order = np.argsort(dates, kind='stable')
+    arrays = {'date': dates[order]}
+    dictionaries = {}
+    for column, values in columns.items():
+        if column in NUMERIC_COLUMNS:
+            arrays[column] = np.array([value or 0 for value in values],
+                                      dtype=NUMERIC_COLUMNS[column])[order]
+        elif column in DICTIONARY_COLUMNS:
+            codes, dictionaries[column] = encode(values)
+            arrays[column] = codes[order]
+    return arrays, dictionaries
+
+def write_partition(conn, name, target):
+    """Escribir (o reemplazar) el archivo de la partición `name` en `target`;
+    devuelve (filas, id máximo) de lo archivado"""
+    columns = fetch_columns(conn.execute(f"SELECT {', '.join(EVENT_COLUMNS)} FROM {name} ORDER BY id"),
+                            EVENT_COLUMNS)
+    max_id = columns['id'][-1] if columns['id'] else 0
+    arrays, dictionaries = to_columnar(columns)
+    dates = arrays['date']
+
+    tmp_target = target + '.tmp'
+    shutil.rmtree(tmp_target, ignore_errors=True)
+    os.makedirs(tmp_target)
+    for column, array in arrays.items():
+        np.save(os.path.join(tmp_target, f"{column}.npy"), array)
+    for column, dictionary in dictionaries.items():
+        with gzip.open(os.path.join(tmp_target, f"{column}.dict.gz"), 'wt', encoding='utf-8') as f:
+            json.dump(dictionary, f, separators=(',', ':'))
+
+    valid = arrays['date'][~np.isnat(arrays['date'])]
+    meta = {
+        'version': ARCHIVE_VERSION,
+        'partition': name,
+        'rows': len(dates),
+        'max_id': max_id,
+        'first': str(valid[0]) if len(valid) else None,
+        'last': str(valid[-1]) if len(valid) else None,
+        'columns': {column: str(array.dtype) for column, array in arrays.items()},
+        'dictionaries': list(dictionaries),
+        'archived_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    # meta.json al final y rename del directorio: una partición a medias nunca se lee
+    with open(os.path.join(tmp_target, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    old_target = target + '.old'
+    if os.path.exists(target):
+        shutil.rmtree(old_target, ignore_errors=True)
+        os.rename(target, old_target)
+    os.rename(tmp_target, target)
+    shutil.rmtree(old_target, ignore_errors=True)
+    return meta['rows'], max_id
+
+def archived_stats(target):
+    """(filas, id máximo) según el archivo de una partición; None si no está archivada"""
+    try:
+        partition = ArchivedPartition(target)
+    except (OSError, ValueError):
+        return None
+    max_id = partition.meta.get('max_id')
+    if max_id is None:  # archivo de la versión 1
+        max_id = int(partition.column('id').max()) if partition.rows else 0
+    return partition.rows, max_id
+
+def archive_database(db_path, archive_dir=ARCHIVE_DIR, today=None, retention_days=ARCHIVE_RETENTION_DAYS):
+    """Archivar las particiones cerradas nuevas o que han cambiado desde su
+    archivo y aplicar la retención del archivo.
+
+    Devuelve ([(partición, filas)] escritas en esta llamada,
+    {partición: (filas, id máximo)} de todas las que tienen el archivo al
+    día); un error en una partición no impide archivar las demás.
+    """
+    today = (today or datetime.utcnow().date()).isoformat()
+    root = archive_root(db_path, archive_dir)
+    os.makedirs(root, exist_ok=True)
+    written = []
+    current = {}
+    conn = connect(db_path)
+    try:
+        partitions = partition_ranges(list_partitions(conn))
+        for start, end, name in partitions:
+            if end is None or end > today:
+                continue
+            target = os.path.join(root, name)
+            # Recuento y lectura en la misma instantánea
+            conn.execute("BEGIN")
+            try:
+                stats = partition_stats(conn, name)
+                if archived_stats(target) != stats:
+                    stats = write_partition(conn, name, target)
+                    written.append((name, stats[0]))
+                current[name] = stats
+            except (OSError, ValueError) as e:
+                print(f"Error archiving {name}: {e}", flush=True)
+            finally:
+                conn.commit()
+    finally:
+        conn.close()
+
+    cutoff = str(to_datetime64(today + ' 00:00:00') - np.timedelta64(retention_days, 'D'))
+    in_database = {name for _, _, name in partitions}
+    for partition in EventArchive(db_path, archive_dir).archived():
+        if partition.name in in_database:
+            continue  # Aún en SQLite: se volvería a archivar en la siguiente pasada
+        # Particiones vacías: por la fecha en que se archivaron
+        if (partition.last or partition.meta['archived_at'].replace(' ', 'T')) < cutoff:
+            shutil.rmtree(partition.path)
+    return written, current
+
+class ArchivedPartition:
+    """Una partición archivada: columnas abiertas con mmap al pedirlas"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.name = self.meta['partition']
+        self.rows = self.meta['rows']
+        self.first = self.meta['first']
+        self.last = self.meta['last']
+        self._columns = {}
+        self._dictionaries = {}
+
+    def column(self, name):
+        if name not in self.meta['columns']:
+            raise KeyError(f"Columna desconocida: {name}")
+        array = self._columns.get(name)
+        if array is None:
+            array = self._columns[name] = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode='r')
+        return array
+
+    def dictionary(self, name):
+        dictionary = self._dictionaries.get(name)
+        if dictionary is None:
+            with gzip.open(os.path.join(self.path, f"{name}.dict.gz"), 'rt', encoding='utf-8') as f:
+                dictionary = self._dictionaries[name] = json.load(f)
+        return dictionary
+
+    def bounds(self, since=None, until=None):
+        """[inicio, fin) de las filas con fecha en [since, until) (datetime64)"""
+        dates = self.column('date')
+        lo = int(np.searchsorted(dates, since, 'left')) if since is not None else 0
+        hi = int(np.searchsorted(dates, until, 'left')) if until is not None else self.rows
+        return lo, max(lo, hi)
+
+class OpenPartition:
+    """Filas de una partición aún sin archivar, leídas de SQLite a memoria
+    con la misma interfaz que ArchivedPartition"""
+
+    def __init__(self, name, arrays, dictionaries):
+        self.name = name
+        self.arrays = arrays
+        self.dictionaries = dictionaries
+        self.rows = len(arrays['date'])
+
+    def column(self, name):
+        return self.arrays[name]
+
+    def dictionary(self, name):
+        return self.dictionaries[name]
+
+    def bounds(self, since=None, until=None):
+        dates = self.arrays['date']
+        lo = int(np.searchsorted(dates, since, 'left')) if since is not None else 0
+        hi = int(np.searchsorted(dates, until, 'left')) if until is not None else self.rows
+        return lo, max(lo, hi)
+
+class EventArchive:
+    """Lectura del archivo columnar de events de una base de datos.
+
+    `since`/`until` aceptan lo mismo que db_date (cadena UTC de la base,
+    datetime, timestamp). Los códigos de las columnas de diccionario se
+    traducen con decode().
+
+    Sólo las particiones cerradas están archivadas: con `tail=True`, las
+    que aún no lo están (el mes en curso) se leen además de SQLite.
+    """
+
+    def __init__(self, db_path=INTEL_DB, archive_dir=ARCHIVE_DIR):
+        self.db_path = db_path
+        self.root = archive_root(db_path, archive_dir)
+
+    def archived(self):
+        """Todas las particiones archivadas completas, vacías incluidas"""
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        # '.tmp' / '.old': escritura o reemplazo en curso
+        return [ArchivedPartition(os.path.join(self.root, name)) for name in names
+                if '.' not in name and os.path.exists(os.path.join(self.root, name, 'meta.json'))]
+
+    def partitions(self, since=None, until=None):
+        """Particiones archivadas con filas que solapan con [since, until), por fecha"""
+        since = str(to_datetime64(since)) if since is not None else None
+        until = str(to_datetime64(until)) if until is not None else None
+        partitions = []
+        for partition in self.archived():
+            if partition.first is None:
+                continue
+            if since is not None and partition.last < since:
+                continue
+            if until is not None and partition.first >= until:
+                continue
+            partitions.append(partition)
+        # events_legacy es anterior a todas las demás particiones
+        partitions.sort(key=lambda p: (p.name != LEGACY_PARTITION, p.first))
+        return partitions
+
+    def open_partitions(self, columns, since=None, until=None):
+        """OpenPartition de cada partición de la base sin archivar, con sus
+        filas de [since, until)"""
+        archived = {partition.name for partition in self.archived()}
+        names = ['date'] + [column for column in columns if column != 'date']
+        where, params = [], []
+        if since is not None:
+            where.append("date >= ?")
+            params.append(db_date(since))
+        if until is not None:
+            where.append("date < ?")
+            params.append(db_date(until))
+        sql_where = f" WHERE {' AND '.join(where)}" if where else ''
+
+        conn = connect(self.db_path)
+        try:
+            tables = [name for _, name in list_partitions(conn)] or [EVENTS_VIEW]
+            partitions = []
+            for name in tables:
+                if name in archived:
+                    continue
+                cursor = conn.execute(f"SELECT {', '.join(names)} FROM {name}{sql_where}", params)
+                partitions.append(OpenPartition(name, *to_columnar(fetch_columns(cursor, names))))
+            return partitions
+        finally:
+            conn.close()
+
+    def chunks(self, columns, since=None, until=None, tail=False):
+        """(partición, {columna: vista}) por partición, sin copiar nada"""
+        start = to_datetime64(since) if since is not None else None
+        end = to_datetime64(until) if until is not None else None
+        partitions = self.partitions(since, until)
+        if tail:
+            partitions += self.open_partitions(columns, since, until)
+        for partition in partitions:
+            lo, hi = partition.bounds(start, end)
+            if hi > lo:
+                yield partition, {column: partition.column(column)[lo:hi] for column in columns}
+
+    def load(self, columns=('date', 'event_type', 'source_ip', 'severity'), since=None, until=None,
+             tail=False):
+        """({columna: array}, {columna: diccionario}) de [since, until).
+
+        Con una sola partición los arrays son vistas del mmap (sin copia);
+        con varias se concatenan una vez y los códigos pasan a un diccionario
+        común a todas.
+        """
+        chunks = list(self.chunks(columns, since, until, tail))
+        encoded = [column for column in columns if column in DICTIONARY_COLUMNS]
+        if len(chunks) == 1:
+            partition, arrays = chunks[0]
+            return arrays, {column: partition.dictionary(column) for column in encoded}
+
+        dictionaries = {column: {} for column in encoded}
+        parts = {column: [] for column in columns}
+        for partition, arrays in chunks:
+            for column in columns:
+                array = arrays[column]
+                if column in dictionaries:
+                    common = dictionaries[column]
+                    mapping = np.array([common.setdefault(value, len(common))
+                                        for value in partition.dictionary(column)], dtype=np.uint32)
+                    array = mapping[array]
+                parts[column].append(array)
+
+        result = {}
+        for column in columns:
+            if parts[column]:
+                result[column] = np.concatenate(parts[column])
+            elif column == 'date':
+                result[column] = np.empty(0, dtype='datetime64[s]')
+            else:
+                result[column] = np.empty(0, dtype=NUMERIC_COLUMNS.get(column, np.uint32))
+        for column in encoded:
+            size = len(dictionaries[column])
+            result[column] = result[column].astype(code_dtype(size), copy=False)
+        return result, {column: list(dictionary) for column, dictionary in dictionaries.items()}
+
+def decode(codes, dictionary):
+    """Valores de una columna de diccionario (array de objetos)"""
+    return np.array(dictionary, dtype=object)[codes] if len(dictionary) else np.empty(0, dtype=object)
+
+def main(argv):
+    options = dict(zip(argv[2::2], argv[3::2]))
+    archive_dir = options.get('--dir', ARCHIVE_DIR)
+
+    if len(argv) >= 2 and argv[0] == 'archive':
+        try:
+            archived, _ = archive_database(argv[1], archive_dir)
+        except sqlite3.Error as e:
+            print(f"❌ {argv[1]}: {e}", file=sys.stderr)
+            return 1
+        print(f"✅ {argv[1]}: {len(archived)} particiones archivadas"
+              + (f" ({', '.join(f'{name}: {rows} filas' for name, rows in archived)})" if archived else ""))
+        return 0
+
+    if len(argv) >= 2 and argv[0] == 'list':
+        for partition in EventArchive(argv[1], archive_dir).partitions():
+            size = sum(os.path.getsize(os.path.join(partition.path, name))
+                       for name in os.listdir(partition.path))
+            print(f"{partition.name:24s} {partition.first or '-':19s} → {partition.last or '-':19s} "
+                  f"{partition.rows:>10d} {size / 1024 / 1024:>8.1f} MB")
+        return 0
+
+    print(__doc__.strip().split('Uso:')[1].strip(), file=sys.stderr)
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bytefense OS - Tabla events particionada por meses
+
+Los eventos se guardan en una tabla por mes (events_pYYYYMM01) y `events`
+pasa a ser una vista UNION ALL con un trigger INSTEAD OF INSERT que envía
+cada fila a su partición, así honeypot, IDS, alertas, la API y los
+scripts de shell siguen escribiendo y leyendo `events` como siempre.
+`events` es de sólo inserción: DELETE por id se reparte a las
+particiones, pero UPDATE se rechaza con un error explícito (una fecha
+nueva podría cambiar la fila de partición).
+
+Cada partición cubre desde su inicio hasta el inicio de la siguiente (la
+última no tiene fin y events_legacy, la tabla anterior a la migración,
+no tiene inicio), de modo que toda fecha cae en exactamente una. Las
+particiones diarias de versiones anteriores siguen valiendo: el
+intervalo lo marca el inicio de la siguiente, sea de día o de mes.
+
+Particiones mensuales y no diarias porque la vista es un único SELECT
+compuesto (SQLite admite SQLITE_MAX_COMPOUND_SELECT = 500 términos) y el
+trigger evalúa un INSERT ... WHERE por partición en cada fila: con 90
+días de retención son 4-5 comprobaciones, no 93. EVENTS_MAX_PARTITIONS
+y EVENTS_MAX_RETENTION_DAYS lo mantienen lejos del límite.
+
+La retención borra particiones enteras con DROP TABLE (un mes cuando
+todo él queda antes del corte): sin DELETE fila a fila ni VACUUM, y las
+páginas liberadas se reutilizan para los meses nuevos. Las consultas acotadas en el tiempo usan events_source() para
+leer sólo las particiones que solapan con el intervalo. Antes de borrar,
+las particiones cerradas se copian al archivo columnar de
+bytefense_archive.py para el entrenamiento de los modelos, y la
+retención sólo borra las que están archivadas con las mismas filas (sin
+numpy no se borra nada salvo con BYTEFENSE_ARCHIVE=0).
+
+Uso:
+    bytefense_events.py maintain DB [--retention DÍAS]
+    bytefense_events.py list DB
+"""
+
+import os
+import sys
+import time
+import sqlite3
+from datetime import date, datetime, timedelta
+
+from bytefense_schema import run_script
+
+EVENTS_VIEW = 'events'
+PARTITION_PREFIX = 'events_p'
+LEGACY_PARTITION = 'events_legacy'
+EVENT_COLUMNS = ('id', 'event_type', 'source_ip', 'target_ip', 'description', 'severity', 'date')
+EVENTS_RETENTION_DAYS = int(os.environ.get('BYTEFENSE_EVENTS_RETENTION_DAYS', 90))
+PARTITIONS_AHEAD = 2  # días futuros cuya partición (la de su mes) se crea por adelantado
+EVENTS_MAX_PARTITIONS = 200  # vista y trigger muy por debajo de SQLITE_MAX_COMPOUND_SELECT (500)
+EVENTS_MAX_RETENTION_DAYS = 3650
+EVENTS_MAINTENANCE_INTERVAL = 3600
+EVENTS_ARCHIVE = os.environ.get('BYTEFENSE_ARCHIVE', '1') != '0'  # 0: retención sin archivo columnar
+
+PARTITION_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_type TEXT NOT NULL,
+        source_ip TEXT,
+        target_ip TEXT,
+        description TEXT,
+        severity INTEGER DEFAULT 1,
+        date DATETIME NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_{name}_date ON {name}(date);
+    CREATE INDEX IF NOT EXISTS idx_{name}_type_date ON {name}(event_type, date);
+    CREATE INDEX IF NOT EXISTS idx_{name}_source_date ON {name}(source_ip, date);
+
+    CREATE TRIGGER IF NOT EXISTS trg_{name}_hourly_insert AFTER INSERT ON {name}
+    BEGIN
+        INSERT INTO events_hourly (hour, event_type, count)
+        VALUES (COALESCE(strftime('%Y-%m-%d %H:00:00', NEW.date), ''), NEW.event_type, 1)
+        ON CONFLICT (hour, event_type) DO UPDATE SET count = count + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_{name}_hourly_delete AFTER DELETE ON {name}
+    BEGIN
+        UPDATE events_hourly SET count = count - 1
+        WHERE hour = COALESCE(strftime('%Y-%m-%d %H:00:00', OLD.date), '') AND event_type = OLD.event_type;
+    END;
+"""
+
+def month_start(day):
+    return day.replace(day=1)
+
+def partition_name(day):
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+def id_base(day):
+    """Primer id de la partición que empieza en `day`: los ids crecen con la fecha y no se repiten
+    entre particiones (< 2^53, seguros como números en JavaScript)"""
+    return day.toordinal() << 32
+
+def list_partitions(conn):
+    """[(inicio 'YYYY-MM-DD' o '' para events_legacy, tabla)] ordenadas por inicio"""
+    partitions = []
+    for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                              "AND (name = ? OR name GLOB ?)",
+                              (LEGACY_PARTITION, PARTITION_PREFIX + '[0-9]*')):
+        if name == LEGACY_PARTITION:
+            partitions.append(('', name))
+        else:
+            suffix = name[len(PARTITION_PREFIX):]
+            partitions.append((f"{suffix[:4]}-{suffix[4:6]}-{suffix[6:8]}", name))
+    partitions.sort()
+    return partitions
+
+def partition_ranges(partitions):
+    """[(inicio, fin, tabla)]; fin es el inicio de la siguiente o None"""
+    return [(start, partitions[i + 1][0] if i + 1 < len(partitions) else None, name)
+            for i, (start, name) in enumerate(partitions)]
+
+def partition_stats(conn, name):
+    """(filas, id máximo) de una partición: lo que se compara con su archivo"""
+    rows, max_id = conn.execute(f"SELECT COUNT(*), COALESCE(MAX(id), 0) FROM {name}").fetchone()
+    return rows, max_id
+
+def is_partitioned(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = ?",
+                        (EVENTS_VIEW,)).fetchone() is not None
+
+# -- Lectura --
+
+def partitions_for(conn, since=None, until=None):
+    """Tablas cuyo intervalo solapa con [since, until) (cadenas de fecha)"""
+    if not is_partitioned(conn):
+        return [EVENTS_VIEW]
+    names = []
+    for start, end, name in partition_ranges(list_partitions(conn)):
+        if since is not None and end is not None and end <= since[:10]:
+            continue
+        if until is not None and start and start >= until:
+            continue
+        names.append(name)
+    return names
+
+def events_source(conn, since=None, until=None, columns=EVENT_COLUMNS):
+    """Expresión FROM con sólo las particiones necesarias para [since, until).
+
+    `since`/`until` delimitan qué particiones se leen; el WHERE de la
+    consulta debe seguir filtrando por fecha.
+    """
+    names = partitions_for(conn, since, until)
+    if len(names) == 1:
+        return names[0]
+    column_list = ', '.join(columns)
+    if not names:
+        return f"(SELECT {column_list} FROM {EVENTS_VIEW} WHERE 0)"
+    return '(' + ' UNION ALL '.join(f"SELECT {column_list} FROM {name}" for name in names) + ')'
+
+def utc_since(**delta):
+    """Fecha UTC 'YYYY-MM-DD HH:MM:SS' de hace `delta` (para events_source y el WHERE)"""
+    return (datetime.utcnow() - timedelta(**delta)).strftime('%Y-%m-%d %H:%M:%S')
+
+def max_event_id(conn):
+    """MAX(id) de events mirando sólo la partición más reciente con filas"""
+    if not is_partitioned(conn):
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+    for _, name in reversed(list_partitions(conn)):
+        value = conn.execute(f"SELECT MAX(id) FROM {name}").fetchone()[0]
+        if value is not None:
+            return value
+    return 0
+
+def events_after_source(conn, last_id, columns=EVENT_COLUMNS):
+    """Expresión FROM con las particiones que pueden tener ids > last_id"""
+    if not is_partitioned(conn):
+        return EVENTS_VIEW
+    # events_legacy conserva sus ids originales, siempre por debajo de 2^32
+    names = [name for start, name in list_partitions(conn)
+             if (id_base(date.fromisoformat(start)) + (1 << 32) if start else 1 << 32) > last_id]
+    if len(names) == 1:
+        return names[0]
+    column_list = ', '.join(columns)
+    return '(' + ' UNION ALL '.join(f"SELECT {column_list} FROM {name}" for name in names) + ')'
+
+# -- Mantenimiento --
+
+def create_partition(conn, day):
+    name = partition_name(day)
+    run_script(conn, PARTITION_SCHEMA.format(name=name))
+    if not conn.execute("SELECT 1 FROM sqlite_sequence WHERE name = ?", (name,)).fetchone():
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (name, id_base(day)))
+    return name
+
+def build_router(conn):
+    """(Re)crear la vista events y los triggers que reparten las escrituras"""
+    partitions = partition_ranges(list_partitions(conn))
+    if len(partitions) > EVENTS_MAX_PARTITIONS:
+        # Antes de tocar la vista: la actual sigue funcionando
+        raise ValueError(f"events tendría {len(partitions)} particiones (máximo {EVENTS_MAX_PARTITIONS}); "
+                         f"reduce BYTEFENSE_EVENTS_RETENTION_DAYS")
+    column_list = ', '.join(EVENT_COLUMNS)
+    conn.execute(f"DROP VIEW IF EXISTS {EVENTS_VIEW}")
+    conn.execute(f"CREATE VIEW {EVENTS_VIEW} AS " + ' UNION ALL '.join(
+        f"SELECT {column_list} FROM {name}" for _, _, name in partitions))
+
+    inserts = []
+    deletes = []
+    for start, end, name in partitions:
+        conditions = []
+        if start and start != partitions[0][0]:
+            conditions.append(f"NEW.date >= '{start}'")
+        if end:
+            # Fechas NULL a la primera partición para que salte el NOT NULL como antes
+            first = "NEW.date IS NULL OR " if not conditions else ""
+            conditions.append(f"{first}NEW.date < '{end}'")
+        where = ' AND '.join(f"({c})" for c in conditions) or '1'
+        inserts.append(f"""
+        INSERT INTO {name} ({column_list})
+        SELECT NEW.id, NEW.event_type, NEW.source_ip, NEW.target_ip, NEW.description,
+               COALESCE(NEW.severity, 1), NEW.date
+        WHERE {where};""")
+        deletes.append(f"\n        DELETE FROM {name} WHERE id = OLD.id;")
+
+    conn.execute(f"CREATE TRIGGER trg_events_route_insert INSTEAD OF INSERT ON {EVENTS_VIEW}\n"
+                 f"    BEGIN{''.join(inserts)}\n    END")
+    conn.execute(f"CREATE TRIGGER trg_events_route_delete INSTEAD OF DELETE ON {EVENTS_VIEW}\n"
+                 f"    BEGIN{''.join(deletes)}\n    END")
+    conn.execute(f"CREATE TRIGGER trg_events_no_update INSTEAD OF UPDATE ON {EVENTS_VIEW}\n"
+                 f"    BEGIN SELECT RAISE(ABORT, 'events es de solo insercion: UPDATE no soportado "
+                 f"(borrar e insertar de nuevo)'); END")
+
+def _maintain(conn, retention_days=EVENTS_RETENTION_DAYS, ahead=PARTITIONS_AHEAD, today=None,
+              archived=None):
+    """Crear particiones futuras y borrar las caducadas (dentro de una transacción).
+
+    Con `archived` ({partición: (filas, id máximo)} de archive_closed) sólo
+    se borran las caducadas cuyo archivo coincide con la tabla; None borra
+    sin comprobar.
+    """
+    if not 0 < retention_days <= EVENTS_MAX_RETENTION_DAYS:
+        raise ValueError(f"Retención de events no válida: {retention_days} días "
+                         f"(1-{EVENTS_MAX_RETENTION_DAYS})")
+    today = today or datetime.utcnow().date()
+    created = []
+    dropped = []
+
+    for offset in range(ahead + 1):
+        day = month_start(today + timedelta(days=offset))
+        start = day.isoformat()
+        ranges = partition_ranges(list_partitions(conn))
+        if any(s == start for s, _, _ in ranges):
+            continue
+        # Sólo si la partición que cubre ese inicio aún no tiene filas de esa fecha o
+        # posteriores; si no, los intervalos dejarían de ser exactos
+        covering = [name for s, e, name in ranges if s <= start and (e is None or start < e)]
+        if covering and conn.execute(f"SELECT 1 FROM {covering[0]} WHERE date >= ? LIMIT 1",
+                                     (start,)).fetchone():
+            continue
+        created.append(create_partition(conn, day))
+
+    # Caducadas: todo su intervalo queda antes del corte (la última nunca caduca)
+    cutoff = (today - timedelta(days=retention_days)).isoformat()
+    hourly_cutoff = cutoff
+    for start, end, name in partition_ranges(list_partitions(conn)):
+        if end is not None and end <= cutoff:
+            # Con el bloqueo de escritura: ninguna fila puede llegar entre la comprobación y el DROP
+            if archived is not None and archived.get(name) != partition_stats(conn, name):
+                print(f"Keeping expired event partition {name}: not archived with its current rows")
+                hourly_cutoff = min(hourly_cutoff, start)
+                continue
+            conn.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+    if dropped and hourly_cutoff:
+        conn.execute("DELETE FROM events_hourly WHERE hour != '' AND hour < ?", (hourly_cutoff,))
+
+    # Sin el trigger de UPDATE: router de una versión anterior
+    if created or dropped or not is_partitioned(conn) or not conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'trg_events_no_update'").fetchone():
+        build_router(conn)
+    return created, dropped
+
+def maintain(conn, retention_days=EVENTS_RETENTION_DAYS, ahead=PARTITIONS_AHEAD, today=None,
+             archived=None):
+    """Mantenimiento periódico en su propia transacción; devuelve (creadas, borradas)"""
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = _maintain(conn, retention_days, ahead, today, archived)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return result
+
+def archive_closed(db_path):
+    """Pasar las particiones cerradas al archivo columnar (bytefense_archive.py).
+
+    Devuelve {partición: (filas, id máximo)} de las archivadas al día, las
+    únicas que maintain() puede borrar, o None con BYTEFENSE_ARCHIVE=0
+    (retención sin archivo). Sin numpy o con errores no se borra nada que
+    no esté archivado.
+    """
+    if not EVENTS_ARCHIVE:
+        return None
+    try:
+        from bytefense_archive import archive_database
+    except ImportError:
+        print("numpy not installed: event partitions are not archived and retention keeps them "
+              "(BYTEFENSE_ARCHIVE=0 drops them without archiving)")
+        return {}
+    try:
+        return archive_database(db_path)[1]
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error archiving event partitions: {e}")
+        return {}
+
+def maintenance_loop(db_path, interval=EVENTS_MAINTENANCE_INTERVAL):
+    """Bucle para un hilo de fondo de los servicios que mantienen la base de datos"""
+    while True:
+        try:
+            conn = sqlite3.connect(db_path, timeout=30)
+            try:
+                if is_partitioned(conn):
+                    created, dropped = maintain(conn, archived=archive_closed(db_path))
+                    if dropped:
+                        print(f"Dropped expired event partitions: {', '.join(dropped)}")
+            finally:
+                conn.close()
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Error maintaining event partitions: {e}")
+        time.sleep(interval)
+
+def convert(conn):
+    """Migración: la tabla events pasa a events_legacy detrás de la vista (O(1), sin copiar filas)"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                    (EVENTS_VIEW,)).fetchone():
+        conn.execute(f"ALTER TABLE {EVENTS_VIEW} RENAME TO {LEGACY_PARTITION}")
+    _maintain(conn)
+
+def main(argv):
+    if len(argv) >= 2 and argv[0] == 'maintain':
+        retention = EVENTS_RETENTION_DAYS
+        if len(argv) >= 4 and argv[2] == '--retention':
+            retention = int(argv[3])
+        conn = sqlite3.connect(argv[1], timeout=30)
+        try:
+            if not is_partitioned(conn):
+                from bytefense_schema import migrate
+                migrate(conn)
+            archived = archive_closed(argv[1])
+            created, dropped = maintain(conn, retention, archived=archived)
+        except ValueError as e:
+            print(f"❌ {argv[1]}: {e}", file=sys.stderr)
+            return 1
+        finally:
+            conn.close()
+        print(f"✅ {argv[1]}: {len(created)} particiones creadas, "
+              f"{'archivo desactivado' if archived is None else f'{len(archived)} archivadas'}, "
+              f"{len(dropped)} borradas" + (f" ({', '.join(dropped)})" if dropped else ""))
+        return 0
+
+    if len(argv) >= 2 and argv[0] == 'list':
+        conn = sqlite3.connect(argv[1])
+        for start, end, name in partition_ranges(list_partitions(conn)):
+            count = conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+            print(f"{name:24s} {start or '-':10s} → {end or '-':10s} {count:>10d}")
+        conn.close()
+        return 0
+
+    print(__doc__.strip().split('Uso:')[1].strip(), file=sys.stderr)
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
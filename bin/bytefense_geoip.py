@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bytefense OS - Geolocalización y ASN sin conexión
+
+Convierte ficheros CSV de rangos IPv4 (DB-IP lite, IP2Location LITE,
+iptoasn...) en tablas binarias ordenadas que se abren con mmap y se
+consultan por búsqueda binaria, sin llamadas HTTP por cada IP.
+
+Uso:
+    bytefense_geoip.py import country dbip-country-lite.csv
+    bytefense_geoip.py import asn ip2asn-v4.tsv
+    bytefense_geoip.py lookup 8.8.8.8 [--fields country,as]
+"""
+
+import os
+import sys
+import csv
+import json
+import mmap
+import socket
+import struct
+import threading
+from array import array
+from bisect import bisect_right
+
+GEOIP_DIR = os.environ.get('BYTEFENSE_GEOIP_DIR', '/opt/bytefense/intel/geoip')
+TABLE_FILES = {
+    'country': 'country.bin',
+    'asn': 'asn.bin'
+}
+
+# Cabecera: magic, número de rangos, tamaño de la tabla de cadenas
+TABLE_MAGIC = b'BFGEO\x00\x01\x00'
+HEADER = struct.Struct('<8sII')
+
+def ip_to_int(ip):
+    """IPv4 en texto o entero a entero sin signo; None si no es IPv4"""
+    if isinstance(ip, int) or ip.isdigit():
+        value = int(ip)
+        return value if 0 <= value <= 0xFFFFFFFF else None
+    try:
+        return struct.unpack('!I', socket.inet_pton(socket.AF_INET, ip))[0]
+    except (OSError, ValueError):
+        return None
+
+class RangeTable:
+    """Rangos [inicio, fin] -> valor, ordenados por inicio.
+
+    Formato en disco (little endian): cabecera, inicios (uint32 * n),
+    finales (uint32 * n), índice de valor (uint32 * n) y las cadenas de
+    valores en UTF-8 separadas por '\\n'. Los tres arrays se leen
+    directamente del mmap sin copiarlos.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, strings_size = HEADER.unpack_from(self.map, 0)
+        if magic != TABLE_MAGIC:
+            raise ValueError(f"{path} no es una tabla GeoIP de Bytefense")
+
+        view = memoryview(self.map)
+        offset = HEADER.size
+        size = count * 4
+        self.starts = view[offset:offset + size].cast('I')
+        self.ends = view[offset + size:offset + 2 * size].cast('I')
+        self.values = view[offset + 2 * size:offset + 3 * size].cast('I')
+        strings = bytes(view[offset + 3 * size:offset + 3 * size + strings_size])
+        self.strings = strings.decode('utf-8').split('\n') if strings else []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def lookup(self, ip_int):
+        i = bisect_right(self.starts, ip_int) - 1
+        if i >= 0 and ip_int <= self.ends[i]:
+            return self.strings[self.values[i]]
+        return None
+
+    @staticmethod
+    def write(path, ranges):
+        """Guardar [(inicio, fin, valor)] de forma atómica"""
+        ranges.sort()
+        strings = {}
+        starts, ends, values = array('I'), array('I'), array('I')
+        for start, end, value in ranges:
+            starts.append(start)
+            ends.append(end)
+            values.append(strings.setdefault(value, len(strings)))
+        if sys.byteorder != 'little':
+            for column in (starts, ends, values):
+                column.byteswap()
+
+        blob = '\n'.join(strings).encode('utf-8')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(TABLE_MAGIC, len(starts), len(blob)))
+            f.write(starts.tobytes())
+            f.write(ends.tobytes())
+            f.write(values.tobytes())
+            f.write(blob)
+        os.replace(tmp_path, path)
+
+def read_ranges(csv_path, kind):
+    """Leer un CSV/TSV de rangos IPv4; las filas IPv6 o mal formadas se omiten.
+
+    country: inicio, fin, código de país[, nombre]
+    asn:     inicio, fin, número de AS[, país], organización (última columna)
+    """
+    ranges = []
+    with open(csv_path, newline='', encoding='utf-8', errors='replace') as f:
+        first = f.readline()
+        f.seek(0)
+        reader = csv.reader(f, delimiter='\t' if '\t' in first else ',')
+        for row in reader:
+            if len(row) < 3:
+                continue
+            start, end = ip_to_int(row[0].strip()), ip_to_int(row[1].strip())
+            if start is None or end is None or end < start:
+                continue
+
+            if kind == 'country':
+                code = row[2].strip().upper()
+                if not code or code in ('-', 'ZZ'):
+                    continue
+                name = row[3].strip() if len(row) > 3 else ''
+                value = f"{code}\t{name}"
+            else:
+                asn = row[2].strip().upper().lstrip('AS')
+                if not asn.isdigit() or asn == '0':
+                    continue
+                org = row[-1].strip() if len(row) > 3 else ''
+                value = f"{asn}\t{org}"
+            ranges.append((start, end, value.replace('\n', ' ')))
+    return ranges
+
+def import_csv(csv_path, kind, geoip_dir=GEOIP_DIR):
+    """Compilar un CSV a la tabla binaria de `kind` y devolver el número de rangos"""
+    if kind not in TABLE_FILES:
+        raise ValueError(f"Tipo de tabla desconocido: {kind}")
+    ranges = read_ranges(csv_path, kind)
+    os.makedirs(geoip_dir, exist_ok=True)
+    RangeTable.write(os.path.join(geoip_dir, TABLE_FILES[kind]), ranges)
+    return len(ranges)
+
+class GeoIPDatabase:
+    """Consultas de país y ASN sobre las tablas compiladas.
+
+    Las tablas se abren al primer uso y se recargan si el fichero cambia
+    (p. ej. tras un `import`); si faltan, los campos vuelven como None.
+    """
+
+    def __init__(self, geoip_dir=GEOIP_DIR):
+        self.geoip_dir = geoip_dir
+        self.tables = {}  # kind -> (mtime, RangeTable)
+        self.lock = threading.Lock()
+
+    def _table(self, kind):
+        path = os.path.join(self.geoip_dir, TABLE_FILES[kind])
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+        cached = self.tables.get(kind)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with self.lock:
+            cached = self.tables.get(kind)
+            if not cached or cached[0] != mtime:
+                cached = (mtime, RangeTable(path))
+                self.tables[kind] = cached
+        return cached[1]
+
+    def lookup(self, ip):
+        """{'country_code', 'country', 'asn', 'as_org', 'as'} de una IPv4"""
+        result = {'country_code': None, 'country': None, 'asn': None, 'as_org': None, 'as': None}
+        ip_int = ip_to_int(ip)
+        if ip_int is None:
+            return result
+
+        country_table = self._table('country')
+        value = country_table.lookup(ip_int) if country_table else None
+        if value:
+            code, name = value.split('\t', 1)
+            result['country_code'] = code
+            result['country'] = name or code
+
+        asn_table = self._table('asn')
+        value = asn_table.lookup(ip_int) if asn_table else None
+        if value:
+            asn, org = value.split('\t', 1)
+            result['asn'] = int(asn)
+            result['as_org'] = org or None
+            result['as'] = f"AS{asn} {org}".strip()
+        return result
+
+geoip = GeoIPDatabase()
+
+def lookup(ip):
+    """Consulta sobre la base de datos por defecto"""
+    return geoip.lookup(ip)
+
+def main(argv):
+    if len(argv) >= 3 and argv[0] == 'import':
+        count = import_csv(argv[2], argv[1])
+        print(f"✅ {count} rangos importados en {os.path.join(GEOIP_DIR, TABLE_FILES[argv[1]])}")
+        return 0
+
+    if len(argv) >= 2 and argv[0] == 'lookup':
+        result = lookup(argv[1])
+        if len(argv) >= 4 and argv[2] == '--fields':
+            # Salida separada por tabuladores para scripts de shell
+            print('\t'.join(str(result.get(f) or 'Unknown') for f in argv[3].split(',')))
+        else:
+            print(json.dumps(result, ensure_ascii=False))
+        return 0
+
+    print(__doc__.strip().split('Uso:')[1].strip(), file=sys.stderr)
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bytefense OS - Nivel caliente en memoria (últimas 24 horas)
+
+Casi todas las lecturas preguntan por "la última hora" o "las últimas 24
+horas" de events y blocked_ips: /api/status, /api/threats, /api/events,
+las comprobaciones de bytefense-alerts.py, el auto-bloqueo del honeypot y
+check_recent_threats de bytefense-health-pro. En lugar de recorrer SQL en
+cada pregunta, el demonio de ingesta (único escritor, bytefense_ingest.py)
+mantiene un anillo de 1440 buckets por minuto con contadores por tipo, por
+IP y por (tipo, IP), más los agregados de la última hora y del día que se
+actualizan al entrar y salir cada bucket. Las ventanas de 60 y 1440
+minutos se responden en tiempo constante; cualquier otra suma como mucho
+sus buckets.
+
+El anillo se alimenta leyendo lo confirmado por id (tras cada lote y cada
+HOT_SYNC_INTERVAL sin actividad), así también cuentan las filas que la API
+o los scripts escriben directamente, sin duplicados. Los demás procesos
+preguntan por un socket Unix local (una línea JSON por consulta); si el
+demonio no está disponible, hot_client() devuelve None y el llamante usa
+su consulta SQL de siempre.
+
+Las bajas (DELETE de blocked_ips, retención de particiones) no se restan:
+los buckets caducan solos al salir de la ventana.
+
+Uso:
+    bytefense_hot.py count DB SERIE MINUTOS [--type TIPO] [--ip IP]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import calendar
+import threading
+import socketserver
+from functools import lru_cache
+from collections import Counter, deque
+
+from bytefense_events import events_source, events_after_source, max_event_id
+from bytefense_storage import utc_now
+
+HOT_SOCKET = os.environ.get('BYTEFENSE_HOT_SOCKET', "/run/bytefense/hot.sock")
+HOT_SOCKET_MODE = 0o660                 # root y grupo bytefense
+HOT_WINDOW_MINUTES = 24 * 60            # tamaño del anillo
+HOT_WINDOWS = (60, HOT_WINDOW_MINUTES)  # ventanas con agregados mantenidos (O(1))
+HOT_RECENT_EVENTS = 20                  # últimos eventos para /api/events
+HOT_SYNC_INTERVAL = 1.0                 # lectura de filas nuevas sin lotes de ingesta
+HOT_QUERY_TIMEOUT = 0.5
+HOT_RETRY_INTERVAL = 5                  # sin demonio: SQL directo durante este tiempo
+HOT_MAX_LINE = 64 * 1024
+
+SERIES = ('events', 'blocked_ips')
+
+def current_minute():
+    return int(time.time()) // 60
+
+@lru_cache(maxsize=4096)
+def _minute_of_prefix(prefix):
+    return calendar.timegm(time.strptime(prefix, '%Y-%m-%d %H:%M')) // 60
+
+def minute_of(date):
+    """Minuto UTC (desde epoch) de una fecha 'YYYY-MM-DD HH:MM[:SS]'; None si no se entiende"""
+    try:
+        return _minute_of_prefix(str(date)[:16].replace('T', ' '))
+    except ValueError:
+        return None
+
+class Bucket:
+    __slots__ = ('minute', 'total', 'types', 'ips', 'pairs')
+
+    def __init__(self, minute):
+        self.minute = minute
+        self.total = 0
+        self.types = Counter()
+        self.ips = Counter()
+        self.pairs = Counter()
+
+    def add(self, kind, ip, n=1):
+        self.total += n
+        self.types[kind] += n
+        self.ips[ip] += n
+        self.pairs[(kind, ip)] += n
+
+class Window(Bucket):
+    """Agregado de una ventana de minutos: suma los buckets que entran y resta
+    los que salen"""
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__(None)
+
+    def remove(self, bucket):
+        self.total -= bucket.total
+        for counter, other in ((self.types, bucket.types), (self.ips, bucket.ips),
+                               (self.pairs, bucket.pairs)):
+            for key, n in other.items():
+                left = counter[key] - n
+                if left > 0:
+                    counter[key] = left
+                else:
+                    del counter[key]
+
+class Series:
+    """Anillo de buckets por minuto de una tabla (events o blocked_ips).
+
+    `kind` es event_type o reason; `ip` es source_ip o ip.
+    """
+
+    def __init__(self, minutes=HOT_WINDOW_MINUTES, windows=HOT_WINDOWS):
+        self.minutes = minutes
+        self.ring = [None] * minutes
+        self.windows = {size: Window() for size in windows if size <= minutes}
+        self.now = None
+
+    def bucket(self, minute):
+        bucket = self.ring[minute % self.minutes]
+        return bucket if bucket is not None and bucket.minute == minute else None
+
+    def advance(self, minute):
+        """Mover el reloj a `minute`: restar de cada ventana los buckets que salen"""
+        if self.now is None:
+            self.now = minute
+            return
+        if minute <= self.now:
+            return
+        for size, window in self.windows.items():
+            if minute - self.now >= size:
+                self.windows[size] = Window()
+                continue
+            # Salen los minutos (now - size, minute - size]
+            for old in range(self.now - size + 1, minute - size + 1):
+                bucket = self.bucket(old)
+                if bucket is not None:
+                    window.remove(bucket)
+        self.now = minute
+
+    def add(self, minute, kind, ip, n=1):
+        self.advance(current_minute())
+        # Relojes adelantados: la fila cuenta en el minuto actual
+        minute = min(minute, self.now)
+        if minute <= self.now - self.minutes:
+            return
+        slot = minute % self.minutes
+        bucket = self.ring[slot]
+        if bucket is None or bucket.minute != minute:
+            # El bucket anterior del hueco ya salió de todas las ventanas
+            bucket = self.ring[slot] = Bucket(minute)
+        bucket.add(kind, ip, n)
+        for size, window in self.windows.items():
+            if minute > self.now - size:
+                window.add(kind, ip, n)
+
+    def buckets(self, minutes):
+        """Agregados a leer para los últimos `minutes` minutos (minuto actual incluido)"""
+        self.advance(current_minute())
+        minutes = max(1, min(minutes, self.minutes))
+        if minutes in self.windows:
+            return [self.windows[minutes]]
+        return [bucket for bucket in (self.bucket(m) for m in range(self.now - minutes + 1, self.now + 1))
+                if bucket is not None]
+
+    def count(self, minutes, kinds=None, ip=None):
+        total = 0
+        for bucket in self.buckets(minutes):
+            if kinds is None:
+                total += bucket.total if ip is None else bucket.ips.get(ip, 0)
+            elif ip is None:
+                total += sum(bucket.types.get(kind, 0) for kind in kinds)
+            else:
+                total += sum(bucket.pairs.get((kind, ip), 0) for kind in kinds)
+        return total
+
+    def by_type(self, minutes):
+        types = Counter()
+        for bucket in self.buckets(minutes):
+            types.update(bucket.types)
+        return types.most_common()
+
+    def top(self, minutes, n=10):
+        """[(kind, ip, count)] más frecuentes"""
+        pairs = Counter()
+        for bucket in self.buckets(minutes):
+            pairs.update(bucket.pairs)
+        return [(kind, ip, count) for (kind, ip), count in pairs.most_common(n)]
+
+    def hourly(self):
+        """Totales de las últimas 24 horas de reloj (UTC), de la más antigua a la actual"""
+        self.advance(current_minute())
+        start = self.now - self.now % 60
+        counts = []
+        for hour in range(23, -1, -1):
+            first = start - hour * 60
+            counts.append(sum(bucket.total for bucket in (self.bucket(m) for m in range(first, first + 60))
+                              if bucket is not None))
+        return counts
+
+class HotTier:
+    """Nivel caliente de una base de datos: una serie por tabla y los últimos eventos"""
+
+    def __init__(self):
+        self.series = {name: Series() for name in SERIES}
+        self.recent = deque(maxlen=HOT_RECENT_EVENTS)
+        self.last_ids = {name: 0 for name in SERIES}
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def load(self, conn):
+        """Cargar las últimas 24 horas ya agregadas por minuto y fijar las marcas de id,
+        todo en la misma instantánea de lectura"""
+        since = utc_now(time.time() - HOT_WINDOW_MINUTES * 60)
+        conn.execute("BEGIN")
+        try:
+            events = conn.execute(f"""
+                SELECT substr(date, 1, 16), event_type, source_ip, COUNT(*)
+                FROM {events_source(conn, since)} WHERE date > ?
+                GROUP BY 1, 2, 3
+            """, (since,)).fetchall()
+            recent = conn.execute(f"""
+                SELECT event_type, source_ip, description, date
+                FROM {events_source(conn, since)} WHERE date > ?
+                ORDER BY date DESC LIMIT {HOT_RECENT_EVENTS}
+            """, (since,)).fetchall()
+            blocked = conn.execute("""
+                SELECT substr(date, 1, 16), reason, ip, COUNT(*)
+                FROM blocked_ips WHERE date > ?
+                GROUP BY 1, 2, 3
+            """, (since,)).fetchall()
+            last_event = max_event_id(conn)
+            last_blocked = conn.execute("SELECT COALESCE(MAX(id), 0) FROM blocked_ips").fetchone()[0]
+        finally:
+            conn.commit()
+
+        with self.lock:
+            self.series = {name: Series() for name in SERIES}
+            self.recent.clear()
+            for name, rows in (('events', events), ('blocked_ips', blocked)):
+                series = self.series[name]
+                for date, kind, ip, n in rows:
+                    minute = minute_of(date)
+                    if minute is not None:
+                        series.add(minute, kind, ip, n)
+            self.recent.extend(reversed(recent))
+            self.last_ids = {'events': last_event, 'blocked_ips': last_blocked}
+            self.loaded = True
+
+    def sync(self, conn):
+        """Añadir las filas confirmadas desde la última lectura; devuelve cuántas"""
+        last_event = self.last_ids['events']
+        events = conn.execute(f"""
+            SELECT id, event_type, source_ip, description, date
+            FROM {events_after_source(conn, last_event)} WHERE id > ?
+            ORDER BY id
+        """, (last_event,)).fetchall()
+        blocked = conn.execute("""
+            SELECT id, reason, ip, date FROM blocked_ips WHERE id > ? ORDER BY id
+        """, (self.last_ids['blocked_ips'],)).fetchall()
+        if not events and not blocked:
+            return 0
+
+        with self.lock:
+            series = self.series['events']
+            for row_id, kind, ip, description, date in events:
+                minute = minute_of(date)
+                if minute is not None:
+                    series.add(minute, kind, ip)
+                self.recent.append((kind, ip, description, date))
+            series = self.series['blocked_ips']
+            for row_id, kind, ip, date in blocked:
+                minute = minute_of(date)
+                if minute is not None:
+                    series.add(minute, kind, ip)
+            if events:
+                self.last_ids['events'] = events[-1][0]
+            if blocked:
+                self.last_ids['blocked_ips'] = blocked[-1][0]
+        return len(events) + len(blocked)
+
+    def query(self, request):
+        """Responder una consulta {'op', 'series', 'minutes', ...} del socket"""
+        if not self.loaded:
+            raise ValueError("hot tier not loaded yet")
+        op = request.get('op')
+        series = self.series.get(request.get('series', 'events'))
+        if series is None:
+            raise ValueError("unknown series")
+        minutes = int(request.get('minutes', HOT_WINDOW_MINUTES))
+        with self.lock:
+            if op == 'count':
+                kinds = request.get('types')
+                if request.get('type') is not None:
+                    kinds = [request['type']]
+                return series.count(minutes, kinds=kinds, ip=request.get('ip'))
+            if op == 'by_type':
+                return series.by_type(minutes)
+            if op == 'top':
+                return series.top(minutes, int(request.get('n', 10)))
+            if op == 'hourly':
+                return series.hourly()
+            if op == 'recent':
+                return list(reversed(self.recent))[:int(request.get('n', HOT_RECENT_EVENTS))]
+        raise ValueError("unknown op")
+
+class HotRequestHandler(socketserver.StreamRequestHandler):
+    """Una línea JSON por consulta, una línea JSON por respuesta"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                tier = self.server.tiers[os.path.realpath(request['db'])]
+                response = {'result': tier.query(request)}
+            except (ValueError, TypeError, KeyError) as e:
+                response = {'error': str(e)}
+            self.wfile.write(json.dumps(response, separators=(',', ':')).encode('utf-8') + b'\n')
+
+class HotServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Socket de consultas del nivel caliente, servido desde el demonio de ingesta"""
+    daemon_threads = True
+
+    def __init__(self, tiers, path=HOT_SOCKET):
+        self.tiers = tiers
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.unlink(path)  # socket de una ejecución anterior
+        except FileNotFoundError:
+            pass
+        super().__init__(path, HotRequestHandler)
+        os.chmod(path, HOT_SOCKET_MODE)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except (FileNotFoundError, TypeError):
+            pass
+
+class HotClient:
+    """Consultas al nivel caliente; None si el demonio no responde"""
+
+    def __init__(self, path=HOT_SOCKET, timeout=HOT_QUERY_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.sock = None
+        self.reader = None
+        self.retry_at = 0
+
+    def _close(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+        self.sock = None
+        self.reader = None
+
+    def query(self, db_path, op, series='events', **params):
+        if time.monotonic() < self.retry_at:
+            return None
+        request = dict(params, db=db_path, op=op, series=series)
+        data = json.dumps(request, separators=(',', ':')).encode('utf-8') + b'\n'
+        with self.lock:
+            try:
+                if self.sock is None:
+                    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    sock.settimeout(self.timeout)
+                    try:
+                        sock.connect(self.path)
+                    except OSError:
+                        sock.close()
+                        raise
+                    self.sock = sock
+                    self.reader = sock.makefile('rb')
+                self.sock.sendall(data)
+                line = self.reader.readline(HOT_MAX_LINE * 16)
+                if not line.endswith(b'\n'):
+                    raise ConnectionError("hot tier closed the connection")
+                response = json.loads(line)
+            except (OSError, ValueError):
+                self._close()
+                self.retry_at = time.monotonic() + HOT_RETRY_INTERVAL
+                return None
+        # Base sin nivel caliente o consulta no soportada: el llamante usa SQL
+        return response.get('result')
+
+    def count(self, db_path, series, minutes, types=None, ip=None):
+        if minutes > HOT_WINDOW_MINUTES:
+            return None
+        return self.query(db_path, 'count', series, minutes=minutes,
+                          types=list(types) if types is not None else None, ip=ip)
+
+_client = None
+_client_lock = threading.Lock()
+
+def hot_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HotClient()
+        return _client
+
+def main(argv):
+    if len(argv) >= 4 and argv[0] == 'count':
+        db_path, series, minutes = argv[1], argv[2], int(argv[3])
+        options = dict(zip(argv[4::2], argv[5::2]))
+        kind = options.get('--type')
+        count = hot_client().count(db_path, series, minutes,
+                                   types=[kind] if kind else None, ip=options.get('--ip'))
+        if count is None:
+            return 1  # sin demonio: el script hace su consulta SQL
+        print(count)
+        return 0
+
+    print(__doc__.strip().split('Uso:')[1].strip(), file=sys.stderr)
+    return 2
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bytefense OS - Demonio de ingesta de eventos
+
+Honeypot, IDS, alertas y respuesta a incidentes no escriben cada fila con
+su propio INSERT + COMMIT: la envían como una línea JSON por una conexión
+persistente a un socket Unix local y siguen (unos microsegundos). Este
+demonio es el único escritor de esas filas y las confirma en lotes, una
+transacción por base de datos con todo lo pendiente, así las ráfagas de
+ataques no se pelean por el bloqueo de escritura de SQLite.
+
+Sin pérdidas: con la cola interna llena el demonio deja de leer, el buffer
+del socket se llena y send() del productor espera (backpressure). Si el
+demonio no responde en INGEST_SEND_TIMEOUT, o no está arrancado, el
+productor escribe la fila directamente (Storage.submit); una línea cortada
+a medias se descarta en el demonio, así que nunca queda escrita dos veces.
+
+El mismo hilo escritor mantiene el nivel caliente de las últimas 24 horas
+(bytefense_hot.py): tras cada lote lee lo confirmado y lo suma a los
+buckets por minuto, que se consultan por su propio socket.
+
+Se usa SOCK_STREAM y no datagramas: la cola de datagramas Unix está
+limitada a net.unix.max_dgram_qlen mensajes (10 por defecto), lo que
+bloquearía a los productores en cuanto el escritor tarda un poco.
+
+Uso:
+    bytefense_ingest.py serve [--socket RUTA] [--hot-socket RUTA]
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import socket
+import sqlite3
+import selectors
+import threading
+from collections import Counter, defaultdict
+
+from bytefense_storage import open_storage, INSERT_SQL, SYSTEM_DB, INTEL_DB
+from bytefense_hot import HotTier, HotServer, HOT_SOCKET, HOT_SYNC_INTERVAL
+
+INGEST_SOCKET = os.environ.get('BYTEFENSE_INGEST_SOCKET', "/run/bytefense/ingest.sock")
+INGEST_SOCKET_MODE = 0o660              # root y grupo bytefense
+INGEST_QUEUE_SIZE = int(os.environ.get('BYTEFENSE_INGEST_QUEUE_SIZE', 100000))  # filas en memoria
+INGEST_BATCH_MAX = 5000                 # filas máximas por transacción
+INGEST_SNDBUF = 1024 * 1024             # buffer por productor para absorber ráfagas
+INGEST_MAX_LINE = 64 * 1024             # filas mayores se escriben directamente
+INGEST_READ_SIZE = 256 * 1024
+INGEST_SEND_TIMEOUT = float(os.environ.get('BYTEFENSE_INGEST_SEND_TIMEOUT', 2))  # espera con la cola llena
+INGEST_RETRY_INTERVAL = 5               # sin demonio: escritura directa durante este tiempo
+INGEST_LOCK_RETRY_MAX = 5               # segundos máximos entre reintentos con la base bloqueada
+INGEST_STATS_INTERVAL = 300
+
+class IngestClient:
+    """Envío de filas al demonio: una línea por fila, sin esperar respuesta"""
+
+    def __init__(self, path=INGEST_SOCKET, timeout=INGEST_SEND_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.sock = None
+        self.retry_at = 0
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, INGEST_SNDBUF)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def send(self, db_path, table, row):
+        """True si el demonio aceptó la fila; False: el llamante debe escribirla"""
+        if time.monotonic() < self.retry_at:
+            return False
+        data = json.dumps([db_path, table, list(row)], separators=(',', ':'), default=str).encode('utf-8')
+        if len(data) >= INGEST_MAX_LINE:
+            return False
+        with self.lock:
+            try:
+                if self.sock is None:
+                    self.sock = self._connect()
+                self.sock.sendall(data + b'\n')
+                return True
+            except OSError:
+                # Demonio parado, reiniciado o saturado más allá de la espera
+                # (socket.timeout): línea posiblemente cortada, nueva conexión
+                if self.sock is not None:
+                    self.sock.close()
+                    self.sock = None
+                self.retry_at = time.monotonic() + INGEST_RETRY_INTERVAL
+                return False
+
+_client = None
+_client_lock = threading.Lock()
+
+def ingest_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = IngestClient()
+        return _client
+
+class IngestServer:
+    """Recepción en un hilo, escritura por lotes en otro (único escritor)"""
+
+    def __init__(self, path=INGEST_SOCKET, databases=(SYSTEM_DB, INTEL_DB),
+                 queue_size=INGEST_QUEUE_SIZE, batch_max=INGEST_BATCH_MAX, hot_path=HOT_SOCKET):
+        self.path = path
+        self.databases = set(databases)
+        self.hot_path = hot_path
+        self.tiers = {os.path.realpath(db_path): HotTier() for db_path in databases}
+        self.batch_max = batch_max
+        self.rows = queue.Queue(maxsize=queue_size)
+        self.stats = Counter()
+        self.running = True
+        self.sock = None
+
+    def bind(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            os.unlink(self.path)  # socket de una ejecución anterior
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        os.chmod(self.path, INGEST_SOCKET_MODE)
+        sock.listen(128)
+        sock.setblocking(False)
+        self.sock = sock
+
+    def accept(self, line):
+        try:
+            db_path, table, row = json.loads(line)
+        except (ValueError, TypeError):
+            self.stats['rejected'] += 1
+            return
+        if db_path not in self.databases or table not in INSERT_SQL:
+            self.stats['rejected'] += 1
+            return
+        # Con la cola llena se bloquea aquí y deja de leer el socket: backpressure
+        self.rows.put((db_path, table, tuple(row)))
+        self.stats['received'] += 1
+        self.stats['queue_peak'] = max(self.stats['queue_peak'], self.rows.qsize())
+
+    def read(self, selector, conn, pending):
+        """Procesar las líneas completas recibidas; False si no hay más datos"""
+        try:
+            data = conn.recv(INGEST_READ_SIZE)
+        except BlockingIOError:
+            return False
+        except OSError:
+            data = b''
+        if not data:
+            # Un resto sin '\n' es una fila cortada que el productor escribió por su cuenta
+            pending.pop(conn, None)
+            selector.unregister(conn)
+            conn.close()
+            return False
+        lines = (pending.pop(conn, b'') + data).split(b'\n')
+        if len(lines[-1]) >= INGEST_MAX_LINE:
+            self.stats['rejected'] += 1
+            lines[-1] = b''
+        if lines[-1]:
+            pending[conn] = lines[-1]
+        for line in lines[:-1]:
+            self.accept(line)
+        return True
+
+    def receive_loop(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.sock, selectors.EVENT_READ)
+        pending = {}
+        while self.running:
+            for key, _ in selector.select(timeout=1.0):
+                if key.fileobj is self.sock:
+                    try:
+                        conn, _ = self.sock.accept()
+                    except BlockingIOError:
+                        continue
+                    conn.setblocking(False)
+                    selector.register(conn, selectors.EVENT_READ)
+                else:
+                    self.read(selector, key.fileobj, pending)
+
+        # Parada: sin ruta ni escucha, y con SHUT_RD (send() del productor falla
+        # con EPIPE), los productores pasan a escritura directa; después se
+        # vacía lo que ya estaba en los buffers de cada conexión
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        selector.unregister(self.sock)
+        self.sock.close()
+        for key in list(selector.get_map().values()):
+            conn = key.fileobj
+            conn.shutdown(socket.SHUT_RD)
+            conn.setblocking(True)
+            while self.read(selector, conn, pending):
+                pass
+        self.rows.put(None)
+
+    def write_loop(self):
+        for db_path in self.databases:
+            self.hot_load(db_path)
+        synced_at = time.monotonic()
+        while True:
+            if time.monotonic() - synced_at >= HOT_SYNC_INTERVAL:
+                # Recoger también lo que la API o los scripts escriben directamente
+                for db_path in self.databases:
+                    self.hot_sync(db_path)
+                synced_at = time.monotonic()
+            try:
+                item = self.rows.get(timeout=HOT_SYNC_INTERVAL)
+            except queue.Empty:
+                continue
+            if item is None:
+                return
+            # Todo lo acumulado mientras se escribía el lote anterior va en este
+            batch = [item]
+            stop = False
+            while len(batch) < self.batch_max:
+                try:
+                    item = self.rows.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self.write(batch)
+            if stop:
+                return
+
+    def write(self, batch):
+        grouped = defaultdict(lambda: defaultdict(list))
+        for db_path, table, row in batch:
+            grouped[db_path][table].append(row)
+
+        for db_path, tables in grouped.items():
+            storage = open_storage(db_path)
+            count = sum(len(rows) for rows in tables.values())
+            delay = 0.05
+            while True:
+                try:
+                    with storage.transaction() as conn:
+                        for table, rows in tables.items():
+                            conn.executemany(INSERT_SQL[table], rows)
+                    self.stats['written'] += count
+                    break
+                except sqlite3.OperationalError as e:
+                    if 'locked' not in str(e) and 'busy' not in str(e):
+                        self.write_rows(storage, tables)
+                        break
+                    # Otro escritor (API, scripts) retiene el bloqueo: esperar, nunca descartar
+                    self.stats['lock_retries'] += 1
+                    time.sleep(delay)
+                    delay = min(delay * 2, INGEST_LOCK_RETRY_MAX)
+                except sqlite3.DatabaseError:
+                    self.write_rows(storage, tables)
+                    break
+            self.stats['batches'] += 1
+            self.hot_sync(db_path)
+
+    def hot_load(self, db_path):
+        try:
+            self.tiers[os.path.realpath(db_path)].load(open_storage(db_path).connection())
+        except sqlite3.Error as e:
+            print(f"Error loading hot tier for {db_path}: {e}", flush=True)
+
+    def hot_sync(self, db_path):
+        """Sumar al nivel caliente las filas confirmadas (por este lote o por otros escritores)"""
+        tier = self.tiers[os.path.realpath(db_path)]
+        if not tier.loaded:
+            self.hot_load(db_path)
+            return
+        try:
+            self.stats['hot_synced'] += tier.sync(open_storage(db_path).connection())
+        except sqlite3.Error as e:
+            self.stats['hot_errors'] += 1
+            print(f"Error syncing hot tier for {db_path}: {e}", flush=True)
+
+    def write_rows(self, storage, tables):
+        """Una fila inválida no debe tirar el lote: SAVEPOINT por fila"""
+        with storage.transaction() as conn:
+            for table, rows in tables.items():
+                for row in rows:
+                    conn.execute("SAVEPOINT row")
+                    try:
+                        conn.execute(INSERT_SQL[table], row)
+                        self.stats['written'] += 1
+                    except sqlite3.Error as e:
+                        self.stats['failed'] += 1
+                        print(f"Error writing {table} row {row!r}: {e}", flush=True)
+                    finally:
+                        conn.execute("RELEASE row")
+
+    def stats_line(self):
+        stats = self.stats
+        return (f"received {stats['received']}, written {stats['written']} in {stats['batches']} batches, "
+                f"failed {stats['failed']}, rejected {stats['rejected']}, "
+                f"lock retries {stats['lock_retries']}, queue peak {stats['queue_peak']}, "
+                f"hot tier {stats['hot_synced']} rows")
+
+    def serve(self):
+        self.bind()
+        hot = HotServer(self.tiers, self.hot_path)
+        receiver = threading.Thread(target=self.receive_loop, daemon=True)
+        writer = threading.Thread(target=self.write_loop)
+        receiver.start()
+        writer.start()
+        threading.Thread(target=hot.serve_forever, daemon=True).start()
+        print(f"📥 Bytefense ingest listening on {self.path}, hot tier on {self.hot_path} "
+              f"(pid {os.getpid()})", flush=True)
+
+        last_stats = time.monotonic()
+        while self.running:
+            time.sleep(1)
+            if time.monotonic() - last_stats >= INGEST_STATS_INTERVAL:
+                last_stats = time.monotonic()
+                print(f"📊 {self.stats_line()}", flush=True)
+
+        hot.shutdown()
+        hot.server_close()
+        receiver.join()
+        writer.join()
+        print(f"🛑 Bytefense ingest stopped: {self.stats_line()}", flush=True)
+
+    def stop(self, *args):
+        self.running = False
+
+def main(argv):
+    if argv and argv[0] == 'serve':
+        options = dict(zip(argv[1::2], argv[2::2]))
+        server = IngestServer(options.get('--socket', INGEST_SOCKET),
+                              hot_path=options.get('--hot-socket', HOT_SOCKET))
+        signal.signal(signal.SIGTERM, server.stop)
+        signal.signal(signal.SIGINT, server.stop)
+        server.serve()
+        return 0
+
+    print(__doc__.strip().split('Uso:')[1].strip(), file=sys.stderr)
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
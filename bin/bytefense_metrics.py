@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bytefense OS - Métricas de las APIs en formato Prometheus
+
+Cuenta peticiones por endpoint, método y código de estado y guarda
+histogramas de latencia separando el tiempo total, el de base de datos y
+el de serialización. Cada petición sólo suma a contadores en memoria; el
+texto para Prometheus se genera al consultar /api/metrics.
+
+En modo pre-fork cada proceso vuelca periódicamente su estado a un
+fichero y /api/metrics suma los de todos los procesos del servicio. Un
+proceso reiniciado por el supervisor parte de su último volcado, así los
+contadores sumados nunca retroceden mientras el servicio siga arriba.
+"""
+
+import os
+import re
+import json
+import stat
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# Límites superiores de los buckets (segundos)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Directorio privado del usuario del servicio (nunca uno compartido como /tmp)
+METRICS_DIR = os.environ.get('BYTEFENSE_METRICS_DIR', '/opt/bytefense/run/metrics')
+METRICS_DUMP_INTERVAL = 5
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class Metrics:
+    """Contadores e histogramas de un proceso"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.requests = {}    # (endpoint, method, status) -> n
+        self.histograms = {}  # (metric, endpoint, phase) -> [bucket..., +Inf, sum]
+        self.local = threading.local()
+        self.dump_lock = threading.Lock()
+        self.dump_path = None
+        self.service = None
+
+    # -- Medición de la petición en curso (por hilo) --
+
+    def start_request(self):
+        local = self.local
+        local.start = time.perf_counter()
+        local.db = 0.0
+        local.serialize = 0.0
+
+    def add_time(self, phase, seconds):
+        local = self.local
+        setattr(local, phase, getattr(local, phase, 0.0) + seconds)
+
+    @contextmanager
+    def timer(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def end_request(self, endpoint, method, status, timed=True):
+        local = self.local
+        total = time.perf_counter() - local.start
+        with self.lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if timed:
+                self._observe('request', endpoint, 'total', total)
+                self._observe('request', endpoint, 'db', local.db)
+                self._observe('request', endpoint, 'serialize', local.serialize)
+
+    def observe(self, metric, endpoint, phase, seconds):
+        with self.lock:
+            self._observe(metric, endpoint, phase, seconds)
+
+    def _observe(self, metric, endpoint, phase, seconds):
+        key = (metric, endpoint, phase)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+    # -- Exposición --
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'requests': [[*key, n] for key, n in self.requests.items()],
+                'histograms': [[*key, list(h)] for key, h in self.histograms.items()]
+            }
+
+    def load(self, snapshot):
+        """Sumar a los contadores un volcado anterior de este mismo proceso"""
+        size = len(self.buckets) + 2
+        with self.lock:
+            for endpoint, method, status, n in snapshot['requests']:
+                key = (endpoint, method, status)
+                self.requests[key] = self.requests.get(key, 0) + n
+            for metric, endpoint, phase, h in snapshot['histograms']:
+                if len(h) != size:
+                    continue  # Volcado con otros buckets
+                key = (metric, endpoint, phase)
+                histogram = self.histograms.setdefault(key, [0] * (size - 1) + [0.0])
+                for i, value in enumerate(h):
+                    histogram[i] += value
+
+    def merged(self):
+        """Volcados de todos los procesos del servicio, empezando por el propio.
+        
+        Se vuelca antes de leer para que el proceso que atiende la petición
+        aporte el mismo valor que verán los demás: si se sumara su estado en
+        memoria, el total bajaría al responder otro proceso con el volcado.
+        """
+        requests = {}
+        histograms = {}
+        snapshots = [self.snapshot()]
+        if self.dump_path:
+            skip = self.dump_path
+            try:
+                self.dump()
+                snapshots, skip = [], None
+            except OSError:
+                pass
+            directory = os.path.dirname(self.dump_path)
+            pattern = re.compile(re.escape(self.service) + r'-\d+\.json')
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if pattern.fullmatch(name) and path != skip:
+                    try:
+                        with open(path) as f:
+                            snapshots.append(json.load(f))
+                    except (OSError, ValueError):
+                        continue
+
+        for snapshot in snapshots:
+            for endpoint, method, status, n in snapshot['requests']:
+                key = (endpoint, method, status)
+                requests[key] = requests.get(key, 0) + n
+            for metric, endpoint, phase, h in snapshot['histograms']:
+                key = (metric, endpoint, phase)
+                if key in histograms:
+                    histograms[key] = [a + b for a, b in zip(histograms[key], h)]
+                else:
+                    histograms[key] = list(h)
+        return requests, histograms
+
+    def render(self):
+        """Texto en formato de exposición de Prometheus"""
+        requests, histograms = self.merged()
+        lines = [
+            '# HELP bytefense_http_requests_total Peticiones atendidas por endpoint, método y estado.',
+            '# TYPE bytefense_http_requests_total counter'
+        ]
+        for (endpoint, method, status), n in sorted(requests.items()):
+            lines.append(f'bytefense_http_requests_total{{endpoint="{endpoint}",method="{method}",'
+                         f'status="{status}"}} {n}')
+
+        families = (
+            ('request', 'bytefense_http_request_duration_seconds',
+             'Latencia de las peticiones por fase (total, db, serialize).'),
+            ('cache_refresh', 'bytefense_cache_refresh_duration_seconds',
+             'Tiempo de recálculo de respuestas cacheadas por fase.')
+        )
+        for metric, name, help_text in families:
+            keys = sorted(k for k in histograms if k[0] == metric)
+            if not keys:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for key in keys:
+                _, endpoint, phase = key
+                h = histograms[key]
+                labels = f'endpoint="{endpoint}",phase="{phase}"'
+                cumulative = 0
+                for bound, count in zip(self.buckets, h):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                cumulative += h[len(self.buckets)]
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+                lines.append(f'{name}_sum{{{labels}}} {h[-1]:.6f}')
+                lines.append(f'{name}_count{{{labels}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    # -- Modo pre-fork --
+
+    def start_dumping(self, service, index, interval=METRICS_DUMP_INTERVAL):
+        """Volcar el estado de este proceso para que otros lo incluyan en /api/metrics.
+        
+        Si ya hay un volcado con este índice es de la instancia anterior del
+        mismo proceso (clear_dumps borra los de otras ejecuciones) y se toma
+        como base de los contadores.
+        """
+        try:
+            private_dir(METRICS_DIR)
+        except OSError as e:
+            print(f"Metrics dump disabled: {e}")
+            return
+        self.service = service
+        self.dump_path = os.path.join(METRICS_DIR, f'{service}-{index}.json')
+        try:
+            with open(self.dump_path) as f:
+                self.load(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring previous metrics dump: {e}")
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dump()
+                except OSError as e:
+                    print(f"Error dumping metrics: {e}")
+
+        threading.Thread(target=loop, daemon=True).start()
+
+    def dump(self):
+        tmp_path = f'{self.dump_path}.{os.getpid()}.tmp'
+        with self.dump_lock:
+            try:
+                os.unlink(tmp_path)  # Resto de un volcado interrumpido
+            except FileNotFoundError:
+                pass
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.snapshot(), f, separators=(',', ':'))
+            os.replace(tmp_path, self.dump_path)
+
+metrics = Metrics()
+
+def private_dir(path):
+    """Crear (si falta) un directorio sólo accesible por el usuario actual"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.geteuid():
+        raise OSError(f"{path} is not a directory owned by uid {os.geteuid()}")
+    if stat.S_IMODE(st.st_mode) != 0o700:
+        os.chmod(path, 0o700)
+
+def clear_dumps(service):
+    """Borrar volcados de una ejecución anterior (llamar antes de lanzar los procesos)"""
+    pattern = re.compile(re.escape(service) + r'-\d+\.json')
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        return
+    for name in names:
+        if pattern.fullmatch(name):
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except OSError:
+                pass
+
+class MetricsHandlerMixin:
+    """Recordar el código de estado enviado por un BaseHTTPRequestHandler"""
+
+    metrics_status = 0
+
+    def send_response(self, code, message=None):
+        self.metrics_status = code
+        super().send_response(code, message)
+
+def endpoint_label(path, routes):
+    """Etiqueta de métricas acotada: rutas conocidas, resto de la API o estáticos"""
+    path = path.split('?', 1)[0]
+    if path in routes:
+        return path
+    return "/api/other" if path.startswith("/api/") else "static"
+
+def instrumented(routes, untimed=()):
+    """Decorador para do_GET/do_POST: mide la petición bajo la etiqueta de su
+    ruta (una de `routes` o las genéricas de endpoint_label)"""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(handler):
+            metrics.start_request()
+            handler.metrics_status = 0
+            try:
+                return method(handler)
+            finally:
+                endpoint = endpoint_label(handler.path, routes)
+                metrics.end_request(endpoint, handler.command, handler.metrics_status,
+                                    timed=endpoint not in untimed)
+        return wrapper
+    return decorator
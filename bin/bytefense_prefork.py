@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bytefense OS - Supervisor pre-fork para los servidores HTTP
+
+Lanza N procesos hijo que escuchan en el mismo puerto con SO_REUSEPORT
+(el kernel reparte las conexiones entre ellos), comprueba que cada uno
+sigue atendiendo su bucle de accept() y reinicia los que mueren o se
+bloquean. El estado compartido entre procesos debe vivir en la base de
+datos o en memoria compartida creada antes de hacer fork.
+"""
+
+import os
+import sys
+import time
+import mmap
+import signal
+import socket
+import struct
+
+PREFORK_HEALTH_INTERVAL = 2     # segundos entre revisiones del supervisor
+PREFORK_HEALTH_TIMEOUT = 30     # un hijo sin latido durante este tiempo se reinicia
+PREFORK_RESTART_DELAY = 1       # espera inicial antes de relanzar un hijo caído
+PREFORK_RESTART_MAX_DELAY = 30  # tope del backoff ante caídas repetidas
+PREFORK_STOP_TIMEOUT = 10       # espera a que los hijos terminen al parar
+
+def worker_count(value):
+    """Número de procesos: 0 o negativo = uno por CPU"""
+    value = int(value)
+    return value if value > 0 else (os.cpu_count() or 1)
+
+def reuseport_socket(host, port, backlog=128):
+    """Socket de escucha que pueden compartir varios procesos"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+class WorkerSlots:
+    """Último latido de cada hijo en memoria compartida (un double por hijo)"""
+
+    SLOT = struct.Struct('d')
+
+    def __init__(self, count):
+        self.map = mmap.mmap(-1, self.SLOT.size * count)
+
+    def beat(self, index):
+        self.SLOT.pack_into(self.map, index * self.SLOT.size, time.monotonic())
+
+    def last(self, index):
+        return self.SLOT.unpack_from(self.map, index * self.SLOT.size)[0]
+
+class PreforkSupervisor:
+    """Mantener `workers` procesos ejecutando `target(index, beat)`.
+
+    `target` debe servir peticiones hasta que se le pida parar y llamar a
+    `beat()` periódicamente (p. ej. desde service_actions() del servidor).
+    El hijo con índice 0 es el primario: el único que debe ejecutar tareas
+    que no se pueden repetir en cada proceso.
+    """
+
+    def __init__(self, workers, target, name="bytefense"):
+        self.workers = workers
+        self.target = target
+        self.name = name
+        self.slots = WorkerSlots(workers)
+        self.pids = {}           # pid -> índice
+        self.failures = [0] * workers
+        self.started = [0.0] * workers
+        self.restart_at = [0.0] * workers
+        self.stopping = False
+
+    def _spawn(self, index):
+        self.slots.beat(index)
+        self.started[index] = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                signal.signal(signal.SIGTERM, _exit_on_signal)
+                self.target(index, lambda: self.slots.beat(index))
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 0
+            except BaseException as e:
+                print(f"[{self.name}] worker {index} crashed: {e}", file=sys.stderr)
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self.pids[pid] = index
+        return pid
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            index = self.pids.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+            # Backoff exponencial si el hijo muere nada más arrancar
+            uptime = time.monotonic() - self.started[index]
+            self.failures[index] = self.failures[index] + 1 if uptime < PREFORK_HEALTH_TIMEOUT else 1
+            delay = min(PREFORK_RESTART_DELAY * 2 ** (self.failures[index] - 1), PREFORK_RESTART_MAX_DELAY)
+            self.restart_at[index] = time.monotonic() + delay
+            print(f"[{self.name}] worker {index} (pid {pid}) exited with status {status}, "
+                  f"restarting in {delay}s", file=sys.stderr)
+
+    def _check_health(self):
+        now = time.monotonic()
+        for pid, index in list(self.pids.items()):
+            if now - self.slots.last(index) > PREFORK_HEALTH_TIMEOUT:
+                print(f"[{self.name}] worker {index} (pid {pid}) unresponsive, killing", file=sys.stderr)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        try:
+            while not self.stopping:
+                running = set(self.pids.values())
+                now = time.monotonic()
+                for index in range(self.workers):
+                    if index not in running and now >= self.restart_at[index]:
+                        self._spawn(index)
+                time.sleep(PREFORK_HEALTH_INTERVAL)
+                self._reap()
+                self._check_health()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        self.stopping = True
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + PREFORK_STOP_TIMEOUT
+        while self.pids and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self.pids.pop(pid, None)
+            else:
+                time.sleep(0.1)
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+def _exit_on_signal(signum, frame):
+    # Convertir SIGTERM en SystemExit para que se ejecuten los `finally`
+    raise SystemExit(0)
+
+def serve_wsgi_app(app, host, port, workers, backlog=128):
+    """Servir una app WSGI (Flask) con `workers` procesos; 1 = app.run de siempre"""
+    if workers <= 1:
+        app.run(host=host, port=port, debug=False)
+        return
+
+    from werkzeug.serving import make_server
+
+    def run_worker(index, beat):
+        sock = reuseport_socket(host, port, backlog)
+        server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+        server.service_actions = beat
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+    print(f"🚀 Serving on {host}:{port} with {workers} worker processes")
+    PreforkSupervisor(workers, run_worker, name=getattr(app, 'name', 'wsgi')).run()
@@ -0,0 +1,657 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bytefense OS - Migraciones versionadas del esquema SQLite
+
+Cada migración se aplica una sola vez por base de datos (bytefense.db y
+threats.db) dentro de una transacción y queda registrada en la tabla
+schema_migrations. Las instalaciones existentes se ponen al día al
+arrancar la API o los demonios; system/schema.sql sigue describiendo el
+estado final para crear bases nuevas desde los scripts de shell.
+
+También mantiene el registro de consultas calientes: `check` ejecuta
+EXPLAIN QUERY PLAN sobre cada una y falla si alguna recorre una tabla
+entera.
+
+Uso:
+    bytefense_schema.py migrate DB
+    bytefense_schema.py status DB
+    bytefense_schema.py check [DB]     (sin DB: base en memoria recién migrada)
+"""
+
+import sys
+import sqlite3
+
+# -- Migraciones --
+
+BASE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS blocked_ips (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ip TEXT UNIQUE NOT NULL,
+        reason TEXT NOT NULL,
+        date DATETIME NOT NULL,
+        country TEXT,
+        asn TEXT,
+        active BOOLEAN DEFAULT 1
+    );
+
+    CREATE TABLE IF NOT EXISTS blocked_domains (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        domain TEXT UNIQUE NOT NULL,
+        category TEXT,
+        source TEXT,
+        date DATETIME NOT NULL,
+        active BOOLEAN DEFAULT 1
+    );
+
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_type TEXT NOT NULL,
+        source_ip TEXT,
+        target_ip TEXT,
+        description TEXT,
+        severity INTEGER DEFAULT 1,
+        date DATETIME NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS node_config (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        updated DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS threat_intel (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        indicator TEXT NOT NULL,
+        type TEXT NOT NULL,
+        source TEXT NOT NULL,
+        confidence INTEGER DEFAULT 50,
+        tags TEXT,
+        first_seen DATETIME NOT NULL,
+        last_seen DATETIME NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS registered_nodes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        node_id TEXT UNIQUE NOT NULL,
+        node_name TEXT NOT NULL,
+        node_type TEXT NOT NULL,
+        ip_address TEXT NOT NULL,
+        public_ip TEXT,
+        port INTEGER DEFAULT 8080,
+        version TEXT,
+        status TEXT DEFAULT 'online',
+        last_heartbeat DATETIME NOT NULL,
+        first_registered DATETIME NOT NULL,
+        metadata TEXT
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_blocked_ips_date ON blocked_ips(date);
+    CREATE INDEX IF NOT EXISTS idx_blocked_ips_active ON blocked_ips(active);
+    CREATE INDEX IF NOT EXISTS idx_events_date ON events(date);
+    CREATE INDEX IF NOT EXISTS idx_events_type ON events(event_type);
+    CREATE INDEX IF NOT EXISTS idx_threat_intel_type ON threat_intel(type);
+    CREATE INDEX IF NOT EXISTS idx_registered_nodes_status ON registered_nodes(status);
+    CREATE INDEX IF NOT EXISTS idx_registered_nodes_heartbeat ON registered_nodes(last_heartbeat);
+    CREATE INDEX IF NOT EXISTS idx_registered_nodes_type ON registered_nodes(node_type);
+"""
+
+# Agregados horarios mantenidos por triggers (histogramas del dashboard)
+ROLLUP_SCHEMA = """
+    -- hour = 'YYYY-MM-DD HH:00:00'; fechas no interpretables se agrupan en ''.
+    -- Nota: INSERT OR REPLACE sólo descuenta la fila reemplazada con recursive_triggers.
+    CREATE TABLE IF NOT EXISTS blocked_ips_hourly (
+        hour TEXT NOT NULL,
+        reason TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, reason)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS events_hourly (
+        hour TEXT NOT NULL,
+        event_type TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, event_type)
+    ) WITHOUT ROWID;
+
+    CREATE TRIGGER IF NOT EXISTS trg_blocked_ips_hourly_insert AFTER INSERT ON blocked_ips
+    BEGIN
+        INSERT INTO blocked_ips_hourly (hour, reason, count)
+        VALUES (COALESCE(strftime('%Y-%m-%d %H:00:00', NEW.date), ''), NEW.reason, 1)
+        ON CONFLICT (hour, reason) DO UPDATE SET count = count + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_blocked_ips_hourly_delete AFTER DELETE ON blocked_ips
+    BEGIN
+        UPDATE blocked_ips_hourly SET count = count - 1
+        WHERE hour = COALESCE(strftime('%Y-%m-%d %H:00:00', OLD.date), '') AND reason = OLD.reason;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_blocked_ips_hourly_update AFTER UPDATE OF date, reason ON blocked_ips
+    BEGIN
+        UPDATE blocked_ips_hourly SET count = count - 1
+        WHERE hour = COALESCE(strftime('%Y-%m-%d %H:00:00', OLD.date), '') AND reason = OLD.reason;
+        INSERT INTO blocked_ips_hourly (hour, reason, count)
+        VALUES (COALESCE(strftime('%Y-%m-%d %H:00:00', NEW.date), ''), NEW.reason, 1)
+        ON CONFLICT (hour, reason) DO UPDATE SET count = count + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_events_hourly_insert AFTER INSERT ON events
+    BEGIN
+        INSERT INTO events_hourly (hour, event_type, count)
+        VALUES (COALESCE(strftime('%Y-%m-%d %H:00:00', NEW.date), ''), NEW.event_type, 1)
+        ON CONFLICT (hour, event_type) DO UPDATE SET count = count + 1;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_events_hourly_delete AFTER DELETE ON events
+    BEGIN
+        UPDATE events_hourly SET count = count - 1
+        WHERE hour = COALESCE(strftime('%Y-%m-%d %H:00:00', OLD.date), '') AND event_type = OLD.event_type;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_events_hourly_update AFTER UPDATE OF date, event_type ON events
+    BEGIN
+        UPDATE events_hourly SET count = count - 1
+        WHERE hour = COALESCE(strftime('%Y-%m-%d %H:00:00', OLD.date), '') AND event_type = OLD.event_type;
+        INSERT INTO events_hourly (hour, event_type, count)
+        VALUES (COALESCE(strftime('%Y-%m-%d %H:00:00', NEW.date), ''), NEW.event_type, 1)
+        ON CONFLICT (hour, event_type) DO UPDATE SET count = count + 1;
+    END;
+"""
+
+# Registro de cambios de estado de nodos, leído por /api/stream en todos los procesos
+STREAM_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS node_status_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        node_id TEXT NOT NULL,
+        status TEXT,
+        date DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TRIGGER IF NOT EXISTS trg_node_status_log_insert AFTER INSERT ON registered_nodes
+    BEGIN
+        INSERT INTO node_status_log (node_id, status) VALUES (NEW.node_id, NEW.status);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_node_status_log_update AFTER UPDATE OF status ON registered_nodes
+    WHEN OLD.status IS NOT NEW.status
+    BEGIN
+        INSERT INTO node_status_log (node_id, status) VALUES (NEW.node_id, NEW.status);
+    END;
+"""
+
+# Índices para la paginación por clave de los listados de la API
+LIST_INDEXES = """
+    CREATE INDEX IF NOT EXISTS idx_events_type_date ON events(event_type, date);
+    CREATE INDEX IF NOT EXISTS idx_blocked_ips_reason_date ON blocked_ips(reason, date);
+    CREATE INDEX IF NOT EXISTS idx_threat_intel_last_seen ON threat_intel(last_seen);
+    CREATE INDEX IF NOT EXISTS idx_threat_intel_type_seen ON threat_intel(type, last_seen);
+    CREATE INDEX IF NOT EXISTS idx_registered_nodes_type ON registered_nodes(node_type);
+"""
+
+# Índices de las consultas calientes (ver HOT_QUERIES)
+HOT_QUERY_INDEXES = """
+    -- auto_block_aggressive_ips: COUNT(*) por IP en la última hora, resuelto sólo con el índice
+    CREATE INDEX IF NOT EXISTS idx_events_source_date ON events(source_ip, date);
+
+    -- Top de amenazas de /api/threats: rango de fechas + GROUP BY ip, reason sin leer la tabla
+    CREATE INDEX IF NOT EXISTS idx_blocked_ips_date_ip_reason ON blocked_ips(date, ip, reason);
+
+    -- Prefijos de idx_events_type_date e idx_threat_intel_type_seen: sólo cuestan escrituras
+    DROP INDEX IF EXISTS idx_events_type;
+    DROP INDEX IF EXISTS idx_threat_intel_type;
+
+    -- Indicadores enriquecidos de bytefense-intel-advanced.py
+    CREATE TABLE IF NOT EXISTS threat_indicators (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        indicator TEXT NOT NULL,
+        type TEXT NOT NULL,
+        confidence INTEGER DEFAULT 50,
+        severity TEXT DEFAULT 'medium',
+        source TEXT NOT NULL,
+        tags TEXT,
+        context TEXT,
+        first_seen DATETIME NOT NULL,
+        last_seen DATETIME NOT NULL,
+        ttl INTEGER DEFAULT 86400,
+        metadata TEXT,
+        active BOOLEAN DEFAULT 1
+    );
+"""
+
+# Tablas propias de los demonios, antes creadas por cada uno al arrancar
+DAEMON_SCHEMA = """
+    -- bytefense-incident-response.py
+    CREATE TABLE IF NOT EXISTS incidents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        description TEXT,
+        severity INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        source_ip TEXT,
+        target_ip TEXT,
+        attack_type TEXT,
+        indicators TEXT,
+        created_at DATETIME NOT NULL,
+        updated_at DATETIME NOT NULL,
+        resolved_at DATETIME,
+        playbook_executed TEXT,
+        actions_taken TEXT,
+        analyst_notes TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS incident_timeline (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        incident_id INTEGER,
+        timestamp DATETIME NOT NULL,
+        action TEXT NOT NULL,
+        details TEXT,
+        automated BOOLEAN DEFAULT 1,
+        FOREIGN KEY (incident_id) REFERENCES incidents (id)
+    );
+
+    -- bytefense-intel-advanced.py
+    CREATE TABLE IF NOT EXISTS malware_analysis (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        hash_md5 TEXT,
+        hash_sha1 TEXT,
+        hash_sha256 TEXT,
+        file_type TEXT,
+        file_size INTEGER,
+        family TEXT,
+        analysis_date DATETIME,
+        sandbox_report TEXT,
+        yara_matches TEXT,
+        behavior TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS attack_campaigns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        description TEXT,
+        threat_actor TEXT,
+        start_date DATETIME,
+        end_date DATETIME,
+        indicators TEXT,
+        ttps TEXT,
+        targets TEXT,
+        active BOOLEAN DEFAULT 1
+    );
+"""
+
+# Bases auxiliares, fuera de las migraciones (bytefense_storage.Storage(schema=...))
+SPEEDTEST_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS speedtest_results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        download_speed REAL,
+        upload_speed REAL,
+        ping REAL,
+        jitter REAL,
+        server_info TEXT,
+        test_type TEXT DEFAULT 'auto'
+    );
+
+    CREATE TABLE IF NOT EXISTS network_stats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        interface_name TEXT,
+        bytes_sent INTEGER,
+        bytes_recv INTEGER,
+        packets_sent INTEGER,
+        packets_recv INTEGER
+    );
+
+    -- Resultados recientes y recorte a max_results ordenan por timestamp
+    CREATE INDEX IF NOT EXISTS idx_speedtest_results_timestamp ON speedtest_results(timestamp);
+"""
+
+NETWORK_MONITOR_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS network_activity (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        node_ip TEXT,
+        node_name TEXT,
+        app_name TEXT,
+        bandwidth_down REAL,
+        bandwidth_up REAL,
+        connections_count INTEGER,
+        risk_level TEXT,
+        category TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS visited_sites (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        node_ip TEXT,
+        url TEXT,
+        domain TEXT,
+        category TEXT,
+        risk_level TEXT,
+        blocked BOOLEAN DEFAULT FALSE,
+        response_time REAL
+    );
+
+    CREATE TABLE IF NOT EXISTS network_topology (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        source_ip TEXT,
+        dest_ip TEXT,
+        protocol TEXT,
+        port INTEGER,
+        status TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS ai_analysis (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        analysis_type TEXT,
+        node_ip TEXT,
+        anomaly_score REAL,
+        threat_level TEXT,
+        details TEXT
+    );
+"""
+
+def table_exists(conn, name):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+def fill_rollups(conn):
+    """Recalcular los agregados horarios desde las tablas originales (sin transacción propia)"""
+    conn.execute("DELETE FROM blocked_ips_hourly")
+    conn.execute("""
+        INSERT INTO blocked_ips_hourly (hour, reason, count)
+        SELECT COALESCE(strftime('%Y-%m-%d %H:00:00', date), ''), reason, COUNT(*)
+        FROM blocked_ips
+        GROUP BY 1, 2
+    """)
+    conn.execute("DELETE FROM events_hourly")
+    conn.execute("""
+        INSERT INTO events_hourly (hour, event_type, count)
+        SELECT COALESCE(strftime('%Y-%m-%d %H:00:00', date), ''), event_type, COUNT(*)
+        FROM events
+        GROUP BY 1, 2
+    """)
+
+def rebuild_rollups(conn):
+    """Recalcular los agregados horarios en una transacción"""
+    with conn:
+        fill_rollups(conn)
+
+def _partition_events(conn):
+    from bytefense_events import convert
+    convert(conn)
+
+def _unique_threat_indicators(conn):
+    """Clave única (indicator, source) en threat_indicators.
+    
+    Sin ella, el INSERT OR REPLACE de los feeds duplicaba cada indicador en
+    cada actualización. Se conserva la fila más reciente de cada par y las
+    demás se copian a threat_indicators_duplicates antes de borrarlas.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS threat_indicators_duplicates AS
+        SELECT * FROM threat_indicators WHERE 0
+    """)
+    stale = """
+        FROM threat_indicators WHERE id NOT IN (
+            SELECT MAX(id) FROM threat_indicators GROUP BY indicator, source
+        )
+    """
+    conn.execute(f"INSERT INTO threat_indicators_duplicates SELECT * {stale}")
+    removed = conn.execute(f"DELETE {stale}").rowcount
+    if removed:
+        print(f"threat_indicators: {removed} duplicate rows moved to threat_indicators_duplicates")
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_threat_indicators_indicator_source
+            ON threat_indicators(indicator, source)
+    """)
+
+def _rollups(conn):
+    existed = table_exists(conn, 'events_hourly')
+    run_script(conn, ROLLUP_SCHEMA)
+    if not existed:
+        fill_rollups(conn)
+
+# (versión, nombre, SQL o función(conn)); no modificar una migración ya publicada
+MIGRATIONS = [
+    (1, 'base', BASE_SCHEMA),
+    (2, 'hourly_rollups', _rollups),
+    (3, 'node_status_log', STREAM_SCHEMA),
+    (4, 'list_indexes', LIST_INDEXES),
+    (5, 'hot_query_indexes', HOT_QUERY_INDEXES),
+    (6, 'events_partitions', _partition_events),
+    (7, 'daemon_tables', DAEMON_SCHEMA),
+    (8, 'threat_indicators_unique', _unique_threat_indicators),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def split_statements(script):
+    """Sentencias de un script SQL (respeta los ';' dentro de los triggers)"""
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            if statement.strip():
+                yield statement.strip()
+            statement = ''
+    if statement.strip() and not statement.strip().startswith('--'):
+        yield statement.strip()
+
+def run_script(conn, script):
+    # executescript() hace COMMIT antes de empezar: ejecutar sentencia a sentencia
+    for statement in split_statements(script):
+        conn.execute(statement)
+
+def applied_versions(conn):
+    if not table_exists(conn, 'schema_migrations'):
+        return set()
+    return {version for version, in conn.execute("SELECT version FROM schema_migrations")}
+
+def migrate(conn, target=LATEST_VERSION):
+    """Aplicar las migraciones pendientes hasta `target`; devuelve las versiones aplicadas.
+
+    Cada migración va en su propia transacción IMMEDIATE, así varios
+    procesos que arrancan a la vez no aplican dos veces la misma.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    applied = []
+    for version, name, step in MIGRATIONS:
+        if version > target or version in applied_versions(conn):
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Otro proceso pudo aplicarla mientras esperábamos el bloqueo
+            if version in applied_versions(conn):
+                conn.execute("ROLLBACK")
+                continue
+            if callable(step):
+                step(conn)
+            else:
+                run_script(conn, step)
+            conn.execute("INSERT INTO schema_migrations (version, name) VALUES (?, ?)",
+                         (version, name))
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        applied.append(version)
+    return applied
+
+def migrate_path(db_path, target=LATEST_VERSION):
+    """migrate() abriendo y cerrando la base de datos"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        return migrate(conn, target)
+    finally:
+        conn.close()
+
+# -- Consultas calientes --
+
+# nombre -> (SQL, parámetros de ejemplo, acotada). "Acotada" permite recorrer un
+# índice en orden (ORDER BY ... LIMIT), nunca la tabla sin índice.
+HOT_QUERIES = {}
+
+def register_hot_query(name, sql, params=(), bounded=False):
+    HOT_QUERIES[name] = (sql, tuple(params), bounded)
+
+def full_scans(conn, sql, params=(), bounded=False):
+    """Pasos de EXPLAIN QUERY PLAN que recorren una tabla entera"""
+    tables = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    scans = []
+    for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+        detail = row[-1]
+        # SCAN sobre vistas, subconsultas o co-rutinas recorre filas ya filtradas
+        if not detail.startswith('SCAN ') or detail.split()[1] not in tables:
+            continue
+        if bounded and ' USING ' in detail:
+            continue
+        scans.append(detail)
+    return scans
+
+def check_query_plans(conn, queries=None):
+    """{nombre: [pasos con recorrido completo]} de las consultas que fallan"""
+    failures = {}
+    for name, (sql, params, bounded) in (queries or HOT_QUERIES).items():
+        scans = full_scans(conn, sql, params, bounded)
+        if scans:
+            failures[name] = scans
+    return failures
+
+register_hot_query('honeypot.auto_block_aggressive_ips', """
+    SELECT COUNT(*) FROM events WHERE source_ip = ? AND date > datetime('now', '-1 hour')
+""", ('203.0.113.7',))
+
+register_hot_query('intel.detect_attack_campaign', """
+    SELECT * FROM threat_indicators WHERE indicator IN (?, ?)
+""", ('203.0.113.7', 'evil.example.com'))
+
+register_hot_query('api.threats.top', """
+    SELECT ip, reason, COUNT(*) as count
+    FROM blocked_ips
+    WHERE date >= datetime('now', '-24 hours')
+    GROUP BY +ip, reason
+    ORDER BY count DESC
+    LIMIT 10
+""")
+
+register_hot_query('api.threats.hourly', """
+    SELECT hour, SUM(count)
+    FROM blocked_ips_hourly
+    WHERE hour >= strftime('%Y-%m-%d %H:00:00', 'now', '-23 hours')
+    GROUP BY hour
+""")
+
+register_hot_query('api.events.by_type', """
+    SELECT event_type, SUM(count) as count
+    FROM events_hourly
+    WHERE hour >= strftime('%Y-%m-%d %H:00:00', 'now', '-23 hours')
+    GROUP BY event_type
+""")
+
+register_hot_query('api.events.recent', """
+    SELECT event_type, source_ip, description, datetime(date, 'localtime')
+    FROM (SELECT event_type, source_ip, description, date FROM events ORDER BY date DESC LIMIT 20)
+""", bounded=True)
+
+register_hot_query('api.secure.threats.hourly', """
+    SELECT strftime('%H', date) as hour, COUNT(*) as count
+    FROM blocked_ips
+    WHERE date >= datetime('now', '-24 hours')
+    GROUP BY strftime('%H', date)
+""")
+
+register_hot_query('api.list.events', """
+    SELECT date, id, event_type, source_ip FROM events
+    WHERE date >= ? AND (date, id) < (?, ?) ORDER BY date DESC, id DESC LIMIT ?
+""", ('2024-01-01 00:00:00', '2024-02-01 00:00:00', 1000, 101), bounded=True)
+
+register_hot_query('api.list.events_by_type', """
+    SELECT date, id, event_type, source_ip FROM events
+    WHERE event_type = ? AND (date, id) < (?, ?) ORDER BY date DESC, id DESC LIMIT ?
+""", ('SCAN', '2024-02-01 00:00:00', 1000, 101), bounded=True)
+
+register_hot_query('api.list.threats_by_reason', """
+    SELECT date, id, ip, reason FROM blocked_ips
+    WHERE reason = ? ORDER BY date DESC, id DESC LIMIT ?
+""", ('Port Scan', 101), bounded=True)
+
+register_hot_query('api.list.intel_by_type', """
+    SELECT last_seen, id, indicator FROM threat_intel
+    WHERE type = ? ORDER BY last_seen DESC, id DESC LIMIT ?
+""", ('ip', 101), bounded=True)
+
+register_hot_query('api.heartbeat', """
+    UPDATE registered_nodes SET last_heartbeat = datetime('now'), status = ? WHERE node_id = ?
+""", ('online', 'node-1'))
+
+register_hot_query('api.offline_nodes', """
+    SELECT node_id FROM registered_nodes
+    WHERE status = 'online' AND last_heartbeat < datetime('now', '-300 seconds')
+""")
+
+register_hot_query('api.stream.node_status', """
+    SELECT id, node_id, status FROM node_status_log WHERE id > ? ORDER BY id
+""", (0,))
+
+register_hot_query('alerts.check_blocked_ips', """
+    SELECT COUNT(*) FROM blocked_ips WHERE date > ?
+""", ('2024-01-01 00:00:00',))
+
+register_hot_query('alerts.check_nodes', """
+    SELECT l.id, l.node_id, n.node_name, n.last_heartbeat
+    FROM node_status_log l
+    LEFT JOIN registered_nodes n ON n.node_id = l.node_id
+    WHERE l.id > ? AND l.status = ?
+    ORDER BY l.id
+""", (0, 'offline'))
+
+register_hot_query('alerts.check_honeypot_activity', """
+    SELECT COUNT(*) FROM events WHERE date > ? AND event_type IN (?, ?, ?, ?)
+""", ('2024-01-01 00:00:00', 'ssh_login_attempt', 'ssh_additional_attempt', 'http_access', 'http_post_data'))
+
+def main(argv):
+    if len(argv) >= 2 and argv[0] == 'migrate':
+        applied = migrate_path(argv[1])
+        print(f"✅ {argv[1]}: versión {LATEST_VERSION}"
+              + (f" (aplicadas: {', '.join(map(str, applied))})" if applied else " (sin cambios)"))
+        return 0
+
+    if len(argv) >= 2 and argv[0] == 'status':
+        conn = sqlite3.connect(argv[1])
+        applied = applied_versions(conn)
+        conn.close()
+        for version, name, _ in MIGRATIONS:
+            print(f"{'✅' if version in applied else '⏳'} {version:3d} {name}")
+        return 0
+
+    if argv and argv[0] == 'check':
+        conn = sqlite3.connect(argv[1] if len(argv) >= 2 else ':memory:')
+        if len(argv) < 2:
+            migrate(conn)
+        failures = check_query_plans(conn)
+        conn.close()
+        for name, scans in failures.items():
+            print(f"❌ {name}: {'; '.join(scans)}")
+        if failures:
+            return 1
+        print(f"✅ {len(HOT_QUERIES)} consultas calientes sin recorridos completos")
+        return 0
+
+    print(__doc__.strip().split('Uso:')[1].strip(), file=sys.stderr)
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
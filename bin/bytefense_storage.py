@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bytefense OS - Acceso compartido a las bases de datos SQLite
+
+Todos los demonios (IDS, honeypot, alertas, respuesta a incidentes,
+threat intelligence, speedtest, monitor de red) y las APIs abren sus bases
+desde aquí: rutas configurables por entorno, una conexión por hilo en modo
+WAL con los mismos pragmas, el esquema al día (bytefense_schema) y helpers
+de inserción y consulta escritos contra las columnas reales del esquema.
+
+Las fechas se guardan siempre en UTC con el formato de datetime('now')
+('YYYY-MM-DD HH:MM:SS'), que es el que comparan las consultas, los
+agregados horarios y el enrutado de particiones de events.
+"""
+
+import os
+import time
+import sqlite3
+import calendar
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from bytefense_schema import migrate, run_script
+from bytefense_events import events_source
+
+# Rutas de las bases de datos
+SYSTEM_DB = os.environ.get('BYTEFENSE_DB_PATH', "/opt/bytefense/system/bytefense.db")
+INTEL_DB = os.environ.get('BYTEFENSE_INTEL_DB', "/opt/bytefense/intel/threats.db")
+SPEEDTEST_DB = os.environ.get('BYTEFENSE_SPEEDTEST_DB', "/opt/bytefense/system/speedtest.db")
+NETWORK_MONITOR_DB = os.environ.get('BYTEFENSE_NETWORK_MONITOR_DB',
+                                    "/opt/bytefense/system/network_monitor.db")
+
+# Conexiones SQLite
+DB_BUSY_TIMEOUT_MS = 5000               # espera ante "database is locked"
+DB_MMAP_SIZE = 64 * 1024 * 1024         # lecturas vía mmap
+DB_CACHE_SIZE_KB = 8192                 # caché de páginas por conexión
+DB_STATEMENT_CACHE = 128                # sentencias preparadas por conexión
+
+# Tipos de evento que registra bytefense-honeypot.py (log_honeypot_activity)
+HONEYPOT_EVENT_TYPES = ('ssh_login_attempt', 'ssh_additional_attempt', 'http_access', 'http_post_data')
+
+# Severidades textuales (alertas) -> events.severity
+SEVERITY_LEVELS = {'low': 1, 'medium': 2, 'high': 3, 'critical': 4}
+
+# Inserciones de una fila por tabla, compartidas con el demonio de ingesta (bytefense_ingest.py)
+INSERT_SQL = {
+    'events': """
+        INSERT INTO events (event_type, source_ip, target_ip, description, severity, date)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """,
+    'blocked_ips': "INSERT OR IGNORE INTO blocked_ips (ip, reason, date) VALUES (?, ?, ?)",
+    'incident_timeline': """
+        INSERT INTO incident_timeline (incident_id, timestamp, action, details)
+        VALUES (?, ?, ?, ?)
+    """,
+}
+
+def utc_now(timestamp=None):
+    """Fecha en el mismo formato que datetime('now') de SQLite"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp))
+
+def db_date(value=None):
+    """Normalizar una fecha al formato UTC de la base de datos.
+
+    None es ahora; un datetime sin zona se interpreta como hora local
+    (datetime.now()); las cadenas se guardan tal cual.
+    """
+    if value is None:
+        return utc_now()
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, (int, float)):
+        return utc_now(value)
+    return value
+
+def connect(db_path, **kwargs):
+    """Abrir una conexión con los pragmas comunes (WAL, mmap, caché)"""
+    options = {'timeout': DB_BUSY_TIMEOUT_MS / 1000,
+               'cached_statements': DB_STATEMENT_CACHE,
+               'check_same_thread': False}
+    options.update(kwargs)
+    conn = sqlite3.connect(db_path, **options)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+    except sqlite3.OperationalError:
+        pass  # Base de datos de solo lectura: mantener el modo actual
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+class ConnectionPool:
+    """Una conexión SQLite por hilo, abierta una vez con pragmas ajustados.
+
+    Las consultas se reutilizan como sentencias preparadas gracias a la
+    caché de sentencias de cada conexión (clave: texto SQL). Un proceso hijo
+    (modo pre-fork) abre las suyas: una conexión SQLite no debe cruzar un fork.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+        os.register_at_fork(after_in_child=self._forget)
+
+    def _forget(self):
+        # Sin close(): las conexiones heredadas siguen siendo del padre
+        self.lock = threading.Lock()
+        self.connections = []
+        self.local = threading.local()
+
+    def get(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = connect(self.db_path)
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def close_all(self):
+        with self.lock:
+            for conn in self.connections:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self.connections = []
+            self.local = threading.local()
+
+class Storage:
+    """Una base de datos de Bytefense: pool por hilo, esquema y helpers.
+
+    Con `migrations` (bytefense.db, threats.db) se aplican las migraciones
+    versionadas al abrir; `schema` es el script propio de bases auxiliares
+    (speedtest, monitor de red).
+    """
+
+    def __init__(self, db_path, migrations=True, schema=None):
+        self.db_path = db_path
+        self.pool = ConnectionPool(db_path)
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if migrations:
+            migrate(self.connection())
+        if schema:
+            with self.transaction() as conn:
+                run_script(conn, schema)
+
+    def connection(self):
+        return self.pool.get()
+
+    @contextmanager
+    def transaction(self):
+        """Transacción IMMEDIATE: el bloqueo de escritura se pide al empezar,
+        así busy_timeout espera en lugar de fallar al promocionar una lectura"""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    def execute(self, sql, params=()):
+        """Escritura en su propia transacción; devuelve el cursor (lastrowid, rowcount)"""
+        with self.transaction() as conn:
+            return conn.execute(sql, params)
+
+    def executemany(self, sql, rows):
+        with self.transaction() as conn:
+            return conn.executemany(sql, rows).rowcount
+
+    def query(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchone()
+
+    def scalar(self, sql, params=()):
+        row = self.query_one(sql, params)
+        return row[0] if row else None
+
+    def close(self):
+        self.pool.close_all()
+
+    def submit(self, table, row):
+        """Encolar una fila de INSERT_SQL en el demonio de ingesta, que la
+        escribe en lote; si no está disponible, escribirla aquí"""
+        from bytefense_ingest import ingest_client
+        if not ingest_client().send(self.db_path, table, row):
+            self.execute(INSERT_SQL[table], row)
+
+    # -- events --
+
+    @staticmethod
+    def event_row(event_type, description=None, source_ip=None, target_ip=None,
+                  severity=1, date=None):
+        if isinstance(severity, str):
+            severity = SEVERITY_LEVELS.get(severity, 1)
+        return (event_type, source_ip, target_ip, description, severity, db_date(date))
+
+    def insert_event(self, *args, conn=None, **kwargs):
+        """Registrar un evento ya; `conn` para incluirlo en una transacción abierta"""
+        # Sin lastrowid: la vista events inserta mediante un trigger INSTEAD OF
+        row = self.event_row(*args, **kwargs)
+        if conn is not None:
+            conn.execute(INSERT_SQL['events'], row)
+        else:
+            self.execute(INSERT_SQL['events'], row)
+
+    def submit_event(self, *args, **kwargs):
+        """Registrar un evento a través del demonio de ingesta (mismos argumentos que event_row)"""
+        self.submit('events', self.event_row(*args, **kwargs))
+
+    def hot_count(self, series, since, types=None, ip=None):
+        """Recuento de las últimas 24 horas desde el nivel caliente en memoria
+        (bytefense_hot.py), redondeado a minutos; None si hay que ir a SQL"""
+        from bytefense_hot import hot_client
+        try:
+            start = calendar.timegm(time.strptime(since[:19], '%Y-%m-%d %H:%M:%S'))
+        except ValueError:
+            return None
+        minutes = round((time.time() - start) / 60)
+        if minutes < 1:
+            return None
+        return hot_client().count(self.db_path, series, minutes, types=types, ip=ip)
+
+    def count_events(self, since, source_ip=None, event_types=None):
+        """Eventos desde `since` (UTC), opcionalmente de una IP o de unos tipos;
+        del nivel caliente si está disponible, si no sólo se leen las
+        particiones de ese intervalo"""
+        since = db_date(since)
+        count = self.hot_count('events', since, types=event_types, ip=source_ip)
+        if count is not None:
+            return count
+        conn = self.connection()
+        where, params = ["date > ?"], [since]
+        if source_ip is not None:
+            where.append("source_ip = ?")
+            params.append(source_ip)
+        if event_types is not None:
+            where.append(f"event_type IN ({', '.join('?' * len(event_types))})")
+            params += list(event_types)
+        return conn.execute(
+            f"SELECT COUNT(*) FROM {events_source(conn, since)} WHERE {' AND '.join(where)}",
+            params
+        ).fetchone()[0]
+
+    # -- blocked_ips --
+
+    def block_ip(self, ip, reason, date=None, conn=None):
+        """Añadir una IP a blocked_ips; False si ya estaba"""
+        params = (ip, reason, db_date(date))
+        if conn is not None:
+            return conn.execute(INSERT_SQL['blocked_ips'], params).rowcount > 0
+        return self.execute(INSERT_SQL['blocked_ips'], params).rowcount > 0
+
+    def submit_blocked_ip(self, ip, reason, date=None):
+        self.submit('blocked_ips', (ip, reason, db_date(date)))
+
+    def count_blocked_ips(self, since):
+        since = db_date(since)
+        count = self.hot_count('blocked_ips', since)
+        if count is not None:
+            return count
+        return self.scalar("SELECT COUNT(*) FROM blocked_ips WHERE date > ?", (since,))
+
+    # -- registered_nodes --
+
+    # El estado lo escribe sólo la API (heartbeats y detección offline); aquí se lee
+
+    def last_node_status_change(self):
+        return self.scalar("SELECT COALESCE(MAX(id), 0) FROM node_status_log")
+
+    def node_status_changes(self, after_id, status):
+        """(id, node_id, node_name, last_heartbeat) de los cambios a `status` posteriores a `after_id`"""
+        return self.query("""
+            SELECT l.id, l.node_id, n.node_name, n.last_heartbeat
+            FROM node_status_log l
+            LEFT JOIN registered_nodes n ON n.node_id = l.node_id
+            WHERE l.id > ? AND l.status = ?
+            ORDER BY l.id
+        """, (after_id, status))
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+def open_storage(db_path, migrations=True, schema=None):
+    """Storage compartido por todo el proceso para `db_path` (migra una sola vez)"""
+    with _storages_lock:
+        storage = _storages.get(db_path)
+        if storage is None:
+            storage = _storages[db_path] = Storage(db_path, migrations, schema)
+        return storage
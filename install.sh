@@ -267,21 +267,31 @@ install_core_module() {
         error_exit "Error al actualizar pip"
     fi
     
-    if ! pip3 install flask pyjwt bcrypt pyotp qrcode[pil] requests feedparser schedule; then
+    if ! pip3 install flask pyjwt bcrypt pyotp qrcode[pil] requests feedparser schedule numpy; then
         error_exit "Error al instalar dependencias Python"
     fi
     
     # Descargar scripts desde GitHub de forma segura
-    local scripts=("bytefense-api.py" "bytefense-ctl" "bytefense-alerts.py" "bytefense-auth.py")
+    local scripts=("bytefense-api.py" "bytefense-ctl" "bytefense-alerts.py" "bytefense-auth.py"
+                   "bytefense_ingest.py")
+    # Módulos compartidos que importan los scripts anteriores
+    local modules=("bytefense_storage.py" "bytefense_schema.py" "bytefense_events.py"
+                   "bytefense_prefork.py" "bytefense_metrics.py" "bytefense_geoip.py" "bytefense_hot.py"
+                   "bytefense_archive.py")
     
     for script in "${scripts[@]}"; do
         safe_download "$GITHUB_BASE/bin/$script" "$BYTEFENSE_HOME/bin/$script" "script $script"
         chmod +x "$BYTEFENSE_HOME/bin/$script"
     done
     
+    for module in "${modules[@]}"; do
+        safe_download "$GITHUB_BASE/bin/$module" "$BYTEFENSE_HOME/bin/$module" "módulo $module"
+    done
+    
     # Descargar archivos web
     safe_download "$GITHUB_BASE/web/index.html" "$BYTEFENSE_HOME/web/index.html" "dashboard web"
     safe_download "$GITHUB_BASE/system/schema.sql" "$BYTEFENSE_HOME/system/schema.sql" "esquema de base de datos"
+    safe_download "$GITHUB_BASE/system/bytefense-ingest.service" "$BYTEFENSE_HOME/system/bytefense-ingest.service" "servicio de ingesta"
     
     # Crear enlace simbólico con validación
     if ! ln -sf "$BYTEFENSE_HOME/bin/bytefense-ctl" /usr/local/bin/bytefense-ctl; then
@@ -692,7 +702,7 @@ fi
 
 # Habilitar servicios base
 log "🚀 Habilitando servicios base..."
-for service in bytefense-dashboard bytefense-watch; do
+for service in bytefense-ingest bytefense-dashboard bytefense-watch; do
     if systemctl enable "$service" 2>/dev/null; then
         log "✅ Servicio $service habilitado"
         if systemctl start "$service" 2>/dev/null; then
@@ -1,5 +1,6 @@
 -- Bytefense OS - Esquema de Base de Datos
 -- Base de datos SQLite para inteligencia de amenazas
+-- Estado final de las migraciones de bin/bytefense_schema.py (mantener sincronizados)
 
 CREATE TABLE IF NOT EXISTS blocked_ips (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -20,6 +21,7 @@ CREATE TABLE IF NOT EXISTS blocked_domains (
     active BOOLEAN DEFAULT 1
 );
 
+-- La migración 6 la renombra a events_legacy y crea la vista particionada (bytefense_events.py)
 CREATE TABLE IF NOT EXISTS events (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     event_type TEXT NOT NULL,
@@ -67,10 +69,174 @@ CREATE TABLE IF NOT EXISTS registered_nodes (
 CREATE INDEX IF NOT EXISTS idx_blocked_ips_date ON blocked_ips(date);
 CREATE INDEX IF NOT EXISTS idx_blocked_ips_active ON blocked_ips(active);
 CREATE INDEX IF NOT EXISTS idx_events_date ON events(date);
-CREATE INDEX IF NOT EXISTS idx_events_type ON events(event_type);
-CREATE INDEX IF NOT EXISTS idx_threat_intel_type ON threat_intel(type);
 CREATE INDEX IF NOT EXISTS idx_registered_nodes_status ON registered_nodes(status);
 CREATE INDEX IF NOT EXISTS idx_registered_nodes_heartbeat ON registered_nodes(last_heartbeat);
+CREATE INDEX IF NOT EXISTS idx_registered_nodes_type ON registered_nodes(node_type);
+
+-- Índices para la paginación por clave de los listados de la API
+CREATE INDEX IF NOT EXISTS idx_events_type_date ON events(event_type, date);
+CREATE INDEX IF NOT EXISTS idx_blocked_ips_reason_date ON blocked_ips(reason, date);
+CREATE INDEX IF NOT EXISTS idx_threat_intel_last_seen ON threat_intel(last_seen);
+CREATE INDEX IF NOT EXISTS idx_threat_intel_type_seen ON threat_intel(type, last_seen);
+
+-- Índices de las consultas calientes (bytefense_schema.py check)
+CREATE INDEX IF NOT EXISTS idx_events_source_date ON events(source_ip, date);
+CREATE INDEX IF NOT EXISTS idx_blocked_ips_date_ip_reason ON blocked_ips(date, ip, reason);
+
+-- Indicadores enriquecidos de bytefense-intel-advanced.py
+CREATE TABLE IF NOT EXISTS threat_indicators (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    indicator TEXT NOT NULL,
+    type TEXT NOT NULL,
+    confidence INTEGER DEFAULT 50,
+    severity TEXT DEFAULT 'medium',
+    source TEXT NOT NULL,
+    tags TEXT,
+    context TEXT,
+    first_seen DATETIME NOT NULL,
+    last_seen DATETIME NOT NULL,
+    ttl INTEGER DEFAULT 86400,
+    metadata TEXT,
+    active BOOLEAN DEFAULT 1
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_threat_indicators_indicator_source ON threat_indicators(indicator, source);
+
+-- Agregados horarios mantenidos por triggers (histogramas del dashboard)
+-- hour = 'YYYY-MM-DD HH:00:00'; fechas no interpretables se agrupan en ''.
+-- Nota: INSERT OR REPLACE sólo descuenta la fila reemplazada con recursive_triggers.
+CREATE TABLE IF NOT EXISTS blocked_ips_hourly (
+    hour TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, reason)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS events_hourly (
+    hour TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, event_type)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_blocked_ips_hourly_insert AFTER INSERT ON blocked_ips
+BEGIN
+    INSERT INTO blocked_ips_hourly (hour, reason, count)
+    VALUES (COALESCE(strftime('%Y-%m-%d %H:00:00', NEW.date), ''), NEW.reason, 1)
+    ON CONFLICT (hour, reason) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_blocked_ips_hourly_delete AFTER DELETE ON blocked_ips
+BEGIN
+    UPDATE blocked_ips_hourly SET count = count - 1
+    WHERE hour = COALESCE(strftime('%Y-%m-%d %H:00:00', OLD.date), '') AND reason = OLD.reason;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_blocked_ips_hourly_update AFTER UPDATE OF date, reason ON blocked_ips
+BEGIN
+    UPDATE blocked_ips_hourly SET count = count - 1
+    WHERE hour = COALESCE(strftime('%Y-%m-%d %H:00:00', OLD.date), '') AND reason = OLD.reason;
+    INSERT INTO blocked_ips_hourly (hour, reason, count)
+    VALUES (COALESCE(strftime('%Y-%m-%d %H:00:00', NEW.date), ''), NEW.reason, 1)
+    ON CONFLICT (hour, reason) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_events_hourly_insert AFTER INSERT ON events
+BEGIN
+    INSERT INTO events_hourly (hour, event_type, count)
+    VALUES (COALESCE(strftime('%Y-%m-%d %H:00:00', NEW.date), ''), NEW.event_type, 1)
+    ON CONFLICT (hour, event_type) DO UPDATE SET count = count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_events_hourly_delete AFTER DELETE ON events
+BEGIN
+    UPDATE events_hourly SET count = count - 1
+    WHERE hour = COALESCE(strftime('%Y-%m-%d %H:00:00', OLD.date), '') AND event_type = OLD.event_type;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_events_hourly_update AFTER UPDATE OF date, event_type ON events
+BEGIN
+    UPDATE events_hourly SET count = count - 1
+    WHERE hour = COALESCE(strftime('%Y-%m-%d %H:00:00', OLD.date), '') AND event_type = OLD.event_type;
+    INSERT INTO events_hourly (hour, event_type, count)
+    VALUES (COALESCE(strftime('%Y-%m-%d %H:00:00', NEW.date), ''), NEW.event_type, 1)
+    ON CONFLICT (hour, event_type) DO UPDATE SET count = count + 1;
+END;
+
+-- Cambios de estado de nodos para /api/stream (compartido entre procesos de la API)
+CREATE TABLE IF NOT EXISTS node_status_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    node_id TEXT NOT NULL,
+    status TEXT,
+    date DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_node_status_log_insert AFTER INSERT ON registered_nodes
+BEGIN
+    INSERT INTO node_status_log (node_id, status) VALUES (NEW.node_id, NEW.status);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_node_status_log_update AFTER UPDATE OF status ON registered_nodes
+WHEN OLD.status IS NOT NEW.status
+BEGIN
+    INSERT INTO node_status_log (node_id, status) VALUES (NEW.node_id, NEW.status);
+END;
+
+-- Incidentes (bytefense-incident-response.py)
+CREATE TABLE IF NOT EXISTS incidents (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    description TEXT,
+    severity INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    source_ip TEXT,
+    target_ip TEXT,
+    attack_type TEXT,
+    indicators TEXT,
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL,
+    resolved_at DATETIME,
+    playbook_executed TEXT,
+    actions_taken TEXT,
+    analyst_notes TEXT
+);
+
+CREATE TABLE IF NOT EXISTS incident_timeline (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    incident_id INTEGER,
+    timestamp DATETIME NOT NULL,
+    action TEXT NOT NULL,
+    details TEXT,
+    automated BOOLEAN DEFAULT 1,
+    FOREIGN KEY (incident_id) REFERENCES incidents (id)
+);
+
+-- Análisis de malware y campañas (bytefense-intel-advanced.py)
+CREATE TABLE IF NOT EXISTS malware_analysis (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    hash_md5 TEXT,
+    hash_sha1 TEXT,
+    hash_sha256 TEXT,
+    file_type TEXT,
+    file_size INTEGER,
+    family TEXT,
+    analysis_date DATETIME,
+    sandbox_report TEXT,
+    yara_matches TEXT,
+    behavior TEXT
+);
+
+CREATE TABLE IF NOT EXISTS attack_campaigns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    description TEXT,
+    threat_actor TEXT,
+    start_date DATETIME,
+    end_date DATETIME,
+    indicators TEXT,
+    ttps TEXT,
+    targets TEXT,
+    active BOOLEAN DEFAULT 1
+);
 
 -- Insertar configuración inicial
 INSERT OR IGNORE INTO node_config (key, value) VALUES 